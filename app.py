@@ -4,17 +4,51 @@ Flask Web 服务器
 """
 
 import os
+
+import server
+
+# 以脚本运行时按 SERVER_MODE 选择运行模式（默认 eventlet）；
+# eventlet 的 monkey patch 必须在导入 requests、threading 等模块之前完成
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    server.configure(os.getenv('SERVER_MODE', server.SERVER_MODE_EVENTLET))
+
+import atexit
+import hmac
 import logging
-from flask import Flask, render_template, jsonify, request
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional
+from flask import Flask, Response, render_template, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO
 
 from config import load_config, update_config
 from models import Config, RuntimeState
+from history import DelayHistory
 from clash_api import ClashAPI
 from node_manager import NodeManager
 from delay_checker import DelayChecker
+from node_stats import NodeStatsTable
+from shadow import ShadowEvaluator
+from timeseries import TimeSeriesStore
+from probe_log import ProbeLog
+from warmstart import WarmStart
+from blacklist import parse_rule
 from storage import storage
+from response_cache import ResponseCache
+import payload
+import wiring
+from blocking import run_blocking
+from probe_pool import ProbePool, ProbePoolFull
+import profiler
+from broadcaster import Broadcaster, TOPIC_HISTORY, TOPIC_PROBES, TOPIC_STATE
+from events import CheckCompletedEvent, ConfigChangedEvent, EventBus, NodesChangedEvent, ProbeEvent, SwitchEvent
+from discovery import ControllerDiscovery, PROBE_TIMEOUT
 
 # 配置日志
 log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -32,29 +66,77 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.info(f"日志级别: {log_level}")
 
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON 提供者：jsonify 输出紧凑、不排序键的 UTF-8 JSON，安装了 orjson 时使用 orjson
+
+    日期、dataclass 等 orjson 原生支持的类型仍交给 Flask 的默认转换，保证两种编码器输出一致；
+    调试模式下仍输出缩进格式。
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs) -> str:
+        if payload.orjson and not kwargs:
+            return payload.dumps_with_default(obj, self.default).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        if self._app.debug:
+            return super().response(obj)
+        return self._app.response_class(payload.dumps_with_default(obj, self.default), mimetype=self.mimetype)
+
+
 # 创建 Flask 应用
 app = Flask(__name__,
             static_folder='static',
             template_folder='templates')
 app.config['SECRET_KEY'] = 'clash-auto-switch-secret-key'
+# jsonify 输出紧凑的 UTF-8 JSON（安装了 orjson 时使用 orjson）
+app.json = JSONProvider(app)
 
 # 启用 CORS
 CORS(app)
 
-# 创建 SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")
+# 创建 SocketIO（作为模块导入时，例如测试，使用线程模式）
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=server.async_mode())
 
 # 全局对象
 config: Config = load_config()
-state = RuntimeState()
+state = RuntimeState(delay_history=DelayHistory(per_node_capacity=config.history_capacity))
 clash_api: ClashAPI = None
 node_manager: NodeManager = None
 delay_checker: DelayChecker = None
-
-
-def initialize():
-    """初始化服务"""
-    global clash_api, node_manager, delay_checker
+shadow_evaluator: ShadowEvaluator = None
+node_stats: NodeStatsTable = None
+history_store: TimeSeriesStore = None
+probe_log: ProbeLog = None
+warm_start: WarmStart = None
+probe_pool: ProbePool = None
+event_bus: EventBus = None
+discovery: ControllerDiscovery = None
+
+# Socket.IO 推送（合并窗口内的更新只发送一次，在后台任务中发送）
+broadcaster = Broadcaster(socketio, state.snapshot,
+                          window=config.broadcast_window_ms / 1000,
+                          queue_size=config.broadcast_queue_size)
+
+# /api/nodes、/api/regions 的响应缓存
+response_cache = ResponseCache()
+# 带 ETag 的大响应的压缩结果
+compression_cache = payload.CompressionCache()
+
+
+def initialize(start_checker: bool = False):
+    """初始化服务
+
+    只加载本地状态、创建不依赖 Clash 的组件，立即返回；Controller 在后台发现，
+    可用后由 attach_controller 创建节点管理器和延迟检测器（start_checker 为 True 时随后自动启动检测）。
+    需要等待 Controller 时调用 discovery.wait()。
+    """
+    global clash_api, node_stats, history_store, probe_log, event_bus, discovery
 
     try:
         # 从持久化存储加载配置
@@ -63,49 +145,71 @@ def initialize():
         # 从持久化存储加载黑名单
         saved_blacklist = storage.load_blacklist()
         state.blacklist = saved_blacklist
+        state.blacklist_rules = storage.load_blacklist_rules()
 
         logger.info(f"从存储加载配置: 延迟阈值={config.delay_threshold}ms, 区域={config.locked_region or '未设置'}")
         logger.info(f"从存储加载黑名单: {len(state.blacklist)} 个节点")
 
+        # 退出前写入尚未落盘的配置和黑名单
+        atexit.register(storage.close)
+
+        # 事件总线：各组件发布探测、切换、检测周期和配置事件，订阅者在各自的工作线程中处理
+        if event_bus:
+            event_bus.close()
+        event_bus = EventBus()
+
         # 创建 Clash API 客户端
-        clash_api = ClashAPI(config)
-
-        # 检查 Clash API 是否可用
-        if not clash_api.is_available():
-            logger.error("无法连接到 Clash API，请确保 Clash 正在运行")
-            logger.warning("服务将以只读模式启动，无法进行节点切换")
-
-        # 创建节点管理器和延迟检测器（仅当Clash可用时）
-        if clash_api.is_available():
-            # 创建节点管理器
-            node_manager = NodeManager(clash_api, config, state)
-            # 创建延迟检测器
-            delay_checker = DelayChecker(clash_api, node_manager, config, state)
-            # 添加状态变化回调
-            delay_checker.add_callback(notify_state_update)
-        else:
-            node_manager = None
-            delay_checker = None
+        clash_api = ClashAPI(config, events=event_bus)
+
+        # 节点统计表，由每次探测结果更新（直接在探测线程中更新，检测周期随后的预测判断要读到本次结果）
+        node_stats = NodeStatsTable(window=config.predict_window, failure_value=config.test_timeout)
+        event_bus.subscribe(ProbeEvent, lambda event: node_stats.observe(event.node, event.delay),
+                            name='node_stats', inline=True)
+        # 节点消失或内容变化后丢弃其统计（在发布者线程中处理，先于随后的优先探测）
+        event_bus.subscribe(NodesChangedEvent, lambda event: node_stats.forget(event.removed + event.changed),
+                            name='node_stats.churn', inline=True)
+
+        # 长期延迟时序存储，每次探测结果都批量写入
+        if config.enable_history_store and history_store is None:
+            history_store = TimeSeriesStore(
+                raw_retention_days=config.history_raw_retention_days,
+                minute_retention_days=config.history_minute_retention_days,
+                hour_retention_days=config.history_hour_retention_days
+            )
+            history_store.start()
+            atexit.register(history_store.stop)
+        if history_store:
+            event_bus.subscribe(ProbeEvent, lambda event: history_store.record(event.node, event.delay, event.timestamp),
+                                name='history_store')
+
+        # 探测日志，长期保存每一次探测的原始结果
+        if config.enable_probe_log and probe_log is None:
+            probe_log = ProbeLog(retention_days=config.probe_log_retention_days)
+            atexit.register(probe_log.close)
+        if probe_log is not None:
+            event_bus.subscribe(ProbeEvent, lambda event: probe_log.append(event.node, event.delay, event.timestamp),
+                                name='probe_log')
+
+        # 向订阅 history 主题的客户端推送探测数据点，切换、检测周期结束和节点增删后推送状态
+        event_bus.subscribe(ProbeEvent, publish_history_point, name='broadcast.history')
+        event_bus.subscribe((SwitchEvent, CheckCompletedEvent, NodesChangedEvent), lambda event: notify_state_update(),
+                            name='broadcast.state')
+        broadcaster.start()
+        # 退出时先处理完积压的事件，再关闭存储（atexit 按注册的相反顺序执行）
+        atexit.register(event_bus.close)
 
         # 初始化活跃连接检测状态
         state.active_detection_enabled = config.enable_active_detection
 
-        # 获取初始状态（仅当Clash可用时）
-        if clash_api.is_available():
-            current_node = clash_api.get_current_proxy(config.proxy_group)
-            if current_node:
-                state.current_node = current_node
-
-            if node_manager:
-                available_nodes = node_manager.get_available_nodes()
-                state.available_nodes = available_nodes
-
-            logger.info("服务初始化成功")
-        else:
-            logger.warning("服务以只读模式启动，无法进行节点切换")
-            state.current_node = "未知"
-            state.available_nodes = []
-
+        # 不等待 Clash：在后台发现 Controller，可用后再创建节点管理器和延迟检测器
+        if discovery:
+            discovery.stop()
+        discovery = ControllerDiscovery(
+            lambda: clash_api.is_available(max_retries=1, timeout=PROBE_TIMEOUT),
+            lambda: attach_controller(start_checker)
+        )
+        discovery.start()
+        logger.info("服务初始化成功，正在后台连接 Clash Controller")
         return True
 
     except Exception as e:
@@ -113,12 +217,107 @@ def initialize():
         return False
 
 
+def attach_controller(start_checker: bool = False):
+    """Clash Controller 可用后创建节点管理器、延迟检测器等组件，获取初始状态
+
+    由后台的 Controller 发现在 Controller 首次可用时调用；抛出异常时发现线程退避后重试。
+    装配步骤与守护进程共用（见 wiring.attach_controller）；组件全部创建完成后才对外可见，
+    请求不会用到未初始化完的组件。
+    """
+    global node_manager, delay_checker, shadow_evaluator, warm_start, probe_pool
+
+    components = wiring.attach_controller(clash_api, config, state, node_stats, event_bus,
+                                          warm_start=warm_start)
+    manager = components.node_manager
+    checker = components.delay_checker
+    if components.warm_start is not warm_start:
+        atexit.register(components.warm_start.stop)
+    warm_start = components.warm_start
+    # 手动测速共用的有界探测池
+    if probe_pool:
+        probe_pool.shutdown()
+    probe_pool = ProbePool(manager.measure_node, workers=config.probe_workers)
+    atexit.register(probe_pool.shutdown)
+    shadow_evaluator = components.shadow_evaluator
+
+    node_manager = manager
+    delay_checker = checker
+    notify_state_update()
+    logger.info(f"已连接 Clash Controller: 当前节点 {state.current_node or '未知'}，"
+                f"可用节点 {len(state.available_nodes)} 个")
+
+    if start_checker:
+        checker.start()
+        logger.info("延迟检测已自动启动")
+
+
 def notify_state_update():
-    """通知客户端状态更新"""
-    try:
-        socketio.emit('state_update', state.to_dict())
-    except Exception as e:
-        logger.error(f"发送状态更新失败: {e}")
+    """通知客户端状态更新
+
+    只登记更新，由推送后台任务在合并窗口结束后发送：订阅 state 主题的客户端先收到一次
+    完整快照（state_snapshot），之后只收到相对自己已收到版本的增量（state_delta）；
+    状态版本未变化时不发送。
+    """
+    broadcaster.publish_state()
+
+
+def publish_history_point(event: ProbeEvent):
+    """推送延迟数据点，客户端来不及接收时同一节点只保留最新一条"""
+    broadcaster.publish(TOPIC_HISTORY, 'history_point', {
+        'node_name': event.node,
+        'delay': event.delay,
+        'timestamp': event.timestamp
+    }, key=event.node)
+
+
+def publish_config_changed(changes: Dict):
+    """发布配置变更事件"""
+    if event_bus and changes:
+        event_bus.publish(ConfigChangedEvent(changes, time.time()))
+
+
+def conditional_json(body: bytes, etag: str) -> Response:
+    """带强 ETag 的 JSON 响应，请求的 If-None-Match 匹配时返回 304"""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # 允许浏览器缓存，但每次使用前都要重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """按 Accept-Encoding 压缩较大的响应（br / gzip）
+
+    带 ETag 的响应按编码区分 ETag（同一内容的不同编码是不同的表示），在压缩前重新检查
+    If-None-Match，压缩结果按 ETag 缓存，内容未变化时不重复压缩。
+    """
+    if response.direct_passthrough or response.mimetype not in payload.COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+
+    body = response.get_data()
+    if len(body) < payload.COMPRESS_MIN_SIZE:
+        return response
+    encoding = payload.negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    if etag:
+        etag = f"{etag}-{encoding}"
+        response.set_etag(etag, weak)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+        body = compression_cache.get(etag, encoding, body)
+    else:
+        body = payload.compress(body, encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 
 # ========== 路由 ==========
@@ -134,7 +333,15 @@ def index():
 @app.route('/api/state', methods=['GET'])
 def get_state():
     """获取当前状态"""
-    return jsonify(state.to_dict())
+    # 快照的 JSON 和 ETag 按状态版本缓存，状态未变化时不重复序列化，客户端可用 If-None-Match 得到 304
+    snapshot = state.snapshot()
+    return conditional_json(snapshot.to_json(), snapshot.etag)
+
+
+@app.route('/api/controller', methods=['GET'])
+def get_controller_status():
+    """获取 Clash Controller 连接状态（后台发现的进度、探测次数和最近的错误）"""
+    return jsonify({'success': True, 'controller': discovery.status() if discovery else None})
 
 
 @app.route('/api/config', methods=['GET'])
@@ -150,6 +357,7 @@ def update_config_api():
         data = request.json
         global config
         config = update_config(config, **data)
+        publish_config_changed({key: value for key, value in data.items() if hasattr(config, key)})
 
         # 保存配置到文件
         if storage.save_config(config):
@@ -215,6 +423,8 @@ def smart_config():
         else:
             return jsonify({'success': False, 'error': '无效的检测方法，必须是 api、traffic 或 none'}), 400
 
+    publish_config_changed({key: getattr(config, key) for key in data if hasattr(config, key)})
+
     # 保存配置到文件
     storage.save_config(config)
 
@@ -223,38 +433,108 @@ def smart_config():
 
 # ========== API: 节点管理 ==========
 
+# /api/nodes 分页参数
+NODES_PAGE_SIZE = 50
+NODES_MAX_PAGE_SIZE = 500
+NODE_SORT_KEYS = ('name', 'delay')
+# 单节点测速在探测池中排队的最长等待时间(秒)，另加测速本身的超时
+NODE_TEST_QUEUE_WAIT = 30
+
+
+def query_nodes(nodes: List[str], latest: Dict[str, Optional[int]], search: str = '', sort: str = '',
+                descending: bool = False, page: int = 1, page_size: int = NODES_PAGE_SIZE) -> Dict:
+    """对节点列表搜索、排序并分页
+
+    按延迟排序时使用最近一次探测结果，没有结果（未探测或失败）的节点始终排在最后。
+    page_size 为 0 时不分页，返回全部匹配的节点。
+    """
+    if search:
+        search = search.lower()
+        nodes = [node for node in nodes if search in node.lower()]
+
+    if sort == 'name':
+        nodes = sorted(nodes, reverse=descending)
+    elif sort == 'delay':
+        measured = sorted((node for node in nodes if latest.get(node) is not None),
+                          key=latest.get, reverse=descending)
+        nodes = measured + [node for node in nodes if latest.get(node) is None]
+
+    total = len(nodes)
+    if page_size <= 0:
+        page_size = max(total, 1)
+    pages = max(1, -(-total // page_size))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * page_size
+    return {
+        'items': [{'name': node, 'delay': latest.get(node)} for node in nodes[start:start + page_size]],
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'pages': pages
+    }
+
+
 @app.route('/api/nodes', methods=['GET'])
 def get_nodes():
-    """获取所有节点"""
+    """获取所有节点
+
+    查询参数: region 区域（默认使用锁定区域）。带 page/page_size/q/sort/order 任一参数时只返回一页
+    （items 含最近延迟），q 按名称搜索，sort 为 name 或 delay，order 为 asc 或 desc，
+    page_size=0 返回全部匹配的节点（供前端虚拟列表一次获取）；
+    format=columnar 时 items 为列式 {"name": [...], "delay": [...]}；
+    否则返回完整的 all_nodes 和 filtered_nodes。
+    响应按节点列表指纹、当前节点、黑名单和查询参数缓存，带 ETag，未变化时返回 304。
+    """
     try:
         if not node_manager:
             return jsonify({'success': False, 'error': '服务未初始化'}), 500
 
-        # 获取查询参数
-        region = request.args.get('region', '')
-
-        # 临时保存当前配置
-        original_region = config.locked_region
-
-        # 如果提供了 region 参数，临时修改配置
-        if region:
-            config.locked_region = region
-
-        if not node_manager:
-            return jsonify({'success': False, 'error': 'Clash API 不可用，无法获取节点'}), 500
-
-        all_nodes = node_manager.get_available_nodes()
-        filtered_nodes = node_manager.filter_nodes()
-
-        # 恢复原始配置
-        config.locked_region = original_region
-
-        return jsonify({
-            'success': True,
-            'all_nodes': all_nodes,
-            'filtered_nodes': filtered_nodes,
-            'current_node': state.current_node
-        })
+        # 获取查询参数（不修改全局配置，检测周期可能正在使用它）
+        region = request.args.get('region', '') or config.locked_region
+        paged = any(name in request.args for name in ('page', 'page_size', 'q', 'sort', 'order', 'format'))
+        columnar = request.args.get('format') == payload.FORMAT_COLUMNAR
+        search = request.args.get('q', '').strip()
+        sort = request.args.get('sort', '')
+        if sort and sort not in NODE_SORT_KEYS:
+            return jsonify({'success': False, 'error': f'sort 必须是 {" 或 ".join(NODE_SORT_KEYS)}'}), 400
+        descending = request.args.get('order', 'asc') == 'desc'
+        page = request.args.get('page', 1, type=int)
+        page_size = request.args.get('page_size', NODES_PAGE_SIZE, type=int)
+        page_size = 0 if page_size <= 0 else min(page_size, NODES_MAX_PAGE_SIZE)
+
+        snapshot = clash_api.proxies_snapshot(config.proxies_cache_seconds)
+        key = (snapshot.fingerprint if snapshot else None, region, state.current_node,
+               state.blacklist, state.blacklist_matcher())
+        if paged:
+            # 分页结果包含最近延迟，任一节点有新的探测结果即失效
+            key += (search, sort, descending, page, page_size, columnar,
+                    node_stats.observations if node_stats else 0)
+
+        def build():
+            all_nodes = node_manager.get_available_nodes(config.proxies_cache_seconds)
+            filtered_nodes = node_manager.select_nodes(all_nodes, region)
+            if not paged:
+                return {
+                    'success': True,
+                    'all_nodes': all_nodes,
+                    'filtered_nodes': filtered_nodes,
+                    'current_node': state.current_node
+                }
+            latest = node_stats.latest_delays() if node_stats else {}
+            result = query_nodes(filtered_nodes, latest, search, sort, descending, page, page_size)
+            if columnar:
+                result['items'] = payload.columnar(result['items'], ('name', 'delay'))
+            return {
+                'success': True,
+                'current_node': state.current_node,
+                'all_count': len(all_nodes),
+                **result
+            }
+
+        if snapshot is None:
+            # 获取失败的结果不缓存
+            return jsonify(build())
+        return conditional_json(*response_cache.get('nodes_page' if paged else 'nodes', key, build))
     except Exception as e:
         logger.error(f"获取节点列表失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -273,8 +553,8 @@ def switch_node():
         if not node_manager:
             return jsonify({'success': False, 'error': '服务未初始化'}), 500
 
+        # 切换结果以 SwitchEvent 发布，由事件订阅者推送状态
         success = node_manager.switch_to_node(node_name)
-        notify_state_update()
 
         if success:
             return jsonify({'success': True, 'message': f'已切换到节点: {node_name}'})
@@ -288,7 +568,7 @@ def switch_node():
 
 @app.route('/api/nodes/test', methods=['POST'])
 def test_node():
-    """测试节点延迟"""
+    """测试节点延迟（与批量测试共用探测池，排队已满时返回 429）"""
     try:
         data = request.json
         node_name = data.get('node_name')
@@ -296,53 +576,125 @@ def test_node():
         if not node_name:
             return jsonify({'success': False, 'error': '节点名称不能为空'}), 400
 
-        if not clash_api:
+        if not probe_pool:
             return jsonify({'success': False, 'error': '服务未初始化'}), 500
 
-        delay = clash_api.get_delay(
-            node_name,
-            test_url=config.test_url,
-            timeout=config.test_timeout
-        )
+        timeout = config.test_timeout / 1000 * max(1, config.probe_samples) + NODE_TEST_QUEUE_WAIT
+        delay = probe_pool.submit(node_name).result(timeout=timeout)
 
         if delay is not None:
             return jsonify({'success': True, 'node_name': node_name, 'delay': delay})
         else:
             return jsonify({'success': False, 'error': '测试失败'}), 500
 
+    except ProbePoolFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+    except FutureTimeoutError:
+        return jsonify({'success': False, 'error': '测试超时'}), 504
     except Exception as e:
         logger.error(f"测试节点延迟失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/nodes/test/batch', methods=['POST'])
+def test_nodes_batch():
+    """批量测试节点延迟
+
+    请求体: {"nodes": [节点名...]} 指定节点，或 {"region": 区域, "q": 搜索词} 按条件选择
+    （均为空时测试锁定区域内未被拉黑的全部节点）；可选 "sid" 为 Socket.IO 连接 ID，只向该客户端推送。
+    立即返回批次 ID，测试在共用的探测池中并发进行，每个节点完成时向订阅 probes 主题的客户端
+    推送 probe_result，全部完成后推送 probe_batch_done。
+    """
+    try:
+        if not node_manager or not probe_pool:
+            return jsonify({'success': False, 'error': '服务未初始化'}), 500
+
+        data = request.json or {}
+        nodes = data.get('nodes')
+        if nodes is None:
+            region = data.get('region', '') or config.locked_region
+            nodes = node_manager.select_nodes(node_manager.get_available_nodes(config.proxies_cache_seconds), region)
+            search = (data.get('q') or '').strip().lower()
+            if search:
+                nodes = [node for node in nodes if search in node.lower()]
+        elif not isinstance(nodes, list) or not all(isinstance(node, str) for node in nodes):
+            return jsonify({'success': False, 'error': 'nodes 必须是节点名列表'}), 400
+
+        sid = data.get('sid')
+
+        def on_result(batch_id, node, delay, completed, total):
+            broadcaster.publish(TOPIC_PROBES, 'probe_result', {
+                'batch_id': batch_id,
+                'node_name': node,
+                'delay': delay,
+                'completed': completed,
+                'total': total
+            }, to=sid)
+
+        def on_done(batch_id, summary):
+            logger.info(f"批量测速 {batch_id} 完成: 成功 {summary['succeeded']}/{summary['total']}，"
+                        f"耗时 {summary['elapsed']:.1f}s")
+            broadcaster.publish(TOPIC_PROBES, 'probe_batch_done', {'batch_id': batch_id, **summary}, to=sid)
+
+        batch_id = probe_pool.run_batch(nodes, on_result, on_done)
+        return jsonify({'success': True, 'batch_id': batch_id, 'total': len(set(nodes))}), 202
+    except ProbePoolFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+    except Exception as e:
+        logger.error(f"批量测速失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ========== API: 黑名单 ==========
 
 @app.route('/api/blacklist', methods=['GET'])
 def get_blacklist():
     """获取黑名单"""
-    return jsonify({'success': True, 'blacklist': list(state.blacklist)})
+    return jsonify({
+        'success': True,
+        'blacklist': list(state.blacklist),
+        'rules': [rule.to_dict() for rule in state.blacklist_rules if not rule.expired()]
+    })
 
 
 @app.route('/api/blacklist', methods=['POST'])
 def add_blacklist():
-    """添加黑名单"""
+    """添加黑名单
+
+    请求体: {"node_name": 节点名} 添加精确节点；{"pattern": "glob:HK*" 或规则内容, "type": 可选类型}
+    添加规则（类型: exact/glob/regex/keyword，也可用 glob:/re:/kw: 前缀）；
+    可选 "ttl_minutes" 使条目到期自动失效
+    """
     try:
         data = request.json
         node_name = data.get('node_name')
+        pattern = data.get('pattern')
+        ttl_minutes = data.get('ttl_minutes')
 
-        if not node_name:
+        if not node_name and not pattern:
             return jsonify({'success': False, 'error': '节点名称不能为空'}), 400
 
         if not node_manager:
             return jsonify({'success': False, 'error': 'Clash API 不可用，无法操作节点'}), 500
 
-        success = node_manager.add_blacklist(node_name)
+        if pattern or ttl_minutes:
+            # 规则或临时条目
+            try:
+                ttl_seconds = float(ttl_minutes) * 60 if ttl_minutes else None
+                rule = parse_rule(pattern or node_name, ttl_seconds, kind=data.get('type') or (None if pattern else 'exact'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            success = node_manager.add_blacklist_rule(rule)
+            message = f'已添加黑名单规则: {rule.key}'
+        else:
+            success = node_manager.add_blacklist(node_name)
+            message = f'已添加到黑名单: {node_name}'
 
         if success:
             # 保存黑名单到文件
-            storage.save_blacklist(state.blacklist)
+            storage.save_blacklist(state.blacklist, state.blacklist_rules)
             notify_state_update()
-            return jsonify({'success': True, 'message': f'已添加到黑名单: {node_name}'})
+            return jsonify({'success': True, 'message': message})
         else:
             return jsonify({'success': False, 'error': '添加失败'}), 500
 
@@ -353,24 +705,31 @@ def add_blacklist():
 
 @app.route('/api/blacklist', methods=['DELETE'])
 def remove_blacklist():
-    """移除黑名单"""
+    """移除黑名单
+
+    请求体: {"node_name": 节点名} 或 {"rule": 规则标识（类型:内容）}
+    """
     try:
         data = request.json
         node_name = data.get('node_name')
+        rule_key = data.get('rule')
 
-        if not node_name:
+        if not node_name and not rule_key:
             return jsonify({'success': False, 'error': '节点名称不能为空'}), 400
 
         if not node_manager:
             return jsonify({'success': False, 'error': 'Clash API 不可用，无法操作节点'}), 500
 
-        success = node_manager.remove_blacklist(node_name)
+        if rule_key:
+            success = node_manager.remove_blacklist_rule(rule_key)
+        else:
+            success = node_manager.remove_blacklist(node_name)
 
         if success:
             # 保存黑名单到文件
-            storage.save_blacklist(state.blacklist)
+            storage.save_blacklist(state.blacklist, state.blacklist_rules)
             notify_state_update()
-            return jsonify({'success': True, 'message': f'已从黑名单移除: {node_name}'})
+            return jsonify({'success': True, 'message': f'已从黑名单移除: {rule_key or node_name}'})
         else:
             return jsonify({'success': False, 'error': '移除失败'}), 500
 
@@ -428,6 +787,104 @@ def check_now():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# ========== API: 节点统计 ==========
+
+@app.route('/api/stats', methods=['GET'])
+def get_node_stats():
+    """获取节点统计（窗口 p90、趋势等）"""
+    if not node_stats:
+        return jsonify({'success': False, 'error': '服务未初始化'}), 500
+
+    return jsonify({'success': True, 'stats': node_stats.to_dict()})
+
+
+# ========== API: 历史数据 ==========
+
+# 未指定 step 时，查询结果的最大点数
+HISTORY_MAX_POINTS = 500
+
+
+def _parse_time(value: str, default: float) -> float:
+    """解析时间参数：epoch 秒或 ISO 格式"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """查询节点的延迟历史
+
+    参数: node（必填，缺省时返回有记录的节点列表）、from/to（epoch 秒或 ISO 时间，默认最近 24 小时）、
+    step（聚合粒度秒数，0 表示原始记录；默认自动选择 1 分钟或 1 小时的整数倍）、
+    format=columnar（points 为列式 {"t": [...], "delay": [...], ...}）。
+    未启用长期时序存储时从内存中每个节点最近 HISTORY_CAPACITY 条记录查询（只有原始记录，忽略 step）。
+    """
+    try:
+        node = request.args.get('node', '')
+        if not node:
+            nodes = history_store.nodes() if history_store else state.history_nodes()
+            return jsonify({'success': True, 'nodes': nodes})
+
+        end = _parse_time(request.args.get('to'), time.time())
+        start = _parse_time(request.args.get('from'), end - 86400)
+        if start >= end:
+            return jsonify({'success': False, 'error': 'from 必须早于 to'}), 400
+
+        if not history_store:
+            points = state.node_history(node, start, end)
+            if request.args.get('format') == payload.FORMAT_COLUMNAR:
+                points = payload.columnar(points, ('t', 'delay'))
+            return jsonify({
+                'success': True,
+                'node': node,
+                'from': start,
+                'to': end,
+                'step': 0,
+                'source': 'memory',
+                'points': points
+            })
+
+        if request.args.get('step'):
+            step = int(request.args['step'])
+        else:
+            # 自动选择粒度，保证点数不超过上限并能直接命中汇总表
+            raw_step = (end - start) / HISTORY_MAX_POINTS
+            unit = 3600 if raw_step > 3600 else 60
+            step = max(1, -(-int(raw_step) // unit)) * unit
+
+        points = history_store.query(node, start, end, step)
+        if request.args.get('format') == payload.FORMAT_COLUMNAR:
+            points = payload.columnar(points)
+        return jsonify({
+            'success': True,
+            'node': node,
+            'from': start,
+            'to': end,
+            'step': step,
+            'points': points
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'参数错误: {e}'}), 400
+    except Exception as e:
+        logger.error(f"查询延迟历史失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ========== API: 影子策略 ==========
+
+@app.route('/api/shadow', methods=['GET'])
+def get_shadow_report():
+    """获取影子策略评估报告"""
+    if not shadow_evaluator:
+        return jsonify({'success': False, 'error': '未配置影子策略 (SHADOW_POLICIES)'}), 404
+
+    return jsonify({'success': True, 'policies': shadow_evaluator.report()})
+
+
 # ========== API: 区域 ==========
 
 @app.route('/api/regions', methods=['GET'])
@@ -437,49 +894,164 @@ def get_regions():
         if not node_manager:
             return jsonify({'success': False, 'error': '服务未初始化'}), 500
 
-        regions = node_manager.get_all_regions()
-        return jsonify({'success': True, 'regions': regions})
+        snapshot = clash_api.proxies_snapshot(config.proxies_cache_seconds)
+        if snapshot is None:
+            # Clash 不可用时使用缓存的区域索引
+            return jsonify({'success': True, 'regions': node_manager.get_all_regions()})
+
+        def build():
+            return {'success': True, 'regions': node_manager.get_all_regions(config.proxies_cache_seconds)}
+
+        return conditional_json(*response_cache.get('regions', snapshot.fingerprint, build))
     except Exception as e:
         logger.error(f"获取区域列表失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# ========== API: 管理（剖析与诊断） ==========
+
+def require_admin(view):
+    """管理接口鉴权：请求头 Authorization: Bearer <ADMIN_TOKEN> 或 X-Admin-Token；未设置 ADMIN_TOKEN 时不可用"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_token = os.getenv('ADMIN_TOKEN', '')
+        if not admin_token:
+            return jsonify({'success': False, 'error': '未启用管理接口 (ADMIN_TOKEN)'}), 404
+
+        token = request.headers.get('X-Admin-Token', '')
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+        if not hmac.compare_digest(token.encode('utf-8'), admin_token.encode('utf-8')):
+            return jsonify({'success': False, 'error': '管理令牌无效'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/api/admin/profile', methods=['POST'])
+@require_admin
+def admin_profile():
+    """剖析运行中的服务 N 秒
+
+    参数: seconds（默认 10，最长 60）；mode=sample（默认，采样所有线程的调用栈，返回折叠栈文本，
+    可用 flamegraph.pl / speedscope 打开；interval_ms 采样间隔，thread 只采样名称包含该字符串的线程）
+    或 mode=cprofile（用 cProfile 剖析检测周期和 Flask 请求处理；format=text 返回 pstats 报告，
+    sort / limit 控制排序和行数，format=pstats 返回可用 pstats / snakeviz 打开的二进制文件）
+    """
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), profiler.MAX_DURATION)
+        mode = request.args.get('mode', 'sample')
+        if mode not in ('sample', 'cprofile'):
+            return jsonify({'success': False, 'error': 'mode 必须是 sample 或 cprofile'}), 400
+
+        with profiler.session():
+            logger.info(f"开始剖析: {mode}, {seconds} 秒")
+            if mode == 'sample':
+                interval = float(request.args.get('interval_ms', profiler.DEFAULT_INTERVAL * 1000)) / 1000
+                # eventlet 模式下在原生线程中采样，采样间隔内不阻塞事件循环
+                counts, rounds = run_blocking(profiler.sample_stacks, seconds, interval,
+                                                     request.args.get('thread', ''))
+                response = Response(profiler.format_collapsed(counts), mimetype='text/plain')
+                response.headers['X-Profile-Samples'] = str(rounds)
+                return response
+
+            call_profiler = profiler.CallProfiler([
+                (delay_checker, '_check_and_switch'),
+                (app, 'full_dispatch_request')
+            ])
+            with call_profiler.installed():
+                time.sleep(seconds)
+            stats = call_profiler.stats()
+
+        if stats is None:
+            return Response('剖析期间没有检测周期或请求\n', mimetype='text/plain')
+        if request.args.get('format') == 'pstats':
+            return Response(profiler.dump_pstats(stats), mimetype='application/octet-stream',
+                            headers={'Content-Disposition': 'attachment; filename=profile.pstats'})
+        report = profiler.format_pstats(stats, request.args.get('sort', 'cumulative'),
+                                        int(request.args.get('limit', 50)))
+        return Response(f"剖析调用数: {call_profiler.calls}\n{report}", mimetype='text/plain')
+    except profiler.ProfilerBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'参数错误: {e}'}), 400
+    except Exception as e:
+        logger.error(f"剖析失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/admin/threads', methods=['GET'])
+@require_admin
+def admin_threads():
+    """导出所有线程（eventlet 模式下包括所有协程）的调用栈"""
+    return Response(profiler.dump_threads(), mimetype='text/plain')
+
+
 # ========== WebSocket ==========
 
 @socketio.on('connect')
 def handle_connect():
     """客户端连接"""
+    broadcaster.add_client(request.sid)
     logger.info('客户端已连接')
-    emit('state_update', state.to_dict())
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """客户端断开连接"""
+    broadcaster.remove_client(request.sid)
     logger.info('客户端已断开')
 
 
 @socketio.on('subscribe')
-def handle_subscribe():
-    """订阅状态更新"""
-    emit('state_update', state.to_dict())
+def handle_subscribe(data=None):
+    """订阅主题: {"topics": ["state", "history", "probes"]}，缺省为 state
+
+    订阅 state 时先推送一次完整快照，之后由 notify_state_update 推送增量。
+    """
+    topics = (data or {}).get('topics') or [TOPIC_STATE]
+    return {'topics': broadcaster.subscribe(request.sid, topics)}
+
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data=None):
+    """取消订阅主题: {"topics": [...]}"""
+    broadcaster.unsubscribe(request.sid, (data or {}).get('topics') or [])
+
+
+@app.route('/api/events', methods=['GET'])
+def get_event_stats():
+    """获取事件总线各订阅者的积压、丢弃和处理延迟"""
+    return jsonify({'success': True, 'subscribers': event_bus.stats() if event_bus else []})
+
+
+@app.route('/api/broadcast', methods=['GET'])
+def get_broadcast_stats():
+    """获取 Socket.IO 推送统计（客户端数、各主题订阅数、被替换和丢弃的消息数）"""
+    return jsonify({'success': True, 'broadcast': broadcaster.stats()})
+
+
+def disconnect_clients():
+    """断开所有 Socket.IO 客户端
+
+    不等待客户端取走关闭消息（eio.disconnect 会等待，已离开但尚未超时的会话会一直阻塞）。
+    """
+    for client in list(socketio.server.eio.sockets.values()):
+        client.close(wait=False)
 
 
 # ========== 主程序 ==========
 
 def main():
     """主函数"""
-    # 初始化服务
-    if not initialize():
-        logger.error("初始化失败，请检查 Clash 是否正在运行")
-        return
+    # docker stop 发送 SIGTERM，转换为正常退出以执行 atexit（写入待保存数据、关闭存储）；
+    # 退出前断开所有 Socket.IO 客户端，否则服务器会一直等待长轮询和 WebSocket 请求结束
+    server.install_exit_handler(on_exit=disconnect_clients)
 
-    # 自动启动延迟检测（仅当可用时）
-    if delay_checker:
-        delay_checker.start()
-        logger.info("延迟检测已自动启动")
-    else:
-        logger.warning("Clash API 不可用，跳过延迟检测启动")
+    # 初始化服务（Clash 在后台发现，连接后自动启动延迟检测）
+    if not initialize(start_checker=True):
+        logger.error("初始化失败")
+        return
 
     # 获取配置
     host = os.getenv('FLASK_HOST', '127.0.0.1')
@@ -489,7 +1061,12 @@ def main():
     logger.info(f"Web 界面: http://{host}:{port}")
 
     # 启动服务器
-    socketio.run(app, host=host, port=port, debug=debug, allow_unsafe_werkzeug=True)
+    if server.async_mode() == server.SERVER_MODE_EVENTLET:
+        logger.info("运行模式: eventlet（生产）")
+        socketio.run(app, host=host, port=port, debug=debug, use_reloader=False, log_output=debug)
+    else:
+        logger.info("运行模式: threading（Werkzeug 开发服务器，仅用于开发调试）")
+        socketio.run(app, host=host, port=port, debug=debug, allow_unsafe_werkzeug=True)
 
 
 if __name__ == '__main__':
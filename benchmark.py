@@ -0,0 +1,776 @@
+#!/usr/bin/env python3
+"""
+性能基准脚本
+在本地 Clash Controller 替身上运行，不需要真实的 Clash
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+# 替身 Controller 生成节点名时使用的区域前缀
+REGION_PREFIXES = ['香港 HK', '日本 JP', '新加坡 SG', '美国 US', '台湾 TW']
+
+
+class StandInController:
+    """本地 Clash Controller 替身
+
+    实现延迟检测用到的 RESTful 接口（/、/proxies、/proxies/{name}、/proxies/{name}/delay、
+    /connections），延迟按每个节点的真实基准值加随机噪声、尖峰和丢包生成，但不实际等待。
+    """
+
+    def __init__(self, nodes: int = 20, group: str = 'PROXY', seed: int = 0,
+                 noise: float = 0.25, spike_rate: float = 0.05, loss: float = 0.02,
+                 base_delays: List[int] = None):
+        self.group = group
+        self.noise = noise
+        self.spike_rate = spike_rate
+        self.loss = loss
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        if base_delays is None:
+            base_delays = [self._rng.randint(40, 400) for _ in range(nodes)]
+        self.true_delay: Dict[str, int] = {}
+        for i, base in enumerate(base_delays):
+            prefix = REGION_PREFIXES[i % len(REGION_PREFIXES)]
+            self.true_delay[f"{prefix}-{i + 1:02d}"] = base
+        self.current = next(iter(self.true_delay))
+
+        self.request_count = 0
+        self.handler_seconds = 0.0
+        self._servers: List[socketserver.BaseServer] = []
+
+    # ---------- 接口实现 ----------
+
+    def proxies(self) -> Dict:
+        """GET /proxies 的响应"""
+        proxies = {
+            name: {'name': name, 'type': 'Shadowsocks', 'udp': True, 'history': []}
+            for name in self.true_delay
+        }
+        proxies[self.group] = {
+            'name': self.group,
+            'type': 'Selector',
+            'now': self.current,
+            'all': list(self.true_delay)
+        }
+        proxies['DIRECT'] = {'name': 'DIRECT', 'type': 'Direct'}
+        return {'proxies': proxies}
+
+    def sample_delay(self, name: str, timeout: int) -> Optional[int]:
+        """生成一次延迟采样，None 表示超时"""
+        with self._lock:
+            if self._rng.random() < self.loss:
+                return None
+            delay = self.true_delay[name] * self._rng.lognormvariate(0, self.noise)
+            if self._rng.random() < self.spike_rate:
+                delay *= 3
+        delay = int(delay)
+        return delay if delay <= timeout else None
+
+    def handle(self, method: str, path: str, query: Dict, body: bytes):
+        """处理请求，返回 (状态码, JSON 对象)"""
+        parts = [unquote(p) for p in path.strip('/').split('/') if p]
+        if not parts:
+            return 200, {'hello': 'clash'}
+        if parts == ['proxies']:
+            return 200, self.proxies()
+        if parts == ['connections']:
+            return 200, {'connections': [], 'downloadTotal': 0, 'uploadTotal': 0}
+        if parts[0] == 'proxies' and len(parts) == 3 and parts[2] == 'delay':
+            name = parts[1]
+            if name not in self.true_delay:
+                return 404, {'message': 'resource not found'}
+            timeout = int(query.get('timeout', ['5000'])[0])
+            delay = self.sample_delay(name, timeout)
+            if delay is None:
+                return 504, {'message': 'Timeout'}
+            return 200, {'delay': delay}
+        if parts[0] == 'proxies' and len(parts) == 2:
+            name = parts[1]
+            if method == 'PUT':
+                target = json.loads(body or b'{}').get('name')
+                if target not in self.true_delay:
+                    return 400, {'message': 'proxy not exist'}
+                self.current = target
+                return 204, None
+            return 200, self.proxies()['proxies'].get(name, {})
+        return 404, {'message': 'resource not found'}
+
+    # ---------- HTTP 服务 ----------
+
+    def _make_handler(self, tcp: bool = True):
+        controller = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # TCP_NODELAY 只适用于 TCP 套接字
+            disable_nagle_algorithm = tcp
+
+            def _serve(self):
+                started = time.thread_time()
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload = controller.handle(self.command, parsed.path, parse_qs(parsed.query), body)
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if data:
+                    self.wfile.write(data)
+                with controller._lock:
+                    controller.request_count += 1
+                    controller.handler_seconds += time.thread_time() - started
+
+            do_GET = do_PUT = do_POST = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _serve(self, server: socketserver.BaseServer):
+        server.daemon_threads = True
+        # 客户端（被测服务）退出时断开的连接不打印异常
+        server.handle_error = lambda request, client_address: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._servers.append(server)
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """在后台线程启动，返回 base URL"""
+        server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._serve(server)
+        return f"http://{host}:{server.server_address[1]}"
+
+    def start_unix(self, path: str) -> str:
+        """在 Unix 域套接字上启动（可与 TCP 同时监听），返回 unix:// 形式的 CLASH_API_URL"""
+        if os.path.exists(path):
+            os.unlink(path)
+        self._serve(socketserver.ThreadingUnixStreamServer(path, self._make_handler(tcp=False)))
+        return f"unix://{path}"
+
+    def stop(self):
+        """停止服务"""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+            if isinstance(server, socketserver.UnixStreamServer) and os.path.exists(server.server_address):
+                os.unlink(server.server_address)
+        self._servers = []
+
+    def reset_counters(self):
+        """清零请求计数"""
+        with self._lock:
+            self.request_count = 0
+            self.handler_seconds = 0.0
+
+
+def _build_node_manager(base_url: str, **overrides):
+    """创建连接到替身 Controller 的 NodeManager"""
+    from clash_api import ClashAPI
+    from models import Config, RuntimeState
+    from node_manager import NodeManager
+
+    config = Config(clash_api_url=base_url, **overrides)
+    clash_api = ClashAPI(config)
+    return NodeManager(clash_api, config, RuntimeState())
+
+
+# ========== 基准: 多样本探测 ==========
+
+def bench_multi_sample(args) -> int:
+    """比较单样本与多样本探测的 Controller 开销和选路抖动"""
+    print("=" * 60)
+    print(f"多样本探测: {args.rounds} 轮选路，单样本 vs {args.samples} 样本")
+    print("=" * 60)
+
+    # 几个延迟相近的优质节点，加上若干较差节点，最容易出现来回切换
+    base_delays = [80, 95, 110, 130, 180, 250, 320]
+    controller = StandInController(base_delays=base_delays, seed=args.seed, noise=0.3)
+    base_url = controller.start()
+    best_true = min(base_delays)
+
+    print(f"{'模式':<12}{'请求/轮':>10}{'耗时/轮(ms)':>14}{'Controller CPU/轮(ms)':>24}"
+          f"{'选路变化':>10}{'平均多出(ms)':>14}")
+    try:
+        for samples in (1, args.samples):
+            node_manager = _build_node_manager(base_url, probe_samples=samples, rank_by=args.rank_by)
+            nodes = node_manager.get_available_nodes()
+            controller.reset_counters()
+
+            previous, flaps, regret = None, 0, 0
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                choice = node_manager.select_best_node(nodes)
+                if previous is not None and choice != previous:
+                    flaps += 1
+                previous = choice
+                regret += controller.true_delay[choice] - best_true
+            elapsed = time.perf_counter() - started
+
+            label = '单样本' if samples == 1 else f'{samples} 样本'
+            print(f"{label:<12}{controller.request_count / args.rounds:>10.1f}"
+                  f"{elapsed / args.rounds * 1000:>14.2f}"
+                  f"{controller.handler_seconds / args.rounds * 1000:>24.2f}"
+                  f"{flaps:>10}{regret / args.rounds:>14.1f}")
+    finally:
+        controller.stop()
+    return 0
+
+
+# ========== 基准: 探测日志扫描 ==========
+
+def _timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def bench_probe_log(args) -> int:
+    """生成大规模探测日志，测量时间范围查询和单节点扫描的速度"""
+    from probe_log import ProbeLog, STATUS_FAILED, STATUS_OK
+
+    print("=" * 60)
+    print(f"探测日志: {args.rows:,} 行, {args.nodes} 个节点, 采样间隔 {args.interval}s")
+    print("=" * 60)
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        log = ProbeLog(Path(directory), segment_rows=args.segment_rows)
+        node_ids = [log.node_id(f"{REGION_PREFIXES[i % len(REGION_PREFIXES)]}-{i + 1:04d}")
+                    for i in range(args.nodes)]
+
+        # 每个分段复用同一组节点/延迟/状态列，只有时间戳逐段递增，以便快速生成上亿行
+        chunk = min(args.segment_rows, args.rows)
+        nodes_column = array('I', (node_ids[i % args.nodes] for i in range(chunk)))
+        delays_column = array('i', (int(rng.lognormvariate(4.8, 0.4)) for _ in range(chunk)))
+        statuses_column = bytes(STATUS_FAILED if rng.random() < 0.02 else STATUS_OK for _ in range(chunk))
+        step = args.interval / args.nodes  # 所有节点轮流探测，相邻两行的时间差
+        start_ts = time.time() - args.rows * step
+
+        started = time.perf_counter()
+        written = 0
+        while written < args.rows:
+            n = min(chunk, args.rows - written)
+            base = start_ts + written * step
+            timestamps = array('d', (base + i * step for i in range(n)))
+            log.append_columns(timestamps, nodes_column[:n], delays_column[:n], statuses_column[:n])
+            written += n
+        log.flush()
+        elapsed = time.perf_counter() - started
+        size = sum(segment.path.stat().st_size for segment in log.segments)
+        print(f"写入: {elapsed:.1f}s（{args.rows / elapsed / 1e6:.1f}M 行/秒），"
+              f"{len(log.segments)} 个分段，{size / 1e9:.2f} GB")
+
+        end_ts = start_ts + args.rows * step
+        target = log.node_name(node_ids[args.nodes // 2])
+        queries = [
+            ('最近 1 小时（全部节点）', end_ts - 3600, end_ts, None),
+            ('最近 1 天（全部节点）', end_ts - 86400, end_ts, None),
+            ('全部范围（全部节点）', None, None, None),
+            ('最近 1 天（单节点）', end_ts - 86400, end_ts, target),
+            ('全部范围（单节点）', None, None, target),
+        ]
+        print(f"{'查询':<22}{'命中行数':>14}{'耗时(ms)':>12}{'扫描速度(M 行/秒)':>20}")
+        for label, begin, end, node in queries:
+            summary, seconds = _timed(lambda: log.summary(begin, end, node))
+            scanned = log.summary(begin, end)['count'] if node else summary['count']
+            print(f"{label:<22}{summary['count']:>14,}{seconds * 1000:>12.1f}"
+                  f"{scanned / seconds / 1e6 if seconds else 0:>20.1f}")
+
+        # 对照：同样的数据以 JSON Lines 保存时，统计单节点需要逐行解析
+        sample = min(args.rows, 200000)
+        lines = [
+            json.dumps({'node_name': log.node_name(nodes_column[i % chunk]), 'delay': delays_column[i % chunk],
+                        'timestamp': start_ts + i * step}, ensure_ascii=False)
+            for i in range(sample)
+        ]
+        _, seconds = _timed(lambda: sum(1 for line in lines if json.loads(line)['node_name'] == target))
+        print(f"对照 JSON Lines 解析: {sample / seconds / 1e6:.2f}M 行/秒"
+              f"（按此速度扫描全部 {args.rows:,} 行约需 {args.rows / sample * seconds:.0f}s）")
+        log.close()
+    return 0
+
+
+def bench_payload(args) -> int:
+    """比较 /api/nodes、/api/history 响应在不同 JSON 编码器、列式编码和压缩下的体积与序列化耗时"""
+    import payload
+
+    rng = random.Random(args.seed)
+    names = [f"{REGION_PREFIXES[i % len(REGION_PREFIXES)]}-{i + 1:04d} 专线" for i in range(args.nodes)]
+    items = [{'name': name, 'delay': rng.randint(40, 400) if rng.random() > 0.05 else None} for name in names]
+    now = int(time.time())
+    points = [{'t': now - i * 60, 'count': 2, 'failures': 0, 'avg': rng.randint(40, 400),
+               'min': rng.randint(40, 100), 'max': rng.randint(100, 600)} for i in range(args.points)]
+    cases = [
+        ('节点列表', {'success': True, 'all_nodes': names, 'filtered_nodes': names}, None),
+        ('节点分页', {'success': True, 'items': items}, lambda d: {**d, 'items': payload.columnar(d['items'])}),
+        ('延迟历史', {'success': True, 'points': points}, lambda d: {**d, 'points': payload.columnar(d['points'])}),
+    ]
+
+    def flask_default(obj):
+        # 原先 jsonify 的输出：键排序、非 ASCII 字符转义
+        return json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    def encode_ms(encoder, obj):
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            encoder(obj)
+            timings.append(time.perf_counter() - started)
+        return _percentile(timings, 0.5) * 1000
+
+    print("=" * 60)
+    print(f"响应负载: {args.nodes} 个节点, {args.points} 个历史数据点, JSON 编码器 {payload.JSON_ENCODER}, "
+          f"压缩 {'/'.join(payload.ENCODINGS)}")
+    print("=" * 60)
+    print(f"{'数据':<10}{'编码':<18}{'序列化(ms)':>12}{'原始(KB)':>10}"
+          + ''.join(f"{encoding + '(KB)':>10}" for encoding in payload.ENCODINGS))
+    for label, data, to_columnar in cases:
+        variants = [('jsonify(原)', flask_default, data), (payload.JSON_ENCODER, payload.dumps, data)]
+        if to_columnar:
+            variants.append((f"{payload.JSON_ENCODER}+列式", payload.dumps, to_columnar(data)))
+        for name, encoder, obj in variants:
+            body = encoder(obj)
+            print(f"{label:<10}{name:<18}{encode_ms(encoder, obj):>12.2f}{len(body) / 1024:>10.1f}"
+                  + ''.join(f"{len(payload.compress(body, encoding)) / 1024:>10.1f}"
+                            for encoding in payload.ENCODINGS))
+    return 0
+
+
+# ========== 基准: Web 服务 ==========
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _launch_app(controller_url: str, mode: str, port: int) -> subprocess.Popen:
+    """以指定运行模式启动 app.py，不等待"""
+    env = dict(os.environ,
+               CLASH_API_URL=controller_url, SERVER_MODE=mode,
+               FLASK_HOST='127.0.0.1', FLASK_PORT=str(port), FLASK_DEBUG='False',
+               LOG_LEVEL='ERROR', CHECK_INTERVAL='3600',
+               ENABLE_HISTORY_STORE='false', ENABLE_WARM_START='false')
+    return subprocess.Popen([sys.executable, str(Path(__file__).with_name('app.py'))], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _poll(url: str, ready, timeout: float, interval: float = 0.02) -> Optional[float]:
+    """轮询 url 直到 ready(响应) 为真，返回此时的 perf_counter，超时返回 None"""
+    import requests
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.get(url, timeout=1)
+            if response.ok and ready(response):
+                return time.perf_counter()
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    return None
+
+
+def _controller_connected(response) -> bool:
+    controller = response.json().get('controller')
+    return bool(controller) and controller['state'] == 'connected'
+
+
+def _start_app(controller_url: str, mode: str, port: int) -> subprocess.Popen:
+    """以指定运行模式启动 app.py，等待 /api/state 可用且已连接 Controller"""
+    process = _launch_app(controller_url, mode, port)
+    base_url = f"http://127.0.0.1:{port}"
+    if (_poll(f"{base_url}/api/state", lambda response: True, 30, interval=0.2) is None
+            or _poll(f"{base_url}/api/controller", _controller_connected, 30, interval=0.2) is None):
+        process.kill()
+        raise RuntimeError(f"app.py（{mode}）启动超时")
+    return process
+
+
+def _measure_state_throughput(base_url: str, clients: int, duration: float) -> Dict:
+    """clients 个保持连接的客户端并发请求 /api/state"""
+    import requests
+
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                session.get(f"{base_url}/api/state", timeout=10).raise_for_status()
+                local.append(time.perf_counter() - started)
+            except requests.RequestException:
+                errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {'requests': len(latencies), 'errors': errors[0], 'rps': len(latencies) / elapsed,
+            'p50': _percentile(latencies, 0.5), 'p99': _percentile(latencies, 0.99)}
+
+
+def _measure_fanout(base_url: str, clients: int, rounds: int) -> Dict:
+    """连接 clients 个 Socket.IO 客户端，切换检测器状态触发广播，测量送达全部客户端的延迟"""
+    import requests
+    import socketio
+
+    # 服务端关闭时客户端会记录大量连接错误，基准中不需要
+    quiet = logging.getLogger('benchmark.socketio')
+    quiet.disabled = True
+
+    arrivals: List[List[float]] = [[] for _ in range(clients)]
+    connected = []
+    for i in range(clients):
+        client = socketio.Client(reconnection=False, logger=quiet, engineio_logger=quiet)
+        client.on('state_delta', lambda data, slot=arrivals[i]: slot.append(time.perf_counter()))
+        client.on('state_snapshot', lambda data, slot=arrivals[i]: slot.append(time.perf_counter()))
+        try:
+            client.connect(base_url, transports=['polling'], wait_timeout=10)
+            # 服务端只向订阅了 state 主题的客户端推送，等待订阅确认后再开始测量
+            client.call('subscribe', {'topics': ['state']}, timeout=10)
+            connected.append(client)
+        except Exception:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+    latencies: List[float] = []
+    delivered = 0
+    session = requests.Session()
+    for round_index in range(rounds):
+        action = 'stop' if round_index % 2 == 0 else 'start'
+        sent = time.perf_counter()
+        session.post(f"{base_url}/api/checker/{action}", timeout=10)
+        deadline = sent + 10
+        pending = set(range(len(connected)))
+        while pending and time.perf_counter() < deadline:
+            pending = {i for i in pending if not any(t >= sent for t in arrivals[i])}
+            time.sleep(0.005)
+        for i in range(len(connected)):
+            received = [t for t in arrivals[i] if t >= sent]
+            if received:
+                latencies.append(received[0] - sent)
+                delivered += 1
+        time.sleep(0.2)
+
+    for client in connected:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+    expected = len(connected) * rounds
+    return {'connected': len(connected), 'delivered': delivered / expected if expected else 0.0,
+            'p50': _percentile(latencies, 0.5), 'p99': _percentile(latencies, 0.99),
+            'max': max(latencies, default=0.0)}
+
+
+def bench_server(args) -> int:
+    """分别以 eventlet 和 threading 模式启动服务，测量 /api/state 吞吐和 Socket.IO 广播扇出"""
+    controller = StandInController(nodes=args.nodes, seed=args.seed)
+    controller_url = controller.start()
+
+    print("=" * 60)
+    print(f"Web 服务: /api/state {args.http_clients} 并发 {args.duration:.0f}s，"
+          f"Socket.IO {args.sio_clients} 客户端 × {args.rounds} 次广播")
+    print("=" * 60)
+    print(f"{'模式':<12}{'请求/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'错误':>6}"
+          f"{'连接数':>8}{'送达率':>8}{'扇出 p50':>10}{'扇出 p99':>10}{'扇出 max':>10}")
+    try:
+        for mode in args.modes:
+            # eventlet 监听时启用 SO_REUSEPORT，固定端口可能与残留进程共享，因此每次选择空闲端口
+            port = _free_port()
+            process = _start_app(controller_url, mode, port)
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                http = _measure_state_throughput(base_url, args.http_clients, args.duration)
+                fanout = _measure_fanout(base_url, args.sio_clients, args.rounds)
+            finally:
+                _stop_app(process)
+            print(f"{mode:<12}{http['rps']:>10.0f}{http['p50'] * 1000:>10.1f}{http['p99'] * 1000:>10.1f}"
+                  f"{http['errors']:>6}{fanout['connected']:>8}{fanout['delivered']:>8.0%}"
+                  f"{fanout['p50'] * 1000:>10.1f}{fanout['p99'] * 1000:>10.1f}{fanout['max'] * 1000:>10.1f}")
+    finally:
+        controller.stop()
+    return 0
+
+
+def _stop_app(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def bench_startup(args) -> int:
+    """启动 app.py 到 HTTP 可用、到连接 Controller 的耗时；Controller 晚于服务启动时的接管耗时"""
+    print("=" * 60)
+    print(f"服务启动: {args.nodes} 个节点，Controller 延后 {args.late:.1f}s 启动的场景")
+    print("=" * 60)
+    print(f"{'模式':<12}{'Controller':<12}{'HTTP 可用(ms)':>14}{'连接完成(ms)':>14}{'接管(ms)':>10}")
+    for mode in args.modes:
+        for late in (False, True):
+            controller = StandInController(nodes=args.nodes, seed=args.seed)
+            controller_port = _free_port()
+            controller_url = f"http://127.0.0.1:{controller_port}"
+            if not late:
+                controller.start(port=controller_port)
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+
+            started = time.perf_counter()
+            controller_up = started
+            process = _launch_app(controller_url, mode, port)
+            try:
+                http_ready = _poll(f"{base_url}/api/state", lambda response: True, 30)
+                if late:
+                    time.sleep(max(0.0, started + args.late - time.perf_counter()))
+                    controller.start(port=controller_port)
+                    controller_up = time.perf_counter()
+                connected = _poll(f"{base_url}/api/controller", _controller_connected, 30 + args.late)
+            finally:
+                _stop_app(process)
+                controller.stop()
+
+            def ms(value, since):
+                return f"{(value - since) * 1000:.0f}" if value is not None else '超时'
+
+            print(f"{mode:<12}{'延后启动' if late else '已运行':<12}{ms(http_ready, started):>14}"
+                  f"{ms(connected, started):>14}{ms(connected, controller_up):>10}")
+    return 0
+
+
+def _memory_kb(pid: int) -> Dict[str, int]:
+    """进程的常驻内存和峰值常驻内存(KB)，读取 /proc/<pid>/status（仅 Linux）"""
+    result = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                result[key] = int(value.split()[0])
+    return result
+
+
+def bench_footprint(args) -> int:
+    """完整 Web 服务（eventlet / threading）与无界面守护进程的启动耗时和常驻内存"""
+    controller = StandInController(nodes=args.nodes, seed=args.seed)
+    controller_url = controller.start()
+    daemon_script = str(Path(__file__).with_name('daemon.py'))
+
+    print("=" * 60)
+    print(f"启动耗时与内存: {args.nodes} 个节点，连接 Controller 后稳定 {args.settle:.0f}s 再读取内存")
+    print("=" * 60)
+    print(f"{'入口':<22}{'就绪(ms)':>10}{'RSS(MB)':>10}{'峰值(MB)':>10}")
+    try:
+        for entry in args.entries:
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            started = time.perf_counter()
+            if entry == 'daemon':
+                env = dict(os.environ, CLASH_API_URL=controller_url, LOG_LEVEL='ERROR', CHECK_INTERVAL='3600',
+                           ENABLE_HISTORY_STORE='false', ENABLE_WARM_START='false')
+                process = subprocess.Popen([sys.executable, daemon_script, '--listen', f"127.0.0.1:{port}"],
+                                           env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                ready = _poll(f"{base_url}/healthz", lambda response: True, 30)
+            else:
+                process = _launch_app(controller_url, entry, port)
+                ready = _poll(f"{base_url}/api/controller", _controller_connected, 30)
+            try:
+                time.sleep(args.settle)
+                memory = _memory_kb(process.pid)
+            finally:
+                _stop_app(process)
+
+            name = 'daemon.py' if entry == 'daemon' else f"app.py（{entry}）"
+            elapsed = f"{(ready - started) * 1000:.0f}" if ready is not None else '超时'
+            print(f"{name:<22}{elapsed:>10}{memory.get('VmRSS', 0) / 1024:>10.1f}{memory.get('VmHWM', 0) / 1024:>10.1f}")
+    finally:
+        controller.stop()
+    return 0
+
+
+def run_stand_in(args) -> int:
+    """在前台运行 Controller 替身，启动后在标准输出打印各监听地址（供基准在独立进程中使用）"""
+    controller = StandInController(nodes=args.nodes, seed=args.seed)
+    urls = [controller.start(port=args.port)]
+    if args.unix:
+        urls.append(controller.start_unix(args.unix))
+    print(' '.join(urls), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+    return 0
+
+
+def _process_cpu_seconds(pid: int) -> float:
+    """进程累计的用户态 + 内核态 CPU 时间，读取 /proc/<pid>/stat（仅 Linux）"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def bench_transport(args) -> int:
+    """经回环 TCP 与 Unix 域套接字访问 Controller 的单次探测延迟、吞吐和每次探测的 CPU 开销
+
+    替身 Controller 在独立进程中运行，客户端和服务端的 CPU 分别统计。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from clash_api import ClashAPI
+    from models import Config
+
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='clash-bench-'), 'controller.sock')
+    controller = subprocess.Popen(
+        [sys.executable, __file__, '--seed', str(args.seed), 'stand-in', '--nodes', str(args.nodes),
+         '--unix', socket_path],
+        stdout=subprocess.PIPE, text=True)
+    urls = controller.stdout.readline().split()
+
+    print("=" * 60)
+    print(f"Controller 传输: 顺序 {args.probes} 次探测，{args.concurrency} 并发 {args.probes} 次探测")
+    print("=" * 60)
+    print(f"{'传输':<8}{'p50(µs)':>10}{'p99(µs)':>10}{'客户端 CPU(µs/次)':>20}{'服务端 CPU(µs/次)':>20}"
+          f"{'并发(次/秒)':>14}")
+    try:
+        for name, url in zip(('tcp', 'unix'), urls):
+            api = ClashAPI(Config(clash_api_url=url, probe_workers=args.concurrency))
+            nodes = [proxy for proxy, info in api.get_proxies().items()
+                     if info.get('type') not in ('Selector', 'Direct')]
+            for node in nodes[:50]:
+                api.get_delay(node)
+
+            latencies = []
+            client_cpu = time.process_time()
+            server_cpu = _process_cpu_seconds(controller.pid)
+            for i in range(args.probes):
+                started = time.perf_counter()
+                api.get_delay(nodes[i % len(nodes)])
+                latencies.append(time.perf_counter() - started)
+            client_cpu = time.process_time() - client_cpu
+            server_cpu = _process_cpu_seconds(controller.pid) - server_cpu
+
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                started = time.perf_counter()
+                list(executor.map(api.get_delay, (nodes[i % len(nodes)] for i in range(args.probes))))
+                throughput = args.probes / (time.perf_counter() - started)
+            api.session.close()
+
+            print(f"{name:<8}{_percentile(latencies, 0.5) * 1e6:>10.0f}{_percentile(latencies, 0.99) * 1e6:>10.0f}"
+                  f"{client_cpu / args.probes * 1e6:>20.0f}{server_cpu / args.probes * 1e6:>20.0f}"
+                  f"{throughput:>14.0f}")
+    finally:
+        controller.terminate()
+        controller.wait(timeout=10)
+        shutil.rmtree(os.path.dirname(socket_path), ignore_errors=True)
+    return 0
+
+
+def main(argv: List[str] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='Clash Auto Switch 性能基准')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    multi = subparsers.add_parser('multi-sample', help='多样本探测的开销与抖动')
+    multi.add_argument('--rounds', type=int, default=200)
+    multi.add_argument('--samples', type=int, default=5)
+    multi.add_argument('--rank-by', default='median', choices=['median', 'min', 'score'])
+    multi.set_defaults(func=bench_multi_sample)
+
+    probe_log = subparsers.add_parser('probe-log', help='探测日志的写入和扫描速度')
+    probe_log.add_argument('--rows', type=int, default=10_000_000, help='生成的行数（如 100000000）')
+    probe_log.add_argument('--nodes', type=int, default=2000)
+    probe_log.add_argument('--interval', type=float, default=30, help='每个节点的探测间隔(秒)')
+    probe_log.add_argument('--segment-rows', type=int, default=1 << 20)
+    probe_log.add_argument('--dir', default=None, help='临时数据目录（需约 17 字节/行的磁盘空间）')
+    probe_log.set_defaults(func=bench_probe_log)
+
+    payload_parser = subparsers.add_parser('payload', help='响应体积与序列化耗时（JSON 编码器、列式、压缩）')
+    payload_parser.add_argument('--nodes', type=int, default=5000)
+    payload_parser.add_argument('--points', type=int, default=500)
+    payload_parser.add_argument('--repeat', type=int, default=20)
+    payload_parser.set_defaults(func=bench_payload)
+
+    server = subparsers.add_parser('server', help='/api/state 吞吐与 Socket.IO 广播扇出（eventlet / threading）')
+    server.add_argument('--modes', nargs='+', default=['eventlet', 'threading'])
+    server.add_argument('--nodes', type=int, default=200)
+    server.add_argument('--http-clients', type=int, default=50)
+    server.add_argument('--duration', type=float, default=10)
+    server.add_argument('--sio-clients', type=int, default=300)
+    server.add_argument('--rounds', type=int, default=10)
+    server.set_defaults(func=bench_server)
+
+    startup = subparsers.add_parser('startup', help='服务启动耗时（HTTP 可用、连接 Controller、Controller 延后启动时的接管）')
+    startup.add_argument('--modes', nargs='+', default=['eventlet', 'threading'])
+    startup.add_argument('--nodes', type=int, default=2000)
+    startup.add_argument('--late', type=float, default=3.0, help='延后启动场景中 Controller 晚于服务启动的秒数')
+    startup.set_defaults(func=bench_startup)
+
+    footprint = subparsers.add_parser('footprint', help='完整 Web 服务与无界面守护进程的启动耗时和常驻内存')
+    footprint.add_argument('--entries', nargs='+', default=['eventlet', 'threading', 'daemon'],
+                           help='eventlet / threading（app.py 的运行模式）或 daemon')
+    footprint.add_argument('--nodes', type=int, default=2000)
+    footprint.add_argument('--settle', type=float, default=2.0, help='就绪后等待的秒数')
+    footprint.set_defaults(func=bench_footprint)
+
+    transport = subparsers.add_parser('transport', help='经回环 TCP 与 Unix 域套接字访问 Controller 的延迟和 CPU 开销')
+    transport.add_argument('--nodes', type=int, default=200)
+    transport.add_argument('--probes', type=int, default=5000)
+    transport.add_argument('--concurrency', type=int, default=8)
+    transport.set_defaults(func=bench_transport)
+
+    stand_in = subparsers.add_parser('stand-in', help='在前台运行 Controller 替身')
+    stand_in.add_argument('--nodes', type=int, default=200)
+    stand_in.add_argument('--port', type=int, default=0)
+    stand_in.add_argument('--unix', default='', help='同时监听的 Unix 域套接字路径')
+    stand_in.set_defaults(func=run_stand_in)
+
+    args = parser.parse_args(argv)
+    # 基准运行期间只保留严重错误日志，避免日志输出影响计时
+    logging.basicConfig(level=logging.CRITICAL)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+黑名单规则
+除精确节点名外，支持通配符、正则、关键词规则以及到期自动失效的临时条目；
+所有规则编译为一个匹配器：精确规则为一次集合查找，通配符和关键词规则合并为一个正则，
+用户编写的正则规则各自编译（全局标志、命名组和反向引用只在单条规则内有效）
+"""
+
+import fnmatch
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+# 规则类型
+RULE_EXACT = 'exact'
+RULE_GLOB = 'glob'
+RULE_REGEX = 'regex'
+RULE_KEYWORD = 'keyword'
+RULE_TYPES = (RULE_EXACT, RULE_GLOB, RULE_REGEX, RULE_KEYWORD)
+
+# 文本形式中的类型前缀，如 "glob:HK*"、"re:^香港"、"kw:倍率"
+_PREFIXES = {'exact': RULE_EXACT, 'glob': RULE_GLOB, 're': RULE_REGEX, 'regex': RULE_REGEX,
+             'kw': RULE_KEYWORD, 'keyword': RULE_KEYWORD}
+
+# fnmatch.translate 结果末尾的锚点（不同 Python 版本为 \Z 或 \z）
+_END_ANCHOR = re.compile(r'\\[Zz]\Z')
+
+
+@dataclass(frozen=True)
+class BlacklistRule:
+    """一条黑名单规则，expires_at 为 None 表示永久有效"""
+    pattern: str
+    kind: str = RULE_EXACT
+    expires_at: Optional[float] = None
+
+    def __post_init__(self):
+        if not self.pattern:
+            raise ValueError("规则内容不能为空")
+        if self.kind not in RULE_TYPES:
+            raise ValueError(f"未知的规则类型: {self.kind}")
+        if self.kind == RULE_REGEX:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                raise ValueError(f"无效的正则表达式 '{self.pattern}': {e}")
+
+    @property
+    def key(self) -> str:
+        """规则标识（类型:内容），用于删除"""
+        return f"{self.kind}:{self.pattern}"
+
+    def expired(self, now: float = None) -> bool:
+        """是否已过期"""
+        return self.expires_at is not None and (now or time.time()) >= self.expires_at
+
+    def regex_source(self) -> str:
+        """规则对应的正则片段（用 search 匹配）
+
+        通配符、关键词和精确规则的片段可以安全地合并；正则规则原样返回，只能单独编译。
+        """
+        if self.kind == RULE_GLOB:
+            return _glob_source(self.pattern)
+        if self.kind == RULE_KEYWORD:
+            return '(?i:' + re.escape(self.pattern) + ')'
+        if self.kind == RULE_EXACT:
+            return r'\A' + re.escape(self.pattern) + r'\Z'
+        return self.pattern
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return {
+            'key': self.key,
+            'pattern': self.pattern,
+            'type': self.kind,
+            'expires_at': datetime.fromtimestamp(self.expires_at).isoformat() if self.expires_at else None
+        }
+
+    def to_record(self) -> Dict:
+        """持久化格式"""
+        return {'pattern': self.pattern, 'type': self.kind, 'expires_at': self.expires_at}
+
+    @classmethod
+    def from_record(cls, data: Dict) -> 'BlacklistRule':
+        """从持久化格式创建"""
+        return cls(data['pattern'], data.get('type', RULE_EXACT), data.get('expires_at'))
+
+
+def _glob_source(pattern: str) -> str:
+    """把通配符转换为用于 search 的正则
+
+    首尾的 * 不生成 .*，而是去掉对应的锚点，避免在合并后的正则中产生大量回溯。
+    """
+    core = pattern.strip('*')
+    # 去掉 fnmatch.translate 的结尾锚点，再按需要重新添加
+    source = _END_ANCHOR.sub('', fnmatch.translate(core))
+    start = '' if pattern.startswith('*') else r'\A'
+    end = '' if pattern.endswith('*') else r'\Z'
+    return start + source + end
+
+
+def parse_rule(text: str, ttl_seconds: float = None, kind: str = None) -> BlacklistRule:
+    """解析规则文本：可带类型前缀（glob:/re:/kw:/exact:），无前缀时按 kind（默认精确匹配）处理"""
+    text = text.strip()
+    if kind is None:
+        prefix, sep, rest = text.partition(':')
+        if sep and prefix.lower() in _PREFIXES:
+            kind, text = _PREFIXES[prefix.lower()], rest.strip()
+        else:
+            kind = RULE_EXACT
+    expires_at = time.time() + ttl_seconds if ttl_seconds else None
+    return BlacklistRule(text, kind, expires_at)
+
+
+class BlacklistMatcher:
+    """由一组规则编译得到的匹配器
+
+    精确规则放入集合，通配符和关键词规则合并为一个正则，正则规则逐条编译；
+    最早的过期时间之后需要重新编译。
+    """
+
+    def __init__(self, rules: Tuple[BlacklistRule, ...], now: float = None):
+        now = now or time.time()
+        self.rules = rules
+        active = [rule for rule in rules if not rule.expired(now)]
+        self.exact = frozenset(rule.pattern for rule in active if rule.kind == RULE_EXACT)
+        patterns = [rule.regex_source() for rule in active if rule.kind in (RULE_GLOB, RULE_KEYWORD)]
+        self._regex = re.compile('|'.join(patterns)) if patterns else None
+        self._regexes = tuple(re.compile(rule.pattern) for rule in active if rule.kind == RULE_REGEX)
+        self.valid_until = min((rule.expires_at for rule in active if rule.expires_at), default=float('inf'))
+
+    def __bool__(self) -> bool:
+        return bool(self.exact) or self._regex is not None or bool(self._regexes)
+
+    def stale(self, rules: Tuple[BlacklistRule, ...], now: float = None) -> bool:
+        """规则已变化或有规则到期时需要重新编译"""
+        return rules is not self.rules or (now or time.time()) >= self.valid_until
+
+    def matches(self, node_name: str) -> bool:
+        """节点是否命中任一规则"""
+        if node_name in self.exact:
+            return True
+        if self._regex is not None and self._regex.search(node_name) is not None:
+            return True
+        return any(regex.search(node_name) is not None for regex in self._regexes)
+
+
+def active_rules(rules: Iterable[BlacklistRule], now: float = None) -> Tuple[BlacklistRule, ...]:
+    """去掉已过期的规则"""
+    now = now or time.time()
+    return tuple(rule for rule in rules if not rule.expired(now))
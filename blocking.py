@@ -0,0 +1,25 @@
+"""
+阻塞调用
+sqlite、fsync 等不会让出事件循环的 C 层调用统一经 run_blocking 执行；
+eventlet 模式下（由 server.configure 启用）放到原生线程池，线程模式和无界面守护进程中直接调用
+"""
+
+# 是否把阻塞调用放到 eventlet 的原生线程池执行
+_use_tpool = False
+
+
+def use_native_threads(enabled: bool):
+    """启用或关闭原生线程池（eventlet monkey patch 之后启用）"""
+    global _use_tpool
+    _use_tpool = enabled
+
+
+def run_blocking(func, *args, **kwargs):
+    """执行不会让出事件循环的阻塞调用
+
+    eventlet 模式下放到原生线程池执行，避免阻塞所有协程；否则直接调用。
+    """
+    if _use_tpool:
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
@@ -0,0 +1,279 @@
+"""
+Socket.IO 推送
+在独立的后台任务中合并、限速地向客户端推送更新，检测线程和请求线程只登记更新，不等待发送；
+客户端按主题订阅（state / history / probes），每个客户端有有界的待发送队列，
+慢客户端的旧更新被新的同类更新替换，不会无限堆积
+"""
+
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from models import StateSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 主题
+TOPIC_STATE = 'state'  # 运行状态快照和增量（state_snapshot / state_delta）
+TOPIC_HISTORY = 'history'  # 每次探测的延迟数据点（history_point）
+TOPIC_PROBES = 'probes'  # 手动测速结果（probe_result / probe_batch_done）
+TOPICS = (TOPIC_STATE, TOPIC_HISTORY, TOPIC_PROBES)
+
+# 默认合并窗口(秒)
+DEFAULT_WINDOW = 0.2
+# 每个客户端待发送消息的默认上限
+DEFAULT_QUEUE_SIZE = 100
+# 每个客户端已发送但尚未确认的消息上限，达到后暂停向该客户端发送
+MAX_IN_FLIGHT = 8
+# 超过该时间(秒)未确认的消息视为丢失（兼容不回复确认的客户端）
+ACK_TIMEOUT = 10.0
+
+
+class _Client:
+    """单个客户端的订阅和发送状态"""
+
+    __slots__ = ('sid', 'topics', 'outbox', 'state_pending', 'last_state', 'in_flight',
+                 'sent', 'superseded', 'dropped')
+
+    def __init__(self, sid: str):
+        self.sid = sid
+        self.topics = set()
+        # 键 -> (事件名, 数据)；同一键的新消息替换尚未发送的旧消息
+        self.outbox: 'OrderedDict[Hashable, Tuple[str, Dict]]' = OrderedDict()
+        # 状态更新单独标记，发送时按最新快照生成相对该客户端已收到版本的增量
+        self.state_pending = False
+        self.last_state: Optional[StateSnapshot] = None
+        # 消息序号 -> 发送时间
+        self.in_flight: Dict[int, float] = {}
+        self.sent = 0
+        self.superseded = 0
+        self.dropped = 0
+
+
+class Broadcaster:
+    """合并、限速的 Socket.IO 推送
+
+    socketio 为 Flask-SocketIO 实例；state_source 返回当前状态快照。
+    publish_state / publish 只登记更新并唤醒后台任务，后台任务在合并窗口结束后统一发送。
+    """
+
+    def __init__(self, socketio, state_source: Callable[[], StateSnapshot],
+                 window: float = DEFAULT_WINDOW, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 max_in_flight: int = MAX_IN_FLIGHT, ack_timeout: float = ACK_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.socketio = socketio
+        self.state_source = state_source
+        self.window = max(0.0, window)
+        self.queue_size = max(1, queue_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.ack_timeout = ack_timeout
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._clients: Dict[str, _Client] = {}
+        # 尚未分发的消息: (主题, 事件名, 数据, 键, 目标客户端)
+        self._pending: List[Tuple[str, str, Dict, Hashable, Optional[str]]] = []
+        self._state_dirty = False
+        self._snapshot: Optional[StateSnapshot] = None
+        self._seq = itertools.count()
+        self._running = False
+        self.flushes = 0
+
+    # ---------- 客户端 ----------
+
+    def add_client(self, sid: str):
+        """登记新连接的客户端"""
+        with self._lock:
+            self._clients.setdefault(sid, _Client(sid))
+
+    def remove_client(self, sid: str):
+        """移除断开的客户端，丢弃其待发送消息"""
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def subscribe(self, sid: str, topics: Iterable[str]) -> List[str]:
+        """订阅主题，返回实际订阅的主题；订阅 state 时重新发送一次完整快照"""
+        accepted = [topic for topic in topics if topic in TOPICS]
+        with self._lock:
+            client = self._clients.setdefault(sid, _Client(sid))
+            client.topics.update(accepted)
+            if TOPIC_STATE in accepted:
+                client.last_state = None
+                client.state_pending = True
+                self._state_dirty = True
+        self._wakeup.set()
+        return accepted
+
+    def unsubscribe(self, sid: str, topics: Iterable[str]):
+        """取消订阅主题"""
+        with self._lock:
+            client = self._clients.get(sid)
+            if client:
+                client.topics.difference_update(topics)
+                if TOPIC_STATE not in client.topics:
+                    client.state_pending = False
+                    client.last_state = None
+
+    # ---------- 发布 ----------
+
+    def publish_state(self):
+        """标记运行状态可能已变化，下次发送时取最新快照，版本未变化的客户端不发送"""
+        with self._lock:
+            self._state_dirty = True
+        self._wakeup.set()
+
+    def publish(self, topic: str, event: str, data: Dict, key: Hashable = None, to: str = None):
+        """发布消息
+
+        key 相同的消息在客户端尚未发送时只保留最新一条（key 为 None 时不合并）；
+        指定 to 时只发送给该客户端（不要求其订阅该主题）。
+        """
+        if key is None:
+            key = ('seq', next(self._seq))
+        with self._lock:
+            self._pending.append((topic, event, data, (event, key), to))
+        self._wakeup.set()
+
+    # ---------- 发送 ----------
+
+    def flush(self):
+        """把待分发的消息放入各客户端队列，并向未被阻塞的客户端发送"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            state_dirty, self._state_dirty = self._state_dirty, False
+            clients = list(self._clients.values())
+
+        if state_dirty:
+            self._snapshot = self.state_source()
+        snapshot = self._snapshot
+
+        with self._lock:
+            for client in clients:
+                if (state_dirty and TOPIC_STATE in client.topics
+                        and (client.last_state is None or client.last_state.version != snapshot.version)):
+                    client.state_pending = True
+                for topic, event, data, key, to in pending:
+                    if to is not None:
+                        if to != client.sid:
+                            continue
+                    elif topic not in client.topics:
+                        continue
+                    self._enqueue(client, key, event, data)
+
+        deltas: Dict[int, Dict] = {}
+        now = self._clock()
+        for client in clients:
+            self._drain(client, snapshot, deltas, now)
+        self.flushes += 1
+
+    def _enqueue(self, client: _Client, key: Hashable, event: str, data: Dict):
+        if key in client.outbox:
+            client.superseded += 1
+        elif len(client.outbox) >= self.queue_size:
+            client.outbox.popitem(last=False)
+            client.dropped += 1
+        client.outbox[key] = (event, data)
+
+    def _drain(self, client: _Client, snapshot: Optional[StateSnapshot], deltas: Dict[int, Dict], now: float):
+        """在未确认消息数允许的范围内向客户端发送，状态更新优先"""
+        while True:
+            with self._lock:
+                if client.sid not in self._clients:
+                    return
+                # 超时未确认的消息不再占用名额
+                for seq, sent_at in list(client.in_flight.items()):
+                    if now - sent_at > self.ack_timeout:
+                        del client.in_flight[seq]
+                if len(client.in_flight) >= self.max_in_flight:
+                    return
+
+                if client.state_pending and snapshot is not None:
+                    client.state_pending = False
+                    previous, client.last_state = client.last_state, snapshot
+                    if previous is None:
+                        event, data = 'state_snapshot', snapshot.data
+                    elif previous.version == snapshot.version:
+                        continue
+                    else:
+                        event = 'state_delta'
+                        # 同一旧版本的客户端共用一份增量
+                        data = deltas.get(previous.version)
+                        if data is None:
+                            data = deltas[previous.version] = snapshot.delta_since(previous)
+                elif client.outbox:
+                    _, (event, data) = client.outbox.popitem(last=False)
+                else:
+                    return
+
+                seq = next(self._seq)
+                client.in_flight[seq] = now
+                client.sent += 1
+
+            try:
+                self.socketio.server.emit(event, data, to=client.sid,
+                                          callback=lambda *args, c=client, s=seq: self._acked(c, s))
+            except Exception as e:
+                logger.error(f"推送 {event} 失败: {e}")
+                with self._lock:
+                    client.in_flight.pop(seq, None)
+                return
+
+    def _acked(self, client: _Client, seq: int):
+        """客户端确认收到消息，唤醒后台任务继续发送"""
+        with self._lock:
+            client.in_flight.pop(seq, None)
+            backlog = client.state_pending or client.outbox
+        if backlog:
+            self._wakeup.set()
+
+    # ---------- 后台任务 ----------
+
+    def start(self):
+        """启动后台发送任务"""
+        if self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        """停止后台发送任务"""
+        self._running = False
+        self._wakeup.set()
+
+    def _run(self):
+        while self._running:
+            # 定期醒来以回收超时未确认的消息
+            self._wakeup.wait(self.ack_timeout)
+            self._wakeup.clear()
+            if not self._running:
+                break
+            with self._lock:
+                coalesce = self._state_dirty or bool(self._pending)
+            # 新的更新先等待合并窗口，窗口内的后续更新一并发送；仅确认触发的唤醒立即发送
+            if coalesce and self.window:
+                self.socketio.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"推送更新失败: {e}")
+
+    def stats(self) -> Dict:
+        """推送统计"""
+        with self._lock:
+            clients = list(self._clients.values())
+            return {
+                'clients': len(clients),
+                'window_ms': int(self.window * 1000),
+                'queue_size': self.queue_size,
+                'flushes': self.flushes,
+                'sent': sum(client.sent for client in clients),
+                'queued': sum(len(client.outbox) for client in clients),
+                'in_flight': sum(len(client.in_flight) for client in clients),
+                'superseded': sum(client.superseded for client in clients),
+                'dropped': sum(client.dropped for client in clients),
+                'topics': {topic: sum(1 for client in clients if topic in client.topics) for topic in TOPICS}
+            }
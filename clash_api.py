@@ -4,35 +4,189 @@ Clash API 客户端
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+import hashlib
 import logging
+import threading
+import socket
 import time
-from typing import Dict, List, Optional
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.connection import HTTPConnection
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import quote
-from models import Config
+import payload
+from events import EventBus, ProbeEvent, ProxiesChangedEvent
+from models import Config, ProbeResult
 
 logger = logging.getLogger(__name__)
 
+# 连接池大小（同一 Controller 的长连接复用）
+POOL_MAXSIZE = 8
+# 请求的默认 (连接超时, 读取超时)(秒) - 较长以适应慢速 API
+REQUEST_TIMEOUT = (15, 60)
+# CLASH_API_URL 使用 unix://<套接字路径> 时经 Unix 域套接字（external-controller-unix）访问
+UNIX_SCHEME = 'unix://'
+# /proxies 条目中随测速和探活变化的字段，不参与指纹
+VOLATILE_PROXY_FIELDS = frozenset({'history', 'extra', 'alive'})
+
 
 class ClashAPIError(Exception):
     """Clash API 错误"""
     pass
 
 
+@dataclass(frozen=True)
+class ProxiesDiff:
+    """两次 /proxies 快照之间新增、消失和内容变化的条目名（节点和代理组）"""
+    added: Tuple[str, ...] = ()
+    removed: Tuple[str, ...] = ()
+    changed: Tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+@dataclass(frozen=True)
+class ProxiesSnapshot:
+    """一次 GET /proxies 的结果
+
+    entries 为每个条目的规范化编码，fingerprint 由全部条目计算；两者都不包括每次测速都会变化的
+    history 等字段，Controller 一侧的节点或选择发生变化时才会改变。
+    proxies 由所有读者共享，调用方不得修改。
+    """
+    proxies: Dict
+    fingerprint: str
+    fetched_at: float
+    entries: Dict[str, bytes] = field(default_factory=dict)
+
+    def diff(self, previous: 'ProxiesSnapshot') -> ProxiesDiff:
+        """相对于旧快照的变化，只比较条目编码"""
+        if previous.fingerprint == self.fingerprint:
+            return ProxiesDiff()
+        old, new = previous.entries, self.entries
+        return ProxiesDiff(
+            added=tuple(name for name in new if name not in old),
+            removed=tuple(name for name in old if name not in new),
+            changed=tuple(name for name, value in new.items() if name in old and old[name] != value)
+        )
+
+
+def proxy_entry(info: Dict) -> bytes:
+    """单个条目的规范化编码（键有序，忽略 VOLATILE_PROXY_FIELDS），内容相同的条目编码相同"""
+    return payload.dumps_sorted({key: value for key, value in info.items() if key not in VOLATILE_PROXY_FIELDS})
+
+
+def proxies_fingerprint(proxies: Dict, entries: Dict[str, bytes] = None) -> str:
+    """计算节点列表指纹，entries 为已算好的条目编码"""
+    if entries is None:
+        entries = {name: proxy_entry(info) for name, info in proxies.items()}
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(entries):
+        digest.update(name.encode('utf-8'))
+        digest.update(b'\x00')
+        digest.update(entries[name])
+    return digest.hexdigest()
+
+
+class _UnixConnection(HTTPConnection):
+    """连接到 Unix 域套接字的 HTTP 连接"""
+
+    def __init__(self, socket_path: str, **kwargs):
+        super().__init__('localhost', **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class _UnixConnectionPool(urllib3.HTTPConnectionPool):
+    """Unix 域套接字连接池"""
+
+    def __init__(self, socket_path: str, maxsize: int):
+        super().__init__('localhost', maxsize=maxsize)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> _UnixConnection:
+        self.num_connections += 1
+        return _UnixConnection(self.socket_path, timeout=self.timeout.connect_timeout)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """经 Unix 域套接字访问 Controller 的 requests 适配器
+
+    所有请求都发往同一个套接字，与 TCP 一样复用连接池中的长连接；URL 中的主机名被忽略。
+    """
+
+    def __init__(self, socket_path: str, pool_maxsize: int = POOL_MAXSIZE):
+        self.socket_path = socket_path
+        self._pool = _UnixConnectionPool(socket_path, maxsize=pool_maxsize)
+        super().__init__(pool_connections=1, pool_maxsize=pool_maxsize)
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def request_url(self, request, proxies):
+        # 不经过代理，请求行只包含路径
+        return request.path_url
+
+    def close(self):
+        self._pool.close()
+        super().close()
+
+
 class ClashAPI:
     """Clash API 客户端"""
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, events: EventBus = None):
         self.config = config
-        self.base_url = config.clash_api_url.rstrip('/')
+        # 每次延迟探测完成后发布 ProbeEvent
+        self.events = events
         self.secret = config.clash_secret
         self.headers = {}
         if self.secret:
             self.headers['Authorization'] = f'Bearer {self.secret}'
 
+        # 复用长连接的会话，避免每次请求重新建立连接
+        self.session = requests.Session()
+        # 连接数不少于探测池的并发数，避免并发测速时反复建立连接
+        pool_maxsize = max(POOL_MAXSIZE, config.probe_workers)
+        if config.clash_api_url.startswith(UNIX_SCHEME):
+            # 同一主机上的 Clash：经 Unix 域套接字访问，省去回环 TCP 的开销
+            socket_path = config.clash_api_url[len(UNIX_SCHEME):]
+            self.base_url = f"http+unix://{quote(socket_path, safe='')}"
+            self.session.trust_env = False
+            self.session.mount('http+unix://', UnixSocketAdapter(socket_path, pool_maxsize=pool_maxsize))
+        else:
+            self.base_url = config.clash_api_url.rstrip('/')
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+        # 多样本探测的并发采样线程，不超过连接池大小
+        self._sample_executor = ThreadPoolExecutor(max_workers=pool_maxsize, thread_name_prefix='probe-sample')
+
+        # 最近一次成功获取的节点列表，新快照与它比较得出条目变化
+        self._proxies_snapshot: Optional[ProxiesSnapshot] = None
+        self._snapshot_lock = threading.Lock()
+
         logger.info(f"初始化 Clash API 客户端: {self.base_url}")
         logger.debug(f"代理组: {config.proxy_group}, 测试URL: {config.test_url}")
 
-    def _request(self, method: str, endpoint: str, max_retries: int = 3, **kwargs) -> requests.Response:
+    def _request(self, method: str, endpoint: str, max_retries: int = 3, timeout=REQUEST_TIMEOUT,
+                 **kwargs) -> requests.Response:
         """发送 HTTP 请求，支持重试机制"""
         url = f"{self.base_url}/{endpoint}"
         start_time = time.time()
@@ -50,11 +204,11 @@ class ClashAPI:
         for attempt in range(max_retries):
             try:
                 attempt_start = time.time()
-                response = requests.request(
+                response = self.session.request(
                     method,
                     url,
                     headers=self.headers,
-                    timeout=(15, 60),  # (连接超时, 读取超时) - 增加以适应慢速 API
+                    timeout=timeout,
                     **kwargs
                 )
                 attempt_time = time.time() - attempt_start
@@ -99,21 +253,64 @@ class ClashAPI:
                            f"状态码={e.response.status_code}, 响应={response_text}")
                 raise ClashAPIError(f"API 错误: {e.response.status_code}")
 
-    def get_proxies(self) -> Dict:
-        """获取所有代理节点"""
+    def get_proxies(self, max_age: float = 0) -> Dict:
+        """获取所有代理节点，max_age 见 proxies_snapshot"""
+        snapshot = self.proxies_snapshot(max_age)
+        return snapshot.proxies if snapshot else {}
+
+    def proxies_snapshot(self, max_age: float = 0) -> Optional[ProxiesSnapshot]:
+        """获取节点列表快照
+
+        上次获取未超过 max_age 秒时直接返回缓存，不请求 Clash；max_age 为 0 时总是重新获取。
+        获取失败时返回 None。条目与上一次快照不同时发布 ProxiesChangedEvent。
+        """
+        snapshot = self._proxies_snapshot
+        if max_age and snapshot and time.time() - snapshot.fetched_at < max_age:
+            return snapshot
+
+        # 以发出请求的时间作为快照时间，并发获取时据此判断先后
+        requested_at = time.time()
         try:
             logger.debug("获取所有代理节点")
             response = self._request('GET', 'proxies')
             data = response.json()
             proxies = data.get('proxies', {})
             logger.info(f"成功获取代理节点: 共 {len(proxies)} 个")
-            return proxies
         except ClashAPIError as e:
             logger.error(f"获取节点列表失败: {e}")
-            return {}
+            return None
         except Exception as e:
             logger.error(f"获取节点列表异常: {type(e).__name__}: {e}")
-            return {}
+            return None
+
+        entries = {name: proxy_entry(info) for name, info in proxies.items()}
+        snapshot = ProxiesSnapshot(proxies, proxies_fingerprint(proxies, entries), requested_at, entries)
+        with self._snapshot_lock:
+            previous = self._proxies_snapshot
+            if previous and previous.fetched_at > snapshot.fetched_at:
+                # 并发获取时较早发出的请求后返回，不覆盖较新的快照
+                return snapshot
+            self._proxies_snapshot = snapshot
+            diff = snapshot.diff(previous) if previous else ProxiesDiff()
+
+        if diff:
+            logger.info(f"Controller 节点列表已变化: 新增 {len(diff.added)}，消失 {len(diff.removed)}，"
+                        f"变化 {len(diff.changed)}")
+            if self.events:
+                self.events.publish(ProxiesChangedEvent(
+                    diff.added, diff.removed, diff.changed, proxies,
+                    previous.fingerprint, snapshot.fingerprint, snapshot.fetched_at
+                ))
+        return snapshot
+
+    def invalidate_proxies(self):
+        """使缓存的节点列表过期（切换节点后 Controller 的选择已变化）
+
+        只标记过期、不丢弃，下次获取的结果仍与它比较。
+        """
+        with self._snapshot_lock:
+            if self._proxies_snapshot:
+                self._proxies_snapshot = replace(self._proxies_snapshot, fetched_at=0.0)
 
     def get_proxy_groups(self) -> Dict:
         """获取代理组"""
@@ -158,6 +355,7 @@ class ClashAPI:
 
             payload = {"name": proxy_name}
             self._request('PUT', url, json=payload)
+            self.invalidate_proxies()
             logger.info(f"✅ 切换节点成功: {proxy_name}")
             return True
         except ClashAPIError as e:
@@ -205,8 +403,49 @@ class ClashAPI:
             logger.debug(f"获取流量统计失败: {e}")
             return {}
 
+    def _notify_probe(self, proxy_name: str, delay: Optional[int]):
+        """发布探测结果事件"""
+        if self.events:
+            self.events.publish(ProbeEvent(proxy_name, delay, time.time()))
+
     def get_delay(self, proxy_name: str, test_url: str = None, timeout: int = 5000) -> Optional[int]:
         """测试节点延迟"""
+        delay = self._measure_delay(proxy_name, test_url, timeout)
+        self._notify_probe(proxy_name, delay)
+        return delay
+
+    def probe(self, proxy_name: str, samples: int = 3, test_url: str = None, timeout: int = 5000) -> ProbeResult:
+        """对节点采样多次，返回中位数、最小值、抖动和丢包率
+
+        各次采样在连接池的多个长连接上同时发出，无响应的节点整次探测约耗时一个 timeout，
+        而不是 samples 个；单次采样失败不重试而是计为丢包。
+        只发布一次探测事件（中位数），避免同一时刻的多个样本干扰趋势统计。
+        """
+        result = ProbeResult(node_name=proxy_name)
+        samples = max(samples, 1)
+        if samples == 1:
+            result.samples.append(self._measure_delay(proxy_name, test_url, timeout, max_retries=1))
+        else:
+            futures = [self._sample_executor.submit(self._measure_delay, proxy_name, test_url, timeout,
+                                                    max_retries=1)
+                       for _ in range(samples)]
+            result.samples.extend(future.result() for future in futures)
+        logger.debug(f"  多样本探测 {proxy_name}: {result.to_dict()}")
+        self._notify_probe(proxy_name, result.median)
+        return result
+
+    def test_multiple_probes(self, proxy_names: List[str], samples: int = 3, test_url: str = None,
+                             timeout: int = 5000) -> Dict[str, ProbeResult]:
+        """批量多样本探测多个节点"""
+        logger.info(f"开始批量探测 {len(proxy_names)} 个节点，每个节点 {samples} 次采样")
+        results = {name: self.probe(name, samples, test_url, timeout) for name in proxy_names}
+        succeeded = sum(1 for r in results.values() if r.median is not None)
+        logger.info(f"批量探测完成: 成功 {succeeded}/{len(proxy_names)} 个节点")
+        return results
+
+    def _measure_delay(self, proxy_name: str, test_url: str = None, timeout: int = 5000,
+                       max_retries: int = 3) -> Optional[int]:
+        """向 Clash 发起一次延迟测试"""
         try:
             if test_url is None:
                 test_url = self.config.test_url
@@ -222,7 +461,7 @@ class ClashAPI:
                 "timeout": timeout
             }
 
-            response = self._request('GET', url, params=payload)
+            response = self._request('GET', url, max_retries=max_retries, params=payload)
             data = response.json()
             delay = data.get('delay')
 
@@ -277,11 +516,11 @@ class ClashAPI:
         logger.debug(f"  找到 {len(result)} 个节点")
         return result
 
-    def is_available(self) -> bool:
-        """检查 Clash API 是否可用"""
+    def is_available(self, max_retries: int = 3, timeout=REQUEST_TIMEOUT) -> bool:
+        """检查 Clash API 是否可用（后台发现时使用较短的超时且不重试）"""
         try:
             logger.debug(f"检查 Clash API 可用性: {self.base_url}")
-            response = self._request('GET', '')
+            response = self._request('GET', '', max_retries=max_retries, timeout=timeout)
             available = response.status_code == 200
             logger.info(f"Clash API 状态: {'✅ 可用' if available else '❌ 不可用'}")
             return available
@@ -26,7 +26,37 @@ def load_config() -> Config:
         silent_period_minutes=int(os.getenv('SILENT_PERIOD', 3)),
         min_delay_for_switch=int(os.getenv('MIN_DELAY_FOR_SWITCH', 100)),
         enable_active_detection=os.getenv('ENABLE_ACTIVE_DETECTION', 'true').lower() == 'true',
-        active_check_method=os.getenv('ACTIVE_CHECK_METHOD', 'api')
+        active_check_method=os.getenv('ACTIVE_CHECK_METHOD', 'api'),
+        # 影子策略
+        shadow_policies=os.getenv('SHADOW_POLICIES', ''),
+        # 预测性切换
+        enable_predictive_switch=os.getenv('ENABLE_PREDICTIVE_SWITCH', 'false').lower() == 'true',
+        predict_window=int(os.getenv('PREDICT_WINDOW', 20)),
+        predict_horizon_seconds=int(os.getenv('PREDICT_HORIZON', 120)),
+        # 多样本探测
+        probe_samples=int(os.getenv('PROBE_SAMPLES', 1)),
+        rank_by=os.getenv('RANK_BY', 'median'),
+        # 每个节点保留的延迟记录数
+        history_capacity=int(os.getenv('HISTORY_CAPACITY', 1000)),
+        # 热启动
+        enable_warm_start=os.getenv('ENABLE_WARM_START', 'true').lower() == 'true',
+        warm_start_max_age_minutes=int(os.getenv('WARM_START_MAX_AGE', 60)),
+        standby_max_age_seconds=int(os.getenv('STANDBY_MAX_AGE', 600)),
+        # 长期延迟时序存储
+        enable_history_store=os.getenv('ENABLE_HISTORY_STORE', 'true').lower() == 'true',
+        history_raw_retention_days=int(os.getenv('HISTORY_RAW_RETENTION_DAYS', 2)),
+        history_minute_retention_days=int(os.getenv('HISTORY_MINUTE_RETENTION_DAYS', 14)),
+        history_hour_retention_days=int(os.getenv('HISTORY_HOUR_RETENTION_DAYS', 365)),
+        # 探测日志
+        enable_probe_log=os.getenv('ENABLE_PROBE_LOG', 'false').lower() == 'true',
+        probe_log_retention_days=int(os.getenv('PROBE_LOG_RETENTION_DAYS', 180)),
+        # 节点列表快照缓存
+        proxies_cache_seconds=int(os.getenv('PROXIES_CACHE_TTL', 30)),
+        # 手动测速并发数
+        probe_workers=int(os.getenv('PROBE_WORKERS', 8)),
+        # Socket.IO 推送
+        broadcast_window_ms=int(os.getenv('BROADCAST_WINDOW_MS', 200)),
+        broadcast_queue_size=int(os.getenv('BROADCAST_QUEUE_SIZE', 100))
     )
 
 
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+无界面守护进程
+只运行自动切换（ClashAPI、NodeManager、DelayChecker），不加载 Flask、Socket.IO 和 eventlet，
+适合只需要自动切换、不需要 Web 界面的路由器和边缘设备；配置与 app.py 相同（环境变量 / .env）。
+可选监听一个端口，只提供 /metrics（Prometheus）和 /healthz
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+import server
+import wiring
+from clash_api import ClashAPI
+from config import load_config
+from delay_checker import DelayChecker
+from discovery import STATE_CONNECTED, ControllerDiscovery, PROBE_TIMEOUT
+from events import EventBus, NodesChangedEvent, ProbeEvent
+from history import DelayHistory
+from models import Config, RuntimeState
+from node_manager import NodeManager
+from node_stats import NodeStatsTable
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+class Daemon:
+    """自动切换服务的无界面装配
+
+    与 app.py 相同：本地状态立即加载，Controller 在后台发现，可用后再创建节点管理器和延迟检测器。
+    长期时序存储、探测日志、热启动和影子策略按配置启用；时序存储（sqlite3）和探测日志（mmap）
+    只在启用时导入。
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.state = RuntimeState(delay_history=DelayHistory(per_node_capacity=config.history_capacity))
+        self.event_bus = EventBus()
+        self.clash_api = ClashAPI(config, events=self.event_bus)
+        self.node_stats = NodeStatsTable(window=config.predict_window, failure_value=config.test_timeout)
+        self.node_manager: Optional[NodeManager] = None
+        self.delay_checker: Optional[DelayChecker] = None
+        self.discovery = ControllerDiscovery(
+            lambda: self.clash_api.is_available(max_retries=1, timeout=PROBE_TIMEOUT),
+            self._attach_controller
+        )
+        self._warm_start = None
+        self._closers = []
+
+    def start(self):
+        """加载持久化的配置和黑名单，订阅探测事件，开始后台发现 Controller"""
+        storage.load_state_to_config(self.config)
+        self.state.blacklist = storage.load_blacklist()
+        self.state.blacklist_rules = storage.load_blacklist_rules()
+        self.state.active_detection_enabled = self.config.enable_active_detection
+        logger.info(f"从存储加载配置: 延迟阈值={self.config.delay_threshold}ms, "
+                    f"区域={self.config.locked_region or '未设置'}，黑名单 {len(self.state.blacklist)} 个节点")
+
+        self.event_bus.subscribe(ProbeEvent, lambda event: self.node_stats.observe(event.node, event.delay),
+                                 name='node_stats', inline=True)
+        self.event_bus.subscribe(NodesChangedEvent,
+                                 lambda event: self.node_stats.forget(event.removed + event.changed),
+                                 name='node_stats.churn', inline=True)
+
+        if self.config.enable_history_store:
+            from timeseries import TimeSeriesStore
+            history_store = TimeSeriesStore(
+                raw_retention_days=self.config.history_raw_retention_days,
+                minute_retention_days=self.config.history_minute_retention_days,
+                hour_retention_days=self.config.history_hour_retention_days
+            )
+            history_store.start()
+            self._closers.append(history_store.stop)
+            self.event_bus.subscribe(
+                ProbeEvent, lambda event: history_store.record(event.node, event.delay, event.timestamp),
+                name='history_store')
+
+        if self.config.enable_probe_log:
+            from probe_log import ProbeLog
+            probe_log = ProbeLog(retention_days=self.config.probe_log_retention_days)
+            self._closers.append(probe_log.close)
+            self.event_bus.subscribe(
+                ProbeEvent, lambda event: probe_log.append(event.node, event.delay, event.timestamp),
+                name='probe_log')
+
+        self.discovery.start()
+
+    def _attach_controller(self):
+        """Controller 可用后获取初始状态，创建节点管理器和延迟检测器并启动检测
+
+        装配步骤与 app.attach_controller 共用（见 wiring.attach_controller）。
+        """
+        components = wiring.attach_controller(self.clash_api, self.config, self.state, self.node_stats,
+                                              self.event_bus, warm_start=self._warm_start)
+        self._warm_start = components.warm_start
+        manager, checker = components.node_manager, components.delay_checker
+
+        self.node_manager = manager
+        self.delay_checker = checker
+        checker.start()
+        logger.info(f"已连接 Clash Controller: 当前节点 {self.state.current_node or '未知'}，"
+                    f"可用节点 {len(self.state.available_nodes)} 个，延迟检测已启动")
+
+    def stop(self):
+        """停止检测，处理完积压的事件后关闭存储"""
+        self.discovery.stop()
+        if self.delay_checker:
+            self.delay_checker.stop()
+        if self._warm_start:
+            self._warm_start.stop()
+        self.event_bus.close()
+        for close in reversed(self._closers):
+            close()
+        storage.close()
+
+    @property
+    def checker_running(self) -> bool:
+        return bool(self.delay_checker and self.delay_checker.is_running())
+
+    def health(self) -> Tuple[bool, Dict]:
+        """(是否健康, 详情)：已连接 Controller 且检测运行中视为健康"""
+        healthy = self.discovery.state == STATE_CONNECTED and self.checker_running
+        last_check = self.state.last_check_time
+        return healthy, {
+            'status': 'ok' if healthy else 'unavailable',
+            'controller': self.discovery.status(),
+            'checker_running': self.checker_running,
+            'current_node': self.state.current_node or None,
+            'last_check_time': last_check.isoformat() if last_check else None
+        }
+
+    def metrics(self) -> str:
+        return metrics.render(self.state, self.node_stats, self.discovery, self.event_bus,
+                              checker_running=self.checker_running)
+
+
+def serve_status(daemon: Daemon, host: str, port: int) -> ThreadingHTTPServer:
+    """在后台线程中提供 /metrics 和 /healthz"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path == '/metrics':
+                status, content_type, body = 200, metrics.CONTENT_TYPE, daemon.metrics().encode('utf-8')
+            elif path == '/healthz':
+                healthy, detail = daemon.health()
+                status, content_type = (200 if healthy else 503), 'application/json'
+                body = json.dumps(detail, ensure_ascii=False).encode('utf-8')
+            else:
+                status, content_type, body = 404, 'text/plain; charset=utf-8', b'not found\n'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='status-server', daemon=True).start()
+    logger.info(f"指标和健康检查: http://{host}:{httpd.server_address[1]}/metrics 、/healthz")
+    return httpd
+
+
+def parse_listen(value: str) -> Tuple[str, int]:
+    """解析 [主机:]端口，主机缺省为 127.0.0.1"""
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main(argv: List[str] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='Clash Auto Switch 无界面守护进程')
+    parser.add_argument('--listen', default=os.getenv('DAEMON_LISTEN', ''),
+                        help='提供 /metrics 和 /healthz 的地址 [主机:]端口（默认不监听，环境变量 DAEMON_LISTEN）')
+    args = parser.parse_args(argv)
+
+    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    logging.basicConfig(
+        level=getattr(logging, log_level, logging.INFO),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    # SIGTERM 时正常退出以执行 atexit
+    server.install_exit_handler()
+
+    daemon = Daemon(load_config())
+    atexit.register(daemon.stop)
+    daemon.start()
+    if args.listen:
+        serve_status(daemon, *parse_listen(args.listen))
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
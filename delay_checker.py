@@ -7,10 +7,13 @@ import time
 import threading
 import logging
 from datetime import datetime, timedelta
-from typing import Callable, Optional
+from typing import Callable, Dict, Iterable, Optional
 from clash_api import ClashAPI
+from events import CheckCompletedEvent, ConfigChangedEvent, EventBus, NodesChangedEvent
 from node_manager import NodeManager
 from models import Config, RuntimeState
+from node_stats import NodeStatsTable
+from shadow import ShadowEvaluator
 
 logger = logging.getLogger(__name__)
 
@@ -19,26 +22,94 @@ class DelayChecker:
     """延迟检测器"""
 
     def __init__(self, clash_api: ClashAPI, node_manager: NodeManager,
-                 config: Config, state: RuntimeState):
+                 config: Config, state: RuntimeState,
+                 clock: Callable[[], datetime] = datetime.now,
+                 shadow_evaluator: Optional[ShadowEvaluator] = None,
+                 node_stats: Optional[NodeStatsTable] = None,
+                 events: Optional[EventBus] = None):
         self.clash_api = clash_api
         self.node_manager = node_manager
         self.config = config
         self.state = state
+        # 时钟函数，离线模拟时替换为虚拟时钟
+        self._clock = clock
+        # 影子策略评估器（可选），只记录备选策略的决策
+        self.shadow_evaluator = shadow_evaluator
+        # 节点统计表（可选），用于预测性切换
+        self.node_stats = node_stats
         self._running = False
         self._thread: Optional[threading.Thread] = None
-        self._stop_event = threading.Event()
-
-        # 回调函数列表
-        self._callbacks = []
-
-    def add_callback(self, callback: Callable):
-        """添加状态变化回调"""
-        self._callbacks.append(callback)
+        # 停止、检测间隔被修改或有优先探测的节点时唤醒检测循环
+        self._wake_event = threading.Event()
+        # 等待优先探测的节点（有序去重），在检测间隔内插队探测，不触发检测周期
+        self._priority: Dict[str, None] = {}
+        self._priority_lock = threading.Lock()
+
+        # 事件总线（可选）：每个检测周期结束后发布 CheckCompletedEvent，
+        # 监听配置变更，新出现和内容变化的节点加入优先探测
+        self.events = events
+        self._subscriptions = []
+        if events:
+            self._subscriptions = [
+                events.subscribe(ConfigChangedEvent, self._on_config_changed, name='delay_checker'),
+                events.subscribe(NodesChangedEvent, self._on_nodes_changed, name='priority_probe')
+            ]
+
+    def close(self):
+        """停止检测并取消事件订阅（组件创建失败或被替换时调用）"""
+        self.stop()
+        for subscription in self._subscriptions:
+            self.events.unsubscribe(subscription)
+        self._subscriptions = []
+
+    def _on_config_changed(self, event: ConfigChangedEvent):
+        """检测间隔被修改时立即按新间隔重新计时"""
+        if 'check_interval' in event.changes and self._running:
+            logger.info(f"检测间隔已修改为 {self.config.check_interval} 秒")
+            self._wake_event.set()
 
     def is_running(self) -> bool:
         """检测器是否正在运行"""
         return self._running
 
+    def _on_nodes_changed(self, event: NodesChangedEvent):
+        if event.removed:
+            with self._priority_lock:
+                for node in event.removed:
+                    self._priority.pop(node, None)
+        self.schedule_probe(event.added + event.changed)
+
+    def schedule_probe(self, nodes: Iterable[str]):
+        """把节点加入优先探测：检测运行中时在检测间隔内立即探测，否则在检测启动后首先探测"""
+        with self._priority_lock:
+            before = len(self._priority)
+            for node in nodes:
+                self._priority[node] = None
+            scheduled = len(self._priority) - before
+        if scheduled:
+            logger.info(f"{scheduled} 个节点加入优先探测")
+            self._wake_event.set()
+
+    def _probe_priority(self):
+        """探测等待优先探测的节点，结果并入排名（只探测锁定区域内、不在黑名单中的节点）"""
+        with self._priority_lock:
+            nodes, self._priority = list(self._priority), {}
+        if not nodes:
+            return
+        nodes = self.node_manager.select_nodes(nodes, self.config.locked_region)
+        if not nodes:
+            return
+
+        logger.info(f"优先探测新节点: {nodes}")
+        try:
+            delays = self.node_manager.measure_nodes(nodes)
+        except Exception as e:
+            logger.error(f"优先探测失败: {e}")
+            return
+        if delays:
+            self.node_manager.merge_ranking(delays)
+        logger.info(f"优先探测完成: {len(delays)}/{len(nodes)} 个节点可用")
+
     def _check_active_connections(self) -> bool:
         """检测代理是否有活跃连接
 
@@ -112,30 +183,23 @@ class DelayChecker:
         if not self.state.delay_history:
             return False
 
-        now = datetime.now()
         # 检查最近5秒内的延迟测试记录
-        recent_records = [
-            r for r in self.state.delay_history
-            if (now - r.timestamp).total_seconds() < 5
-        ]
+        recent_count = self.state.count_recent_records(5, now=self._clock())
 
         # 如果有最近的测试记录，可能是用户活动
-        has_recent_activity = len(recent_records) > 0
+        has_recent_activity = recent_count > 0
 
         if has_recent_activity:
-            logger.info(f"通过流量统计检测到活跃连接 (最近5秒内{len(recent_records)}条记录)")
+            logger.info(f"通过流量统计检测到活跃连接 (最近5秒内{recent_count}条记录)")
         else:
             logger.debug("最近30秒内无延迟测试记录")
 
         return has_recent_activity
 
-    def _notify_callbacks(self):
-        """通知所有回调函数"""
-        for callback in self._callbacks:
-            try:
-                callback()
-            except Exception as e:
-                logger.error(f"回调函数执行失败: {e}")
+    def _publish_check_completed(self, node: Optional[str], delay: Optional[int]):
+        """发布检测周期结束事件"""
+        if self.events:
+            self.events.publish(CheckCompletedEvent(node, delay, self._clock().timestamp()))
 
     def start(self):
         """启动延迟检测"""
@@ -144,8 +208,8 @@ class DelayChecker:
             return
 
         self._running = True
-        self._stop_event.clear()
-        self._thread = threading.Thread(target=self._check_loop, daemon=True)
+        self._wake_event.clear()
+        self._thread = threading.Thread(target=self._check_loop, name='delay-checker', daemon=True)
         self._thread.start()
 
         self.state.is_running = True
@@ -157,7 +221,7 @@ class DelayChecker:
             return
 
         self._running = False
-        self._stop_event.set()
+        self._wake_event.set()
 
         if self._thread:
             self._thread.join(timeout=5)
@@ -169,31 +233,44 @@ class DelayChecker:
         """延迟检测循环"""
         while self._running:
             try:
-                # 执行一次延迟检测
+                # 先探测检测停止期间出现的新节点，再执行一次延迟检测
+                self._probe_priority()
                 self._check_and_switch()
 
                 # 等待指定的检测间隔
-                self._stop_event.wait(self.config.check_interval)
+                self._wait(self.config.check_interval)
 
             except Exception as e:
                 logger.error(f"延迟检测出错: {e}")
                 # 出错后等待一段时间再继续
-                self._stop_event.wait(10)
+                self._wait(10)
+
+    def _wait(self, seconds: float):
+        """等待指定时间，停止或检测间隔被修改时提前返回；期间有优先探测的节点时探测后继续等待"""
+        deadline = time.monotonic() + seconds
+        while self._running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._wake_event.wait(remaining):
+                break
+            self._wake_event.clear()
+            if not self._priority:
+                return
+            self._probe_priority()
+        self._wake_event.clear()
 
     def _check_and_switch(self):
         """检测当前节点并判断是否需要切换（智能版）"""
         try:
             # 检查是否在静默期内
             if self.state.in_silent_period and self.state.silent_until:
-                now = datetime.now()
+                now = self._clock()
                 if now < self.state.silent_until:
                     remaining = (self.state.silent_until - now).total_seconds()
                     logger.info(f"静默期内，剩余 {remaining} 秒，跳过检测")
-                    self._notify_callbacks()
-                    return  # 静默期内不检测
+                    return  # 静默期内不检测，状态未变化，无需通知
 
             # 静默期结束
-            if self.state.in_silent_period and self.state.silent_until and datetime.now() >= self.state.silent_until:
+            if self.state.in_silent_period and self.state.silent_until and self._clock() >= self.state.silent_until:
                 logger.info("静默期结束，恢复检测")
                 self.state.in_silent_period = False
                 self.state.silent_until = None
@@ -206,23 +283,25 @@ class DelayChecker:
                 return
 
             # 测试当前节点延迟
-            delay = self.clash_api.get_delay(
-                current_node,
-                test_url=self.config.test_url,
-                timeout=self.config.test_timeout
-            )
+            delay = self.node_manager.measure_node(current_node)
 
             # 更新状态
             self.state.current_node = current_node
             self.state.current_delay = delay if delay else 0
-            self.state.last_check_time = datetime.now()
+            self.state.last_check_time = self._clock()
+
+            # 清理到期的临时黑名单条目
+            expired = self.state.prune_expired_blacklist(now=self.state.last_check_time.timestamp())
+            if expired:
+                logger.info(f"{expired} 条临时黑名单条目已到期")
 
             # 记录延迟历史
             if delay is not None:
-                self.state.add_delay_record(current_node, delay)
+                self.state.add_delay_record(current_node, delay, timestamp=self.state.last_check_time)
 
             # 判断是否需要切换
             need_switch = False
+            predictive = False
 
             if delay is None:
                 logger.warning(f"节点延迟测试失败: {current_node}")
@@ -234,7 +313,13 @@ class DelayChecker:
                 )
                 need_switch = True
             else:
-                logger.info(f"节点延迟正常: {current_node} ({delay}ms)")
+                reason = self._predict_degradation(current_node)
+                if reason:
+                    logger.warning(f"预测节点即将劣化: {current_node} ({delay}ms, {reason})")
+                    need_switch = True
+                    predictive = True
+                else:
+                    logger.info(f"节点延迟正常: {current_node} ({delay}ms)")
 
             # 智能判断：是否允许切换
             allow_switch = True
@@ -254,7 +339,7 @@ class DelayChecker:
                         # 可选：延长静默期
                         if self.config.active_check_method != 'none':
                             silent_minutes = self.config.silent_period_minutes + 2  # 额外2分钟
-                            self.state.silent_until = datetime.now() + timedelta(minutes=silent_minutes)
+                            self.state.silent_until = self._clock() + timedelta(minutes=silent_minutes)
                             self.state.in_silent_period = True
                             logger.info(f"设置静默期 {silent_minutes} 分钟")
                     else:
@@ -263,28 +348,51 @@ class DelayChecker:
             # 需要切换时，自动选择并切换到最佳节点
             if allow_switch and need_switch:
                 logger.info("触发自动切换...")
-                success = self.node_manager.auto_select_and_switch()
+                # 预测性切换时当前样本仍低于阈值，需跳过对当前节点的复测
+                success = self.node_manager.auto_select_and_switch(force=predictive)
 
                 if success:
                     logger.info("自动切换成功")
                     # 记录切换时间并进入静默期
-                    self.state.last_switch_time = datetime.now()
+                    self.state.last_switch_time = self._clock()
                     self.state.switch_count += 1
 
                     # 设置静默期
                     silent_minutes = self.config.silent_period_minutes
-                    self.state.silent_until = datetime.now() + timedelta(minutes=silent_minutes)
+                    self.state.silent_until = self._clock() + timedelta(minutes=silent_minutes)
                     self.state.in_silent_period = True
                     logger.info(f"切换后进入 {silent_minutes} 分钟静默期")
                 else:
                     logger.warning("自动切换失败")
 
-            # 通知回调函数
-            self._notify_callbacks()
+            # 影子策略评估（复用本周期的探测数据，不额外探测）
+            if self.shadow_evaluator:
+                self._evaluate_shadow(current_node, delay)
+
+            # 发布检测周期结束事件
+            self._publish_check_completed(current_node, delay)
 
         except Exception as e:
             logger.error(f"检测过程出错: {e}")
 
+    def _predict_degradation(self, node: str) -> Optional[str]:
+        """基于节点统计判断当前节点是否已经或即将劣化"""
+        if not (self.config.enable_predictive_switch and self.node_stats):
+            return None
+        return self.node_stats.predict_degradation(
+            node,
+            self.config.delay_threshold,
+            self.config.predict_horizon_seconds
+        )
+
+    def _evaluate_shadow(self, current_node: str, delay: Optional[int]):
+        """让影子策略基于本周期数据给出决策"""
+        try:
+            candidates = self.node_manager.filter_nodes(self.shadow_evaluator.known_nodes())
+            self.shadow_evaluator.evaluate(current_node, delay, candidates, self.state.current_node)
+        except Exception as e:
+            logger.error(f"影子策略评估失败: {e}")
+
     def check_now(self):
         """立即执行一次检测（手动触发）"""
         def _manual_check():
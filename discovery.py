@@ -0,0 +1,124 @@
+"""
+Clash Controller 发现
+服务启动时不等待 Clash：在后台线程中按指数退避探测 Controller，首次可用时执行初始化回调
+（创建节点管理器、延迟检测器并获取初始状态）；Clash 启动得比本服务晚也能自动接管
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 首次重试间隔(秒)
+INITIAL_BACKOFF = 1.0
+# 最长重试间隔(秒)
+MAX_BACKOFF = 60.0
+# 重试间隔的随机抖动比例，避免多个实例同时重试
+JITTER = 0.2
+# 探测 Controller 的 (连接超时, 读取超时)(秒)，比普通请求短得多
+PROBE_TIMEOUT: Tuple[float, float] = (2, 5)
+
+STATE_DISCOVERING = 'discovering'
+STATE_CONNECTED = 'connected'
+STATE_STOPPED = 'stopped'
+
+
+class ControllerDiscovery:
+    """后台发现 Clash Controller
+
+    probe 返回 Controller 是否可用（应使用较短的超时、不重试）；on_available 在 Controller
+    首次可用时调用一次，抛出异常视为本次失败，退避后重新探测。
+    """
+
+    def __init__(self, probe: Callable[[], bool], on_available: Callable[[], None],
+                 initial_backoff: float = INITIAL_BACKOFF, max_backoff: float = MAX_BACKOFF,
+                 clock: Callable[[], float] = time.monotonic):
+        self.probe = probe
+        self.on_available = on_available
+        self.initial_backoff = max(0.01, initial_backoff)
+        self.max_backoff = max(self.initial_backoff, max_backoff)
+        self._clock = clock
+
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.state = STATE_DISCOVERING
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self._started_at: Optional[float] = None
+        self._connected_at: Optional[float] = None
+        self._next_attempt_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        """Controller 已可用且初始化回调已完成"""
+        return self._ready.is_set()
+
+    def start(self):
+        """启动后台发现线程"""
+        if self._thread:
+            return
+        self._stopping = False
+        self._started_at = self._clock()
+        self._thread = threading.Thread(target=self._run, name='controller-discovery', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止发现（不影响已完成的初始化）"""
+        self._stopping = True
+        self._wake.set()
+        if not self.ready:
+            self.state = STATE_STOPPED
+
+    def retry_now(self):
+        """跳过当前的退避等待，立即重新探测"""
+        self._wake.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待 Controller 可用，返回是否已可用"""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        backoff = self.initial_backoff
+        while not self._stopping:
+            self.attempts += 1
+            self._next_attempt_at = None
+            try:
+                if self.probe():
+                    self.on_available()
+                    self._connected_at = self._clock()
+                    self.state = STATE_CONNECTED
+                    self.last_error = None
+                    self._ready.set()
+                    logger.info(f"Clash Controller 已连接（第 {self.attempts} 次探测，"
+                                f"启动后 {self._connected_at - self._started_at:.2f}s）")
+                    return
+                self.last_error = 'Controller 不可用'
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+
+            delay = backoff * random.uniform(1 - JITTER, 1 + JITTER)
+            self._next_attempt_at = self._clock() + delay
+            logger.warning(f"Clash Controller 暂不可用（第 {self.attempts} 次）: {self.last_error}，"
+                           f"{delay:.1f}s 后重试")
+            self._wake.wait(delay)
+            self._wake.clear()
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def status(self) -> Dict:
+        """发现状态"""
+        now = self._clock()
+        return {
+            'state': self.state,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'connected_after_seconds': (round(self._connected_at - self._started_at, 3)
+                                        if self._connected_at is not None else None),
+            'next_attempt_in_seconds': (round(max(0.0, self._next_attempt_at - now), 1)
+                                        if self._next_attempt_at is not None and not self.ready else None)
+        }
@@ -0,0 +1,235 @@
+"""
+进程内事件总线
+ClashAPI、NodeManager、DelayChecker 发布探测、切换、检测周期和配置变更事件，
+持久化、统计、推送等订阅者各自拥有有界队列和工作线程，发布者不等待订阅者处理；
+队列满时丢弃最旧的事件，并按订阅者统计积压和延迟
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type, Union
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者队列的默认容量
+DEFAULT_QUEUE_SIZE = 1000
+# 关闭时等待各订阅者处理完积压事件的最长时间(秒)
+CLOSE_TIMEOUT = 5.0
+
+
+class Event:
+    """事件基类"""
+    pass
+
+
+@dataclass(frozen=True)
+class ProbeEvent(Event):
+    """一次延迟探测完成（delay 为 None 表示失败）"""
+    node: str
+    delay: Optional[int]
+    timestamp: float
+
+
+@dataclass(frozen=True)
+class SwitchEvent(Event):
+    """一次节点切换（reason: manual 手动 / auto 自动）"""
+    from_node: Optional[str]
+    to_node: str
+    success: bool
+    reason: str
+    timestamp: float
+
+
+@dataclass(frozen=True)
+class CheckCompletedEvent(Event):
+    """延迟检测周期结束"""
+    node: Optional[str]
+    delay: Optional[int]
+    timestamp: float
+
+
+@dataclass(frozen=True)
+class ConfigChangedEvent(Event):
+    """配置被修改，changes 为 {字段: 新值}"""
+    changes: Dict[str, Any]
+    timestamp: float
+
+
+@dataclass(frozen=True)
+class ProxiesChangedEvent(Event):
+    """Controller 的 /proxies 条目有变化（订阅更新增删节点、代理组选择或成员变化等）
+
+    added / removed / changed 包含节点和代理组；proxies 为新快照的全部条目（只读），
+    previous_fingerprint / fingerprint 为变化前后的快照指纹。
+    """
+    added: Tuple[str, ...]
+    removed: Tuple[str, ...]
+    changed: Tuple[str, ...]
+    proxies: Dict[str, Any]
+    previous_fingerprint: str
+    fingerprint: str
+    timestamp: float
+
+
+@dataclass(frozen=True)
+class NodesChangedEvent(Event):
+    """可用节点有增删或内容变化（由节点管理器从 ProxiesChangedEvent 中筛出实际节点）"""
+    added: Tuple[str, ...]
+    removed: Tuple[str, ...]
+    changed: Tuple[str, ...]
+    timestamp: float
+
+
+EventTypes = Union[Type[Event], Tuple[Type[Event], ...]]
+
+
+class Subscription:
+    """订阅者：事件类型、处理函数及其队列和统计
+
+    inline 订阅者在发布者线程中直接处理（只用于廉价的内存更新，且发布者随后需要读到结果的场景，
+    如节点统计），不占用队列和工作线程。
+    """
+
+    def __init__(self, name: str, event_types: EventTypes, handler: Callable[[Event], None],
+                 queue_size: int = DEFAULT_QUEUE_SIZE, inline: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.event_types = event_types
+        self.handler = handler
+        self.inline = inline
+        self._clock = clock
+        # (入队时间, 事件)
+        self._queue: Deque[Tuple[float, Event]] = deque(maxlen=max(1, queue_size))
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.delivered = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_lag = 0.0
+
+    def matches(self, event: Event) -> bool:
+        return isinstance(event, self.event_types)
+
+    def deliver(self, event: Event):
+        """投递事件，不等待处理"""
+        self.delivered += 1
+        if self.inline:
+            self._handle(event)
+            return
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) == self._queue.maxlen:
+                # deque 满时 append 会挤掉最旧的事件
+                self.dropped += 1
+            self._queue.append((self._clock(), event))
+            self._cond.notify()
+
+    def _handle(self, event: Event):
+        try:
+            self.handler(event)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"事件订阅者 {self.name} 处理 {type(event).__name__} 失败: {e}")
+        self.processed += 1
+
+    def start(self):
+        if self.inline or self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name=f'events-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                enqueued_at, event = self._queue.popleft()
+            self.max_lag = max(self.max_lag, self._clock() - enqueued_at)
+            self._handle(event)
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        """停止接收新事件，处理完积压后结束工作线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    @property
+    def lag(self) -> float:
+        """最旧的未处理事件已等待的时间(秒)"""
+        with self._cond:
+            if not self._queue:
+                return 0.0
+            return self._clock() - self._queue[0][0]
+
+    def stats(self) -> Dict:
+        return {
+            'name': self.name,
+            'events': [t.__name__ for t in (self.event_types if isinstance(self.event_types, tuple)
+                                            else (self.event_types,))],
+            'inline': self.inline,
+            'pending': self.pending,
+            'capacity': self._queue.maxlen,
+            'delivered': self.delivered,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'lag_seconds': round(self.lag, 3),
+            'max_lag_seconds': round(self.max_lag, 3)
+        }
+
+
+class EventBus:
+    """进程内事件总线"""
+
+    def __init__(self):
+        self._subscriptions: List[Subscription] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, event_types: EventTypes, handler: Callable[[Event], None], name: str,
+                  queue_size: int = DEFAULT_QUEUE_SIZE, inline: bool = False) -> Subscription:
+        """订阅一种或多种事件（含子类），返回订阅者"""
+        subscription = Subscription(name, event_types, handler, queue_size=queue_size, inline=inline)
+        subscription.start()
+        with self._lock:
+            # 写时复制，发布时无需加锁
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """取消订阅（已入队的事件仍会处理完）"""
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+        subscription.close()
+
+    def publish(self, event: Event):
+        """发布事件到所有匹配的订阅者"""
+        for subscription in self._subscriptions:
+            if subscription.matches(event):
+                subscription.deliver(event)
+
+    def stats(self) -> List[Dict]:
+        """各订阅者的积压、丢弃和延迟统计"""
+        return [subscription.stats() for subscription in self._subscriptions]
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        """关闭所有订阅者（先处理完积压的事件）"""
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, []
+        for subscription in subscriptions:
+            subscription.close(timeout)
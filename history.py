@@ -0,0 +1,189 @@
+"""
+延迟历史环形缓冲区
+定长、列式（array）存储的延迟记录，O(1) 追加，窗口视图不复制数据
+"""
+
+import sys
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 全局"最近记录"缓冲区容量（用于状态展示和活跃检测）
+RECENT_CAPACITY = 50
+# 每个节点默认保留的采样数
+DEFAULT_PER_NODE_CAPACITY = 1000
+
+
+class RingBuffer:
+    """定长环形缓冲区
+
+    三列分别保存时间戳(float 秒)、节点 ID 和延迟(int)，写满后覆盖最旧的记录。
+    每条记录的序号为其写入时的累计计数，可用于增量读取。
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("容量必须为正数")
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.node_ids = array('I', bytes(array('I').itemsize * capacity))
+        self.delays = array('i', bytes(array('i').itemsize * capacity))
+        self.total = 0  # 累计写入条数，也是下一条记录的序号
+
+    def append(self, timestamp: float, node_id: int, delay: int) -> int:
+        """追加一条记录，返回其序号"""
+        seq = self.total
+        index = seq % self.capacity
+        self.timestamps[index] = timestamp
+        self.node_ids[index] = node_id
+        self.delays[index] = delay
+        self.total = seq + 1
+        return seq
+
+    @property
+    def first_seq(self) -> int:
+        """缓冲区中最旧记录的序号"""
+        return max(self.total - self.capacity, 0)
+
+    def __len__(self) -> int:
+        return self.total - self.first_seq
+
+    def view(self, last: int = None, since_seq: int = None) -> 'RingView':
+        """最近 last 条（或序号 >= since_seq）记录的视图"""
+        start = self.first_seq
+        if last is not None:
+            start = max(start, self.total - last)
+        if since_seq is not None:
+            start = max(start, since_seq)
+        return RingView(self, start, self.total)
+
+
+class RingView:
+    """环形缓冲区的窗口视图，不复制底层数据
+
+    视图创建后若缓冲区继续写入并覆盖了视图范围内的旧记录，迭代时会自动跳过被覆盖的部分。
+    """
+
+    def __init__(self, buffer: RingBuffer, start_seq: int, end_seq: int):
+        self.buffer = buffer
+        self.start_seq = start_seq
+        self.end_seq = end_seq
+
+    def _valid_start(self) -> int:
+        return max(self.start_seq, self.buffer.first_seq)
+
+    def __len__(self) -> int:
+        return max(self.end_seq - self._valid_start(), 0)
+
+    def __iter__(self) -> Iterator[Tuple[int, float, int, int]]:
+        """按时间顺序迭代 (序号, 时间戳, 节点ID, 延迟)"""
+        buffer = self.buffer
+        capacity = buffer.capacity
+        for seq in range(self._valid_start(), self.end_seq):
+            index = seq % capacity
+            yield seq, buffer.timestamps[index], buffer.node_ids[index], buffer.delays[index]
+
+    def segments(self, column: str) -> List[memoryview]:
+        """返回某一列在视图范围内的连续内存段（最多两段，零拷贝）"""
+        data = memoryview(getattr(self.buffer, column))
+        capacity = self.buffer.capacity
+        start = self._valid_start()
+        if start >= self.end_seq:
+            return []
+        begin = start % capacity
+        end = begin + (self.end_seq - start)
+        if end <= capacity:
+            return [data[begin:end]]
+        return [data[begin:], data[:end - capacity]]
+
+    def delays(self) -> List[int]:
+        """视图内的延迟列表"""
+        result = []
+        for segment in self.segments('delays'):
+            result.extend(segment)
+        return result
+
+
+class DelayHistory:
+    """延迟历史
+
+    节点名被驻留为整数 ID；维护一个全局最近记录缓冲区，以及每个节点独立的缓冲区
+    （未启用长期时序存储时 /api/history 从中查询）。本类不加锁，并发访问由 RuntimeState.lock 保护。
+    """
+
+    def __init__(self, recent_capacity: int = RECENT_CAPACITY,
+                 per_node_capacity: int = DEFAULT_PER_NODE_CAPACITY):
+        self.per_node_capacity = per_node_capacity
+        self.recent = RingBuffer(recent_capacity)
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._per_node: Dict[int, RingBuffer] = {}
+
+    def node_id(self, node_name: str) -> int:
+        """获取（必要时分配）节点 ID"""
+        node_id = self._ids.get(node_name)
+        if node_id is None:
+            node_id = len(self._names)
+            self._names.append(sys.intern(node_name))
+            self._ids[self._names[node_id]] = node_id
+        return node_id
+
+    def node_name(self, node_id: int) -> str:
+        """根据 ID 获取节点名"""
+        return self._names[node_id]
+
+    def append(self, node_name: str, delay: int, timestamp: float) -> int:
+        """追加一条记录，返回其在全局缓冲区中的序号"""
+        node_id = self.node_id(node_name)
+        buffer = self._per_node.get(node_id)
+        if buffer is None:
+            buffer = self._per_node[node_id] = RingBuffer(self.per_node_capacity)
+        buffer.append(timestamp, node_id, delay)
+        return self.recent.append(timestamp, node_id, delay)
+
+    def __len__(self) -> int:
+        return len(self.recent)
+
+    def recent_view(self, last: int = None, since_seq: int = None) -> RingView:
+        """全局最近记录视图"""
+        return self.recent.view(last, since_seq)
+
+    def node_view(self, node_name: str, last: int = None) -> Optional[RingView]:
+        """单个节点的记录视图"""
+        buffer = self._per_node.get(self._ids.get(node_name))
+        if buffer is None:
+            return None
+        return buffer.view(last)
+
+    def node_names(self) -> List[str]:
+        """有独立缓冲区的节点"""
+        return sorted(self._names[node_id] for node_id in self._per_node)
+
+    def forget(self, node_names: Iterable[str]):
+        """释放已消失节点的缓冲区（节点 ID 保留，全局缓冲区中的记录仍引用它）"""
+        for node_name in node_names:
+            node_id = self._ids.get(node_name)
+            if node_id is not None:
+                self._per_node.pop(node_id, None)
+
+    def count_since(self, timestamp: float) -> int:
+        """统计全局缓冲区中时间戳不早于 timestamp 的记录数"""
+        count = 0
+        buffer = self.recent
+        for seq in range(buffer.total - 1, buffer.first_seq - 1, -1):
+            if buffer.timestamps[seq % buffer.capacity] < timestamp:
+                break
+            count += 1
+        return count
+
+    def rows(self, view: RingView) -> List[Dict]:
+        """将视图转换为字典列表 [{seq, node_name, delay, timestamp(ISO 格式)}]"""
+        return [
+            {
+                'seq': seq,
+                'node_name': self._names[node_id],
+                'delay': delay,
+                'timestamp': datetime.fromtimestamp(timestamp).isoformat()
+            }
+            for seq, timestamp, node_id, delay in view
+        ]
@@ -0,0 +1,75 @@
+"""
+Prometheus 指标
+把运行状态、节点统计、事件总线和 Controller 连接状态渲染为 Prometheus 文本格式，
+只依赖标准库，无界面守护进程和 Web 服务共用
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+from discovery import STATE_CONNECTED, ControllerDiscovery
+from events import EventBus
+from models import RuntimeState
+from node_stats import NodeStatsTable
+
+# 指标名前缀
+PREFIX = 'clash_auto_switch'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Sample = Tuple[str, float]
+
+
+def _escape(value: str) -> str:
+    """标签值转义（反斜杠、双引号、换行）"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value: float) -> str:
+    """整数原样输出，浮点数保留全部精度（时间戳）"""
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, samples: Iterable[Sample]):
+    lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+    lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{PREFIX}_{name}{labels} {_format(value)}")
+
+
+def _label(name: str, value: str) -> str:
+    return f'{{{name}="{_escape(value)}"}}'
+
+
+def render(state: RuntimeState, node_stats: Optional[NodeStatsTable] = None,
+           discovery: Optional[ControllerDiscovery] = None, event_bus: Optional[EventBus] = None,
+           checker_running: bool = False) -> str:
+    """渲染全部指标"""
+    data = state.snapshot().data
+    lines: List[str] = []
+
+    connected = discovery is not None and discovery.state == STATE_CONNECTED
+    _metric(lines, 'controller_connected', 'gauge', 'Clash Controller 是否已连接', [('', int(connected))])
+    _metric(lines, 'checker_running', 'gauge', '延迟检测是否运行中', [('', int(checker_running))])
+    if data['current_node']:
+        _metric(lines, 'current_node_info', 'gauge', '当前节点',
+                [(_label('node', data['current_node']), 1)])
+    _metric(lines, 'current_delay_milliseconds', 'gauge', '当前节点最近一次检测的延迟',
+            [('', data['current_delay'] or 0)])
+    _metric(lines, 'switches_total', 'counter', '自动和手动切换次数', [('', data['switch_count'])])
+    _metric(lines, 'available_nodes', 'gauge', '可用节点数', [('', len(data['available_nodes']))])
+    _metric(lines, 'blacklisted_nodes', 'gauge', '黑名单节点数', [('', len(data['blacklist']))])
+    _metric(lines, 'blacklist_rules', 'gauge', '生效的黑名单规则数', [('', len(data['blacklist_rules']))])
+    _metric(lines, 'silent_period', 'gauge', '是否处于静默期', [('', int(data['in_silent_period']))])
+    if state.last_check_time:
+        _metric(lines, 'last_check_timestamp_seconds', 'gauge', '上次检测时间',
+                [('', state.last_check_time.timestamp())])
+    if node_stats is not None:
+        _metric(lines, 'probes_total', 'counter', '延迟探测次数', [('', node_stats.observations)])
+    if event_bus is not None:
+        subscribers = event_bus.stats()
+        _metric(lines, 'event_queue_pending', 'gauge', '事件订阅者积压的事件数',
+                [(_label('subscriber', s['name']), s['pending']) for s in subscribers])
+        _metric(lines, 'event_dropped_total', 'counter', '事件订阅者队列满时丢弃的事件数',
+                [(_label('subscriber', s['name']), s['dropped']) for s in subscribers])
+        _metric(lines, 'event_errors_total', 'counter', '事件订阅者处理失败次数',
+                [(_label('subscriber', s['name']), s['errors']) for s in subscribers])
+    return '\n'.join(lines) + '\n'
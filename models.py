@@ -4,9 +4,16 @@
 """
 
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import ClassVar, Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
+import hashlib
+import itertools
 import threading
+import time
+
+from blacklist import BlacklistMatcher, BlacklistRule, active_rules
+from history import DelayHistory, DEFAULT_PER_NODE_CAPACITY
+import payload
 
 
 @dataclass
@@ -27,6 +34,58 @@ class Config:
     enable_active_detection: bool = True  # 是否启用活跃连接检测
     active_check_method: str = 'api'  # 活跃检测方法: 'api'(流量), 'traffic'(统计), 'none'(禁用)
 
+    # 影子策略（只评估不执行），格式见 shadow.build_policies
+    shadow_policies: str = ''
+
+    # 预测性切换配置
+    enable_predictive_switch: bool = False  # 是否根据窗口 p90 和趋势预测提前切换
+    predict_window: int = 20  # 分位数滑动窗口(样本数)
+    predict_horizon_seconds: int = 120  # 趋势预测的时间范围(秒)
+
+    # 多样本探测配置
+    probe_samples: int = 1  # 每次探测的采样次数，1 表示单样本（原有行为）
+    rank_by: str = 'median'  # 节点排序依据: 'median', 'min', 'score'(中位数+抖动+丢包惩罚)
+
+    # 热启动：定期保存节点统计和排名，重启后恢复
+    enable_warm_start: bool = True
+    warm_start_max_age_minutes: int = 60  # 快照超过此时长视为过期，不再恢复
+    standby_max_age_seconds: int = 600  # 排名在此时长内有效，切换时优先复测排名靠前的备用节点
+
+    # 每个节点在内存中保留的延迟记录数
+    history_capacity: int = DEFAULT_PER_NODE_CAPACITY
+
+    # 长期延迟时序存储（DATA_DIR/history.db）
+    enable_history_store: bool = True
+    history_raw_retention_days: int = 2  # 原始探测记录保留天数
+    history_minute_retention_days: int = 14  # 1 分钟汇总保留天数
+    history_hour_retention_days: int = 365  # 1 小时汇总保留天数
+
+    # 探测日志（DATA_DIR/probes，列式二进制，长期保存原始探测结果）
+    enable_probe_log: bool = False
+    probe_log_retention_days: int = 180  # 超过保留期的整段文件会被删除，0 表示不删除
+
+    # Web 接口复用节点列表快照的最长时间(秒)，超过后重新从 Clash 获取，0 表示每次都获取
+    proxies_cache_seconds: int = 30
+
+    # 手动测速（单个和批量）共用的并发探测数
+    probe_workers: int = 8
+
+    # Socket.IO 推送：合并窗口(毫秒)，窗口内的多次更新只推送一次；每个客户端待发送消息的上限
+    broadcast_window_ms: int = 200
+    broadcast_queue_size: int = 100
+
+    # 运行中可通过 Web 界面修改、需要持久化的字段；其余字段为部署配置，只从环境变量读取
+    PERSISTED_FIELDS: ClassVar[Tuple[str, ...]] = (
+        'clash_api_url', 'clash_secret', 'proxy_group', 'delay_threshold', 'check_interval',
+        'locked_region', 'test_timeout', 'test_url',
+        'silent_period_minutes', 'min_delay_for_switch', 'enable_active_detection', 'active_check_method',
+        'probe_samples', 'rank_by', 'enable_predictive_switch', 'predict_horizon_seconds', 'shadow_policies'
+    )
+
+    def persisted_dict(self) -> Dict:
+        """需要持久化的字段"""
+        return {key: getattr(self, key) for key in self.PERSISTED_FIELDS}
+
     def to_dict(self) -> Dict:
         """转换为字典"""
         return {
@@ -41,7 +100,27 @@ class Config:
             'silent_period_minutes': self.silent_period_minutes,
             'min_delay_for_switch': self.min_delay_for_switch,
             'enable_active_detection': self.enable_active_detection,
-            'active_check_method': self.active_check_method
+            'active_check_method': self.active_check_method,
+            'shadow_policies': self.shadow_policies,
+            'enable_predictive_switch': self.enable_predictive_switch,
+            'predict_window': self.predict_window,
+            'predict_horizon_seconds': self.predict_horizon_seconds,
+            'probe_samples': self.probe_samples,
+            'rank_by': self.rank_by,
+            'enable_warm_start': self.enable_warm_start,
+            'warm_start_max_age_minutes': self.warm_start_max_age_minutes,
+            'standby_max_age_seconds': self.standby_max_age_seconds,
+            'history_capacity': self.history_capacity,
+            'enable_history_store': self.enable_history_store,
+            'history_raw_retention_days': self.history_raw_retention_days,
+            'history_minute_retention_days': self.history_minute_retention_days,
+            'history_hour_retention_days': self.history_hour_retention_days,
+            'enable_probe_log': self.enable_probe_log,
+            'probe_log_retention_days': self.probe_log_retention_days,
+            'proxies_cache_seconds': self.proxies_cache_seconds,
+            'probe_workers': self.probe_workers,
+            'broadcast_window_ms': self.broadcast_window_ms,
+            'broadcast_queue_size': self.broadcast_queue_size
         }
 
     @classmethod
@@ -51,31 +130,136 @@ class Config:
 
 
 @dataclass
-class DelayRecord:
-    """延迟记录"""
+class ProbeResult:
+    """多样本探测结果"""
     node_name: str
-    delay: int
-    timestamp: datetime
+    samples: List[Optional[int]] = field(default_factory=list)  # None 表示该次采样失败
+
+    @property
+    def delays(self) -> List[int]:
+        """成功的采样"""
+        return [s for s in self.samples if s is not None]
+
+    @property
+    def median(self) -> Optional[int]:
+        """中位数延迟"""
+        delays = sorted(self.delays)
+        if not delays:
+            return None
+        mid = len(delays) // 2
+        if len(delays) % 2:
+            return delays[mid]
+        return round((delays[mid - 1] + delays[mid]) / 2)
+
+    @property
+    def min(self) -> Optional[int]:
+        """最小延迟"""
+        delays = self.delays
+        return min(delays) if delays else None
+
+    @property
+    def jitter(self) -> float:
+        """抖动：相邻成功采样差值绝对值的平均"""
+        delays = self.delays
+        if len(delays) < 2:
+            return 0.0
+        return sum(abs(b - a) for a, b in zip(delays, delays[1:])) / (len(delays) - 1)
+
+    @property
+    def loss(self) -> float:
+        """丢包率"""
+        if not self.samples:
+            return 1.0
+        return 1 - len(self.delays) / len(self.samples)
+
+    def rank_value(self, rank_by: str = 'median', loss_penalty: int = 5000) -> Optional[float]:
+        """排序用的数值（越小越好），全部失败时返回 None"""
+        if self.median is None:
+            return None
+        if rank_by == 'min':
+            return self.min
+        if rank_by == 'score':
+            return self.median + self.jitter + self.loss * loss_penalty
+        return self.median
 
     def to_dict(self) -> Dict:
         """转换为字典"""
         return {
             'node_name': self.node_name,
-            'delay': self.delay,
-            'timestamp': self.timestamp.isoformat()
+            'samples': self.samples,
+            'median': self.median,
+            'min': self.min,
+            'jitter': round(self.jitter, 1),
+            'loss': round(self.loss, 3)
+        }
+
+
+class StateSnapshot:
+    """运行时状态的不可变快照
+
+    data 由所有读者共享，调用方不得修改；JSON 序列化结果按版本缓存。
+    """
+
+    __slots__ = ('version', 'data', 'history_seq', '_json', '_etag')
+
+    def __init__(self, version: int, data: Dict, history_seq: int):
+        self.version = version
+        self.data = data
+        self.history_seq = history_seq  # 快照包含的最后一条延迟记录之后的序号
+        self._json: Optional[bytes] = None
+        self._etag: Optional[str] = None
+
+    def to_json(self) -> bytes:
+        """序列化为 JSON（UTF-8），同一快照只序列化一次"""
+        if self._json is None:
+            self._json = payload.dumps(self.data)
+        return self._json
+
+    @property
+    def etag(self) -> str:
+        """JSON 内容的强 ETag"""
+        if self._etag is None:
+            self._etag = hashlib.blake2b(self.to_json(), digest_size=16).hexdigest()
+        return self._etag
+
+    def delta_since(self, previous: 'StateSnapshot') -> Dict:
+        """计算相对于旧快照的增量：变化的字段和新追加的延迟记录"""
+        changed = {
+            key: value for key, value in self.data.items()
+            if key not in _DELTA_EXCLUDED_KEYS and previous.data.get(key) != value
+        }
+        history = [row for row in self.data['delay_history'] if row['seq'] >= previous.history_seq]
+        return {
+            'from_version': previous.version,
+            'version': self.version,
+            'changed': changed,
+            'history': history
         }
 
 
+# 增量中单独处理的快照字段
+_DELTA_EXCLUDED_KEYS = frozenset({'version', 'delay_history'})
+
+# 不参与版本号的字段
+_UNVERSIONED_FIELDS = frozenset({'lock'})
+_MISSING = object()
+
+
 @dataclass
 class RuntimeState:
-    """运行时状态"""
+    """运行时状态
+
+    任何字段赋值都会递增版本号；读者通过 snapshot() 获取按版本缓存的不可变快照，
+    无需持有锁。黑名单、黑名单规则和可用节点列表采用写时复制：修改时整体替换，不原地修改。
+    """
     current_node: str = ''
     current_delay: int = 0
     last_check_time: Optional[datetime] = None
     switch_count: int = 0
     blacklist: set = field(default_factory=set)
+    blacklist_rules: Tuple[BlacklistRule, ...] = ()  # 通配符/正则/关键词规则及临时条目
     available_nodes: List[str] = field(default_factory=list)
-    delay_history: List[DelayRecord] = field(default_factory=list)
+    delay_history: DelayHistory = field(default_factory=DelayHistory)
     is_running: bool = False
     lock: threading.Lock = field(default_factory=threading.Lock)
 
@@ -86,53 +270,164 @@ class RuntimeState:
     active_detection_enabled: bool = False  # 是否启用活跃连接检测
     has_active_connections: bool = False  # 检测到活跃连接
 
-    def to_dict(self) -> Dict:
-        """转换为字典"""
+    def __setattr__(self, name, value):
+        previous = self.__dict__.get(name, _MISSING)
+        object.__setattr__(self, name, value)
+        if name in self.__dataclass_fields__ and name not in _UNVERSIONED_FIELDS:
+            # 赋相同的值不算变化，避免每个周期都使快照失效
+            if previous is _MISSING or (previous is not value and previous != value):
+                self._bump_version()
+
+    def _bump_version(self):
+        """递增版本号（itertools.count 在 GIL 下是原子的）"""
+        counter = self.__dict__.get('_version_counter')
+        if counter is None:
+            counter = itertools.count(1)
+            object.__setattr__(self, '_version_counter', counter)
+            object.__setattr__(self, '_snapshot', None)
+        object.__setattr__(self, 'version', next(counter))
+
+    def snapshot(self) -> StateSnapshot:
+        """获取当前版本的快照，状态未变化时直接返回缓存"""
+        snapshot = self._snapshot
+        version = self.version
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        # 只有复制延迟历史时需要短暂持锁
         with self.lock:
-            return {
-                'current_node': self.current_node,
-                'current_delay': self.current_delay,
-                'last_check_time': self.last_check_time.isoformat() if self.last_check_time else None,
-                'switch_count': self.switch_count,
-                'blacklist': list(self.blacklist),
-                'available_nodes': self.available_nodes.copy(),
-                'delay_history': [record.to_dict() for record in self.delay_history[-20:]],  # 只保留最近20条
-                'is_running': self.is_running,
-                # 智能切换相关
-                'in_silent_period': self.in_silent_period,
-                'silent_until': self.silent_until.isoformat() if self.silent_until else None,
-                'last_switch_time': self.last_switch_time.isoformat() if self.last_switch_time else None,
-                'active_detection_enabled': self.active_detection_enabled,
-                'has_active_connections': self.has_active_connections
-            }
+            history = self.delay_history
+            history_rows = history.rows(history.recent_view(20))  # 只保留最近20条
+            history_seq = history.recent.total
+
+        data = {
+            'version': version,
+            'current_node': self.current_node,
+            'current_delay': self.current_delay,
+            'last_check_time': self.last_check_time.isoformat() if self.last_check_time else None,
+            'switch_count': self.switch_count,
+            'blacklist': list(self.blacklist),
+            'blacklist_rules': [rule.to_dict() for rule in active_rules(self.blacklist_rules)],
+            'available_nodes': list(self.available_nodes),
+            'delay_history': history_rows,
+            'is_running': self.is_running,
+            # 智能切换相关
+            'in_silent_period': self.in_silent_period,
+            'silent_until': self.silent_until.isoformat() if self.silent_until else None,
+            'last_switch_time': self.last_switch_time.isoformat() if self.last_switch_time else None,
+            'active_detection_enabled': self.active_detection_enabled,
+            'has_active_connections': self.has_active_connections
+        }
+        snapshot = StateSnapshot(version, data, history_seq)
+        object.__setattr__(self, '_snapshot', snapshot)
+        return snapshot
+
+    def to_dict(self) -> Dict:
+        """转换为字典（共享的快照数据，只读）"""
+        return self.snapshot().data
+
+    def to_json(self) -> bytes:
+        """序列化为 JSON，按版本缓存"""
+        return self.snapshot().to_json()
 
     def add_blacklist(self, node_name: str):
         """添加黑名单"""
         with self.lock:
-            self.blacklist.add(node_name)
+            self.blacklist = self.blacklist | {node_name}
 
     def remove_blacklist(self, node_name: str):
         """移除黑名单"""
         with self.lock:
-            self.blacklist.discard(node_name)
+            self.blacklist = self.blacklist - {node_name}
+
+    def add_blacklist_rule(self, rule: BlacklistRule):
+        """添加黑名单规则（同一规则重复添加时更新过期时间）"""
+        with self.lock:
+            rules = [r for r in self.blacklist_rules if r.key != rule.key]
+            self.blacklist_rules = tuple(rules) + (rule,)
+
+    def remove_blacklist_rule(self, key: str) -> bool:
+        """按标识删除黑名单规则"""
+        with self.lock:
+            rules = tuple(r for r in self.blacklist_rules if r.key != key)
+            if len(rules) == len(self.blacklist_rules):
+                return False
+            self.blacklist_rules = rules
+            return True
+
+    def prune_expired_blacklist(self, now: float = None) -> int:
+        """删除已过期的临时条目，返回删除数量"""
+        with self.lock:
+            rules = active_rules(self.blacklist_rules, now)
+            removed = len(self.blacklist_rules) - len(rules)
+            if removed:
+                self.blacklist_rules = rules
+            return removed
+
+    def blacklist_matcher(self) -> BlacklistMatcher:
+        """当前规则编译得到的匹配器，规则变化或有条目到期时重新编译"""
+        matcher = self.__dict__.get('_blacklist_matcher')
+        if matcher is None or matcher.stale(self.blacklist_rules):
+            matcher = BlacklistMatcher(self.blacklist_rules)
+            object.__setattr__(self, '_blacklist_matcher', matcher)
+        return matcher
 
     def is_blacklisted(self, node_name: str) -> bool:
-        """检查是否在黑名单中"""
+        """检查是否在黑名单中
+
+        规则匹配结果按匹配器缓存：规则不变时每个节点只匹配一次，规则变化或到期后重新匹配。
+        """
+        if node_name in self.blacklist:
+            return True
+        matcher = self.blacklist_matcher()
+        if not matcher:
+            return False
+
+        cache = self.__dict__.get('_blacklist_cache')
+        if cache is None or cache[0] is not matcher:
+            cache = (matcher, {})
+            object.__setattr__(self, '_blacklist_cache', cache)
+        result = cache[1].get(node_name)
+        if result is None:
+            result = cache[1][node_name] = matcher.matches(node_name)
+        return result
+
+    def forget_nodes(self, nodes: Iterable[str]):
+        """从黑名单匹配缓存和每节点延迟历史中移除已消失的节点（不改变状态版本）"""
+        nodes = list(nodes)
+        with self.lock:
+            self.delay_history.forget(nodes)
+        cache = self.__dict__.get('_blacklist_cache')
+        if cache is None:
+            return
+        for node in nodes:
+            cache[1].pop(node, None)
+
+    def node_history(self, node_name: str, start: float, end: float) -> List[Dict]:
+        """内存中单个节点在 [start, end) 内的延迟记录 [{'t': 时间戳, 'delay': 延迟}]"""
         with self.lock:
-            return node_name in self.blacklist
+            view = self.delay_history.node_view(node_name)
+            if view is None:
+                return []
+            return [{'t': ts, 'delay': delay} for _, ts, _, delay in view if start <= ts < end]
 
-    def add_delay_record(self, node_name: str, delay: int):
+    def history_nodes(self) -> List[str]:
+        """内存中有延迟历史的节点"""
+        with self.lock:
+            return self.delay_history.node_names()
+
+    def add_delay_record(self, node_name: str, delay: int, timestamp: Optional[datetime] = None):
         """添加延迟记录"""
+        ts = timestamp.timestamp() if timestamp else time.time()
+        with self.lock:
+            self.delay_history.append(node_name, delay, ts)
+        self._bump_version()
+
+    def count_recent_records(self, seconds: float, now: Optional[datetime] = None) -> int:
+        """统计最近 seconds 秒内的延迟记录数"""
+        now_ts = now.timestamp() if now else time.time()
         with self.lock:
-            record = DelayRecord(
-                node_name=node_name,
-                delay=delay,
-                timestamp=datetime.now()
-            )
-            self.delay_history.append(record)
-            # 只保留最近50条记录
-            if len(self.delay_history) > 50:
-                self.delay_history = self.delay_history[-50:]
+            return self.delay_history.count_since(now_ts - seconds)
 
     def increment_switch_count(self):
         """增加切换次数"""
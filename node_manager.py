@@ -4,64 +4,135 @@
 """
 
 import logging
-from typing import List, Optional, Dict, Tuple
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Dict, Tuple
+from blacklist import BlacklistRule
 from clash_api import ClashAPI
+from events import EventBus, NodesChangedEvent, ProxiesChangedEvent, SwitchEvent
 from models import Config, RuntimeState
 
 logger = logging.getLogger(__name__)
 
+# 切换时优先复测的备用节点数（上次排名靠前的节点）
+STANDBY_COUNT = 3
+
+# 常见的区域关键词
+REGION_KEYWORDS = [
+    '香港', 'HK', 'Hong Kong',
+    '日本', 'JP', 'Japan', '东京', '大阪',
+    '新加坡', 'SG', 'Singapore',
+    '美国', 'US', 'USA', 'United States',
+    '韩国', 'KR', 'Korea',
+    '台湾', 'TW', 'Taiwan',
+    '英国', 'UK', 'GB', 'United Kingdom',
+    '德国', 'DE', 'Germany',
+    '加拿大', 'CA', 'Canada'
+]
+
+# 实际节点类型（SS, SSR, V2Ray, Trojan 等）
+NODE_TYPES = frozenset({'Shadowsocks', 'ShadowsocksR', 'V2Ray', 'Trojan', 'Snell'})
+
+
+def region_matches(node: str, region: str) -> bool:
+    """节点名是否属于区域（忽略大小写包含）"""
+    return region.lower() in node.lower() or region in node
+
+
+def is_node(info: Optional[Dict]) -> bool:
+    """/proxies 条目是否为实际节点（跳过代理组和 DIRECT 等特殊节点）"""
+    return bool(info) and info.get('type') in NODE_TYPES
+
+
+def node_region(node: str) -> Optional[str]:
+    """节点名匹配的第一个区域关键词"""
+    node_lower = node.lower()
+    for keyword in REGION_KEYWORDS:
+        if keyword.lower() in node_lower:
+            return keyword
+    return None
+
 
 class NodeManager:
     """节点管理器"""
 
-    def __init__(self, clash_api: ClashAPI, config: Config, state: RuntimeState):
+    def __init__(self, clash_api: ClashAPI, config: Config, state: RuntimeState,
+                 clock: Callable[[], float] = time.time, events: EventBus = None):
         self.clash_api = clash_api
         self.config = config
         self.state = state
-
-    def get_available_nodes(self) -> List[str]:
-        """获取可用节点列表"""
+        self._clock = clock
+        # 每次切换后发布 SwitchEvent
+        self.events = events
+
+        # 上次全量测速的排名 [(节点, 排序值)]，按排序值升序
+        self.last_ranking: List[Tuple[str, float]] = []
+        self.ranked_at: Optional[float] = None
+        # 区域关键词 -> 节点列表，及其对应的 /proxies 快照指纹（节点列表变化时增量更新）
+        self.region_index: Dict[str, List[str]] = {}
+        self._region_index_fingerprint: Optional[str] = None
+        self._churn_lock = threading.Lock()
+
+        # 订阅 /proxies 条目变化，增量更新可用节点、区域索引和排名，并发布 NodesChangedEvent
+        self._subscription = None
+        if events:
+            self._subscription = events.subscribe(ProxiesChangedEvent, self._on_proxies_changed,
+                                                  name='node_manager')
+
+    def close(self):
+        """取消事件订阅（组件创建失败或被替换时调用）"""
+        if self._subscription:
+            self.events.unsubscribe(self._subscription)
+            self._subscription = None
+
+    def get_available_nodes(self, max_age: float = 0) -> List[str]:
+        """获取可用节点列表，max_age 秒内获取过的节点列表可直接复用"""
         try:
-            all_proxies = self.clash_api.get_proxies()
-
-            # 过滤掉代理组和特殊节点
-            node_list = []
-            for name, info in all_proxies.items():
-                # 跳过代理组（如 PROXY, DIRECT 等）
-                if info.get('type') in ['Selector', 'URLTest', 'Fallback', 'LoadBalance']:
-                    continue
-                # 只保留实际节点（SS, SSR, V2Ray, Trojan 等）
-                if info.get('type') in ['Shadowsocks', 'ShadowsocksR', 'V2Ray', 'Trojan', 'Snell']:
-                    node_list.append(name)
-
-            return node_list
+            all_proxies = self.clash_api.get_proxies(max_age)
+
+            # 过滤掉代理组（如 PROXY）和特殊节点（如 DIRECT），只保留实际节点
+            return [name for name, info in all_proxies.items() if is_node(info)]
         except Exception as e:
             logger.error(f"获取节点列表失败: {e}")
             return []
 
-    def filter_nodes(self, nodes: List[str] = None) -> List[str]:
-        """根据区域和黑名单过滤节点"""
+    def filter_nodes(self, nodes: List[str] = None, region: str = None) -> List[str]:
+        """根据区域和黑名单过滤节点（记录过滤过程），region 为 None 时使用配置的锁定区域"""
         if nodes is None:
             nodes = self.get_available_nodes()
             logger.info(f"原始节点列表: {nodes}")
+        if region is None:
+            region = self.config.locked_region
 
         # 应用区域过滤
-        if self.config.locked_region:
-            logger.info(f"应用区域过滤: {self.config.locked_region}")
+        if region:
+            logger.info(f"应用区域过滤: {region}")
             original_count = len(nodes)
-            nodes = self._filter_by_region(nodes, self.config.locked_region)
+            nodes = self._filter_by_region(nodes, region)
             logger.info(f"区域过滤: {original_count} -> {len(nodes)} 个节点")
             logger.info(f"过滤后的节点列表: {nodes}")
 
-        # 应用黑名单过滤
-        original_count_after_region = len(nodes)
-        nodes = [node for node in nodes if not self.state.is_blacklisted(node)]
-        logger.info(f"黑名单过滤: {original_count_after_region} -> {len(nodes)} 个节点")
-        if original_count_after_region != len(nodes):
-            logger.info(f"被黑名单过滤的节点: {[n for n in self.state.blacklist if n in [n for n in nodes if n not in [node for node in nodes if not self.state.is_blacklisted(node)]]]}")
+        # 应用黑名单过滤（精确名单和规则，每个节点只判断一次）
+        allowed, blocked = [], []
+        for node in nodes:
+            (blocked if self.state.is_blacklisted(node) else allowed).append(node)
+        logger.info(f"黑名单过滤: {len(nodes)} -> {len(allowed)} 个节点")
+        if blocked:
+            logger.info(f"被黑名单过滤的节点: {blocked}")
+        nodes = allowed
 
         return nodes
 
+    def select_nodes(self, nodes: List[str], region: str = '') -> List[str]:
+        """按区域和黑名单过滤节点
+
+        只读取参数和黑名单，不读取也不修改配置、不记录日志，可供 Web 请求与检测周期并发调用。
+        """
+        is_blacklisted = self.state.is_blacklisted
+        return [node for node in nodes
+                if (not region or region_matches(node, region)) and not is_blacklisted(node)]
+
     def _filter_by_region(self, nodes: List[str], region: str) -> List[str]:
         """根据区域过滤节点"""
         region_lower = region.lower()
@@ -70,15 +141,9 @@ class NodeManager:
         logger.info(f"待过滤的节点: {nodes}")
 
         for node in nodes:
-            node_lower = node.lower()
-            # 检查是否匹配区域
-            match = region_lower in node_lower
-            if match:
+            if region_matches(node, region):
                 filtered.append(node)
-                logger.debug(f"✅ '{node}' 匹配区域 '{region}' (小写匹配)")
-            elif region in node:  # 精确匹配
-                filtered.append(node)
-                logger.debug(f"✅ '{node}' 匹配区域 '{region}' (精确匹配)")
+                logger.debug(f"✅ '{node}' 匹配区域 '{region}'")
             else:
                 logger.debug(f"❌ '{node}' 不匹配区域 '{region}'")
 
@@ -104,11 +169,7 @@ class NodeManager:
 
         # 批量测试延迟 - 确保只测试传入的节点
         logger.info(f"开始测试 {len(nodes)} 个节点的延迟，节点列表: {nodes}")
-        delays = self.clash_api.test_multiple_delays(
-            nodes,
-            test_url=self.config.test_url,
-            timeout=self.config.test_timeout
-        )
+        delays = self.measure_nodes(nodes)
 
         if not delays:
             logger.warning("所有节点延迟测试失败")
@@ -127,6 +188,10 @@ class NodeManager:
         for node, delay in sorted(delays.items(), key=lambda x: x[1]):
             logger.info(f"  {node}: {delay}ms")
 
+        # 记录排名，供下次切换时优先复测备用节点
+        self.last_ranking = sorted(delays.items(), key=lambda x: x[1])
+        self.ranked_at = self._clock()
+
         # 选择延迟最低的节点
         best_node = min(delays.items(), key=lambda x: x[1])[0]
         best_delay = delays[best_node]
@@ -142,6 +207,97 @@ class NodeManager:
 
         return best_node
 
+    def standby_candidates(self, nodes: List[str] = None, exclude: str = None) -> List[str]:
+        """上次排名中靠前的备用节点（排名过期时为空）"""
+        if not self.last_ranking or self.ranked_at is None:
+            return []
+        if self._clock() - self.ranked_at > self.config.standby_max_age_seconds:
+            return []
+
+        allowed = set(nodes) if nodes is not None else None
+        candidates = []
+        for node, _ in self.last_ranking:
+            if node == exclude or self.state.is_blacklisted(node):
+                continue
+            if allowed is not None and node not in allowed:
+                continue
+            candidates.append(node)
+            if len(candidates) >= STANDBY_COUNT:
+                break
+        return candidates
+
+    def restore_ranking(self, ranking: List[Tuple[str, float]], ranked_at: float):
+        """恢复之前保存的排名（热启动）"""
+        self.last_ranking = sorted(((node, value) for node, value in ranking), key=lambda x: x[1])
+        self.ranked_at = ranked_at
+
+    def merge_ranking(self, delays: Dict[str, float]):
+        """把部分节点的测速结果并入上次的排名（不刷新排名时间）"""
+        ranking = dict(self.last_ranking)
+        ranking.update(delays)
+        self.last_ranking = sorted(ranking.items(), key=lambda x: x[1])
+
+    def _select_from_standbys(self, nodes: List[str], current_node: str = None) -> Optional[str]:
+        """只复测备用节点，有低于阈值的节点时直接选用，避免全量测速"""
+        candidates = self.standby_candidates(nodes, exclude=current_node)
+        if not candidates:
+            return None
+
+        logger.info(f"优先复测备用节点: {candidates}")
+        delays = self.measure_nodes(candidates)
+        if not delays:
+            logger.info("备用节点全部测试失败，进行全量测速")
+            return None
+
+        best_node, best_value = min(delays.items(), key=lambda x: x[1])
+        if best_value >= self.config.delay_threshold:
+            logger.info(f"备用节点延迟均未低于阈值（最佳 {best_node}: {best_value}ms），进行全量测速")
+            return None
+
+        # 用复测结果更新排名（不刷新排名时间，过期后仍会触发全量测速）
+        self.merge_ranking(delays)
+
+        logger.info(f"选择备用节点: {best_node} (延迟: {best_value}ms)")
+        return best_node
+
+    def measure_node(self, node_name: str) -> Optional[int]:
+        """按配置测量单个节点延迟（多样本模式下返回中位数）"""
+        if self.config.probe_samples > 1:
+            return self.clash_api.probe(
+                node_name,
+                samples=self.config.probe_samples,
+                test_url=self.config.test_url,
+                timeout=self.config.test_timeout
+            ).median
+
+        return self.clash_api.get_delay(
+            node_name,
+            test_url=self.config.test_url,
+            timeout=self.config.test_timeout
+        )
+
+    def measure_nodes(self, nodes: List[str]) -> Dict[str, float]:
+        """按配置批量测量节点，返回用于排序的延迟值（失败的节点不包含在结果中）"""
+        if self.config.probe_samples <= 1:
+            return self.clash_api.test_multiple_delays(
+                nodes,
+                test_url=self.config.test_url,
+                timeout=self.config.test_timeout
+            )
+
+        results = self.clash_api.test_multiple_probes(
+            nodes,
+            samples=self.config.probe_samples,
+            test_url=self.config.test_url,
+            timeout=self.config.test_timeout
+        )
+        ranked = {}
+        for name, result in results.items():
+            value = result.rank_value(self.config.rank_by, loss_penalty=self.config.test_timeout)
+            if value is not None:
+                ranked[name] = value
+        return ranked
+
     def get_node_info(self, node_name: str) -> Optional[Dict]:
         """获取节点信息"""
         try:
@@ -153,8 +309,8 @@ class NodeManager:
             logger.error(f"获取节点信息失败: {e}")
             return None
 
-    def switch_to_node(self, node_name: str, group_name: str = None) -> bool:
-        """切换到指定节点"""
+    def switch_to_node(self, node_name: str, group_name: str = None, reason: str = 'manual') -> bool:
+        """切换到指定节点，reason 为切换原因（manual 手动 / auto 自动）"""
         if not node_name:
             logger.error("节点名称为空")
             return False
@@ -167,6 +323,7 @@ class NodeManager:
             logger.warning(f"节点在黑名单中: {node_name}")
             return False
 
+        previous = self.state.current_node or None
         success = self.clash_api.switch_proxy(group_name, node_name)
         if success:
             self.state.current_node = node_name
@@ -175,10 +332,15 @@ class NodeManager:
         else:
             logger.error(f"切换到节点失败: {node_name}")
 
+        if self.events:
+            self.events.publish(SwitchEvent(previous, node_name, success, reason, self._clock()))
         return success
 
-    def auto_select_and_switch(self) -> bool:
-        """自动选择最佳节点并切换"""
+    def auto_select_and_switch(self, force: bool = False) -> bool:
+        """自动选择最佳节点并切换
+
+        force 为 True 时不再复测当前节点，直接从其余候选节点中选择（用于预测性切换）。
+        """
         logger.info(f"开始自动选择，当前配置: locked_region='{self.config.locked_region}'")
         available_nodes = self.filter_nodes()
 
@@ -193,13 +355,16 @@ class NodeManager:
         logger.info(f"当前节点: {current_node}")
 
         # 如果当前节点可用且不在黑名单中，测试其延迟
-        if current_node and not self.state.is_blacklisted(current_node):
+        if force:
+            # 当前节点预测即将劣化但仍低于阈值，重新排名时可能再次选中它，因此不作为候选
+            logger.info("强制重新选择节点，跳过当前节点复测")
+            available_nodes = [node for node in available_nodes if node != current_node]
+            if not available_nodes:
+                logger.warning("除当前节点外没有可用节点，不切换")
+                return False
+        elif current_node and not self.state.is_blacklisted(current_node):
             logger.info(f"测试当前节点延迟: {current_node}")
-            current_delay = self.clash_api.get_delay(
-                current_node,
-                test_url=self.config.test_url,
-                timeout=self.config.test_timeout
-            )
+            current_delay = self.measure_node(current_node)
 
             if current_delay is not None:
                 logger.info(f"当前节点延迟: {current_delay}ms, 阈值: {self.config.delay_threshold}ms")
@@ -220,10 +385,11 @@ class NodeManager:
 
         # 需要切换，选择最佳节点
         logger.info(f"开始从 {len(available_nodes)} 个节点中选择最佳节点: {available_nodes}")
-        best_node = self.select_best_node(available_nodes)
+        best_node = (self._select_from_standbys(available_nodes, current_node)
+                     or self.select_best_node(available_nodes))
         if best_node:
             logger.info(f"选择结果: {best_node}")
-            return self.switch_to_node(best_node)
+            return self.switch_to_node(best_node, reason='auto')
 
         return False
 
@@ -245,28 +411,101 @@ class NodeManager:
         logger.info(f"移除黑名单: {node_name}")
         return True
 
-    def get_all_regions(self) -> List[str]:
-        """从节点名称中提取所有区域"""
-        nodes = self.get_available_nodes()
-        regions = set()
-
-        # 常见的区域关键词
-        region_keywords = [
-            '香港', 'HK', 'Hong Kong',
-            '日本', 'JP', 'Japan', '东京', '大阪',
-            '新加坡', 'SG', 'Singapore',
-            '美国', 'US', 'USA', 'United States',
-            '韩国', 'KR', 'Korea',
-            '台湾', 'TW', 'Taiwan',
-            '英国', 'UK', 'GB', 'United Kingdom',
-            '德国', 'DE', 'Germany',
-            '加拿大', 'CA', 'Canada'
-        ]
-
+    def build_region_index(self, nodes: List[str]) -> Dict[str, List[str]]:
+        """按区域关键词对节点分组（每个节点归入第一个匹配的关键词）"""
+        index: Dict[str, List[str]] = {}
         for node in nodes:
-            for keyword in region_keywords:
-                if keyword.lower() in node.lower():
-                    regions.add(keyword)
-                    break
+            keyword = node_region(node)
+            if keyword:
+                index.setdefault(keyword, []).append(node)
+        return index
+
+    def add_blacklist_rule(self, rule: BlacklistRule) -> bool:
+        """添加黑名单规则"""
+        self.state.add_blacklist_rule(rule)
+        expiry = f"，{datetime.fromtimestamp(rule.expires_at):%Y-%m-%d %H:%M:%S} 到期" if rule.expires_at else ''
+        logger.info(f"添加黑名单规则: {rule.key}{expiry}")
+        return True
 
-        return sorted(list(regions))
+    def remove_blacklist_rule(self, key: str) -> bool:
+        """删除黑名单规则"""
+        removed = self.state.remove_blacklist_rule(key)
+        if removed:
+            logger.info(f"删除黑名单规则: {key}")
+        return removed
+
+    def get_all_regions(self, max_age: float = 0) -> List[str]:
+        """从节点名称中提取所有区域（Clash 不可用时使用缓存的区域索引）
+
+        区域索引已对应最新的节点列表时直接使用，不重新分组。
+        """
+        snapshot = self.clash_api.proxies_snapshot(max_age)
+        if snapshot:
+            with self._churn_lock:
+                if snapshot.fingerprint != self._region_index_fingerprint:
+                    nodes = [name for name, info in snapshot.proxies.items() if is_node(info)]
+                    if nodes:
+                        self.region_index = self.build_region_index(nodes)
+                        self._region_index_fingerprint = snapshot.fingerprint
+        return sorted(self.region_index)
+
+    def _on_proxies_changed(self, event: ProxiesChangedEvent):
+        """/proxies 条目变化：筛出实际节点的增删和变化，增量更新派生数据"""
+        known = set(self.state.available_nodes)
+        added, removed, changed = [], [], []
+        for name in event.added:
+            if is_node(event.proxies.get(name)):
+                added.append(name)
+        for name in event.removed:
+            if name in known:
+                removed.append(name)
+        for name in event.changed:
+            # 类型可能在节点和代理组之间变化
+            node = is_node(event.proxies.get(name))
+            if node and name in known:
+                changed.append(name)
+            elif node:
+                added.append(name)
+            elif name in known:
+                removed.append(name)
+        if not (added or removed or changed):
+            return
+
+        self.apply_node_churn(added, removed, changed, event.previous_fingerprint, event.fingerprint)
+        logger.info(f"节点列表变化: 新增 {len(added)} 个，移除 {len(removed)} 个，变化 {len(changed)} 个")
+        if added:
+            logger.info(f"新增节点: {added}")
+        if removed:
+            logger.info(f"移除节点: {removed}")
+        if self.events:
+            self.events.publish(NodesChangedEvent(tuple(added), tuple(removed), tuple(changed), event.timestamp))
+
+    def apply_node_churn(self, added: Iterable[str], removed: Iterable[str], changed: Iterable[str] = (),
+                         previous_fingerprint: str = None, fingerprint: str = None):
+        """增量更新可用节点列表、区域索引、黑名单匹配缓存和排名
+
+        区域索引只在对应 previous_fingerprint 时增量更新，否则下次获取区域时重建；
+        内容变化的节点（如服务器或协议参数变化）之前的测速结果不再可信，从排名中移除。
+        """
+        added, removed, changed = list(added), set(removed), set(changed)
+        with self._churn_lock:
+            # 写时复制：整体替换可用节点列表
+            nodes = [node for node in self.state.available_nodes if node not in removed]
+            present = set(nodes)
+            nodes.extend(node for node in added if node not in present)
+            self.state.available_nodes = nodes
+
+            if previous_fingerprint and previous_fingerprint == self._region_index_fingerprint:
+                index = {region: [node for node in members if node not in removed]
+                         for region, members in self.region_index.items()}
+                for node in added:
+                    keyword = node_region(node)
+                    if keyword and node not in index.get(keyword, ()):
+                        index.setdefault(keyword, []).append(node)
+                self.region_index = {region: members for region, members in index.items() if members}
+                self._region_index_fingerprint = fingerprint
+
+        self.state.forget_nodes(removed)
+        stale = removed | changed
+        if stale and any(node in stale for node, _ in self.last_ranking):
+            self.last_ranking = [(node, value) for node, value in self.last_ranking if node not in stale]
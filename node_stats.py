@@ -0,0 +1,332 @@
+"""
+节点统计
+为每个节点维护常数内存的流式分位数估计和趋势检测，用于预测性切换
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 触发预测性切换前每个节点至少需要的样本数
+MIN_SAMPLES_FOR_PREDICTION = 5
+
+
+class P2Quantile:
+    """P² 流式分位数估计（Jain & Chlamtac），仅保存 5 个标记点"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self._heights: List[float] = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        """加入一个样本"""
+        self.count += 1
+        q = self._heights
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self._positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if q[i - 1] < candidate < q[i + 1]:
+                    q[i] = candidate
+                else:
+                    q[i] = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self._heights, self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        """当前分位数估计值"""
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            ordered = sorted(self._heights)
+            return ordered[min(int(self.p * len(ordered)), len(ordered) - 1)]
+        return self._heights[2]
+
+    def to_state(self) -> Dict:
+        """导出估计器状态（用于热启动快照）"""
+        return {'count': self.count, 'heights': list(self._heights),
+                'positions': list(self._positions), 'desired': list(self._desired)}
+
+    @classmethod
+    def from_state(cls, p: float, state: Dict) -> 'P2Quantile':
+        """从导出的状态恢复"""
+        estimator = cls(p)
+        estimator.count = state['count']
+        estimator._heights = list(state['heights'])
+        estimator._positions = list(state['positions'])
+        estimator._desired = list(state['desired'])
+        return estimator
+
+
+class WindowedQuantile:
+    """近似滑动窗口分位数
+
+    交替使用两个 P² 估计器，每个覆盖 window 个样本；查询时按新窗口的填充比例
+    在旧窗口和新窗口的估计值之间加权，内存恒定。
+    """
+
+    def __init__(self, p: float, window: int):
+        self.p = p
+        self.window = max(window, 5)
+        self._current = P2Quantile(p)
+        self._previous: Optional[P2Quantile] = None
+
+    def add(self, x: float):
+        """加入一个样本"""
+        self._current.add(x)
+        if self._current.count >= self.window:
+            self._previous = self._current
+            self._current = P2Quantile(self.p)
+
+    @property
+    def count(self) -> int:
+        """窗口内的样本数（近似）"""
+        if self._previous is None:
+            return self._current.count
+        return self.window
+
+    def value(self) -> Optional[float]:
+        """当前窗口分位数估计值"""
+        current = self._current.value()
+        if self._previous is None:
+            return current
+        previous = self._previous.value()
+        if current is None or self._current.count < 5:
+            return previous
+        weight = self._current.count / self.window
+        return previous * (1 - weight) + current * weight
+
+    def to_state(self) -> Dict:
+        """导出状态"""
+        return {
+            'current': self._current.to_state(),
+            'previous': self._previous.to_state() if self._previous else None
+        }
+
+    def load_state(self, state: Dict):
+        """恢复导出的状态"""
+        self._current = P2Quantile.from_state(self.p, state['current'])
+        previous = state.get('previous')
+        self._previous = P2Quantile.from_state(self.p, previous) if previous else None
+
+
+class HoltTrend:
+    """Holt 双指数平滑趋势检测，支持不等间隔采样，趋势单位为 ms/秒"""
+
+    def __init__(self, alpha: float = 0.5, beta: float = 0.3):
+        self.alpha = alpha
+        self.beta = beta
+        self.level: Optional[float] = None
+        self.trend = 0.0
+        self._last_time: Optional[float] = None
+
+    def add(self, x: float, timestamp: float):
+        """加入一个样本"""
+        if self.level is None:
+            self.level = x
+            self._last_time = timestamp
+            return
+        dt = max(timestamp - self._last_time, 1e-3)
+        previous = self.level
+        self.level = self.alpha * x + (1 - self.alpha) * (self.level + self.trend * dt)
+        self.trend = self.beta * (self.level - previous) / dt + (1 - self.beta) * self.trend
+        self._last_time = timestamp
+
+    def forecast(self, horizon: float) -> Optional[float]:
+        """预测 horizon 秒后的延迟"""
+        if self.level is None:
+            return None
+        return self.level + self.trend * horizon
+
+    def to_state(self) -> Dict:
+        """导出状态"""
+        return {'level': self.level, 'trend': self.trend, 'last_time': self._last_time}
+
+    def load_state(self, state: Dict):
+        """恢复导出的状态"""
+        self.level = state['level']
+        self.trend = state['trend']
+        self._last_time = state['last_time']
+
+
+class NodeStats:
+    """单个节点的统计"""
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.failures = 0
+        self.last_delay: Optional[int] = None
+        self.last_time: Optional[float] = None
+        self.p90 = WindowedQuantile(0.9, window)
+        self.trend = HoltTrend()
+
+    def observe(self, delay: Optional[int], timestamp: float, failure_value: int):
+        """记录一次探测结果，失败按 failure_value 计入分位数和趋势"""
+        self.count += 1
+        self.last_time = timestamp
+        if delay is None:
+            self.failures += 1
+            value = failure_value
+        else:
+            value = delay
+        self.last_delay = delay
+        self.p90.add(value)
+        self.trend.add(value, timestamp)
+
+    def to_state(self) -> Dict:
+        """导出完整状态（用于热启动快照）"""
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'last_delay': self.last_delay,
+            'last_time': self.last_time,
+            'p90': self.p90.to_state(),
+            'trend': self.trend.to_state()
+        }
+
+    @classmethod
+    def from_state(cls, window: int, state: Dict) -> 'NodeStats':
+        """从导出的状态恢复"""
+        stats = cls(window)
+        stats.count = state['count']
+        stats.failures = state['failures']
+        stats.last_delay = state['last_delay']
+        stats.last_time = state['last_time']
+        stats.p90.load_state(state['p90'])
+        stats.trend.load_state(state['trend'])
+        return stats
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        p90 = self.p90.value()
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'last_delay': self.last_delay,
+            'last_time': self.last_time,
+            'p90': round(p90, 1) if p90 is not None else None,
+            'level': round(self.trend.level, 1) if self.trend.level is not None else None,
+            'trend': round(self.trend.trend, 3)
+        }
+
+
+class NodeStatsTable:
+    """所有节点的统计表，由 ClashAPI 发布的 ProbeEvent 更新"""
+
+    def __init__(self, window: int = 20, failure_value: int = 5000,
+                 clock: Callable[[], float] = time.time):
+        self.window = window
+        self.failure_value = failure_value
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats: Dict[str, NodeStats] = {}
+        # 累计探测次数，可作为依赖最新延迟的缓存键
+        self.observations = 0
+
+    def observe(self, node: str, delay: Optional[int]):
+        """记录一次探测结果"""
+        with self._lock:
+            self.observations += 1
+            stats = self._stats.get(node)
+            if stats is None:
+                stats = self._stats[node] = NodeStats(self.window)
+            stats.observe(delay, self._clock(), self.failure_value)
+
+    def forget(self, nodes: Iterable[str]) -> int:
+        """删除节点的统计（节点已消失或内容已变化），返回删除的节点数"""
+        removed = 0
+        with self._lock:
+            for node in nodes:
+                if self._stats.pop(node, None) is not None:
+                    removed += 1
+        return removed
+
+    def get(self, node: str) -> Optional[NodeStats]:
+        """获取节点统计"""
+        return self._stats.get(node)
+
+    def latest_delays(self) -> Dict[str, Optional[int]]:
+        """每个节点最近一次的探测延迟（失败为 None）"""
+        with self._lock:
+            return {node: stats.last_delay for node, stats in self._stats.items()}
+
+    def predict_degradation(self, node: str, threshold: int, horizon: float) -> Optional[str]:
+        """判断节点是否已经或即将劣化，返回原因描述，未劣化返回 None"""
+        with self._lock:
+            stats = self._stats.get(node)
+            if stats is None or stats.p90.count < MIN_SAMPLES_FOR_PREDICTION:
+                return None
+
+            p90 = stats.p90.value()
+            if p90 is not None and p90 > threshold:
+                return f"窗口 p90 {p90:.0f}ms 超过阈值 {threshold}ms"
+
+            forecast = stats.trend.forecast(horizon)
+            if stats.trend.trend > 0 and forecast is not None and forecast > threshold:
+                return f"趋势预测 {horizon:.0f}s 后延迟 {forecast:.0f}ms 超过阈值 {threshold}ms"
+        return None
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        with self._lock:
+            return {node: stats.to_dict() for node, stats in self._stats.items()}
+
+    def export_state(self) -> Dict:
+        """导出所有节点的完整状态"""
+        with self._lock:
+            return {node: stats.to_state() for node, stats in self._stats.items()}
+
+    def load_state(self, data: Dict, max_age: float = None, nodes: List[str] = None) -> int:
+        """恢复导出的状态，跳过最后探测早于 max_age 秒或不在 nodes 中的节点，返回恢复的节点数"""
+        now = self._clock()
+        allowed = set(nodes) if nodes is not None else None
+        restored = 0
+        with self._lock:
+            for node, state in data.items():
+                if allowed is not None and node not in allowed:
+                    continue
+                if max_age is not None and (state.get('last_time') is None or now - state['last_time'] > max_age):
+                    continue
+                try:
+                    self._stats[node] = NodeStats.from_state(self.window, state)
+                    restored += 1
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"节点统计 {node} 恢复失败: {e}")
+        return restored
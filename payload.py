@@ -0,0 +1,105 @@
+"""
+响应负载编码
+JSON 序列化（安装了 orjson 时使用 orjson，否则使用标准库 json）、gzip / brotli 压缩协商，
+以及节点列表和延迟历史的列式编码；不依赖 Flask（无界面守护进程同样使用）
+"""
+
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 实际使用的 JSON 编码器
+JSON_ENCODER = 'orjson' if orjson else 'json'
+
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# 按优先顺序排列的可用压缩编码
+ENCODINGS: Tuple[str, ...] = ('br', 'gzip') if brotli else ('gzip',)
+COMPRESSIBLE_MIMETYPES = frozenset({'application/json', 'text/plain', 'text/html'})
+
+# 列式编码的请求参数值
+FORMAT_COLUMNAR = 'columnar'
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON（非 ASCII 字符不转义）"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_sorted(obj: Any) -> bytes:
+    """序列化为键有序的紧凑 JSON，相同内容的结果相同（用于比较和计算指纹）"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_with_default(obj: Any, default: Callable[[Any], Any]) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON，日期、dataclass 等类型交给 default 转换（与标准库编码器结果一致）"""
+    if orjson:
+        return orjson.dumps(obj, default=default, option=(
+            orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        ))
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def columnar(rows: List[Dict], columns: Sequence[str] = None) -> Dict[str, List]:
+    """行列表转为列式: [{"a": 1, "b": 2}, ...] -> {"a": [1, ...], "b": [2, ...]}
+
+    字段名只出现一次，重复的键不再占用体积；columns 缺省时取第一行的字段。
+    """
+    if columns is None:
+        columns = list(rows[0]) if rows else []
+    return {column: [row.get(column) for row in rows] for column in columns}
+
+
+def negotiate(accept_encodings) -> Optional[str]:
+    """按请求的 Accept-Encoding 选择压缩编码，不接受压缩时返回 None"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """压缩响应体"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime 固定为 0，相同内容的压缩结果相同
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+class CompressionCache:
+    """按 (ETag, 编码) 缓存压缩结果，内容未变化的大响应只压缩一次"""
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self._entries: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                return compressed
+
+        compressed = compress(body, encoding)
+        with self._lock:
+            self._entries[key] = compressed
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return compressed
@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+探测日志
+定长列式二进制格式，通过内存映射的只追加分段文件保存每一次探测的原始结果，
+范围查询和单节点扫描无需解析 JSON，也不需要把整个文件读入内存
+
+分段文件布局（小端）:
+    头部 64 字节: 魔数、版本、容量、已写入行数、最小/最大时间戳、是否按时间有序
+    时间戳列  float64 × 容量
+    节点 ID 列 uint32 × 容量
+    延迟列    int32 × 容量（失败时为 0）
+    状态列    uint8 × 容量
+节点名按 ID 顺序逐行保存在 nodes.txt 中
+"""
+
+import argparse
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+PROBE_LOG_DIR = DATA_DIR / 'probes'
+NODES_FILE = 'nodes.txt'
+
+# 每个分段的默认行数（约 17MB）
+DEFAULT_SEGMENT_ROWS = 1 << 20
+
+MAGIC = b'CASPROBE'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIQddB')
+HEADER_SIZE = 64
+
+# 每行各列的字节数：时间戳、节点 ID、延迟、状态
+ROW_SIZE = 8 + 4 + 4 + 1
+
+STATUS_OK = 0
+STATUS_FAILED = 1
+
+
+def _segment_name(index: int) -> str:
+    return f'seg-{index:08d}.bin'
+
+
+def _segment_index(path: Path) -> int:
+    return int(path.stem.split('-')[1])
+
+
+class Segment:
+    """单个内存映射分段
+
+    行号小于 count 的数据写入后不再修改，读者可以在写入的同时并发扫描。
+    """
+
+    def __init__(self, path: Path, capacity: int = None):
+        self.path = Path(path)
+        if not self.path.exists():
+            if not capacity:
+                raise FileNotFoundError(str(path))
+            with open(self.path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, capacity, 0, 0.0, 0.0, 1).ljust(HEADER_SIZE, b'\0'))
+                f.truncate(HEADER_SIZE + capacity * ROW_SIZE)
+
+        self._file = open(self.path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        magic, version, capacity, count, min_ts, max_ts, ordered = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            self._file.close()
+            raise ValueError(f"不是有效的探测日志分段: {path}")
+
+        self.capacity = capacity
+        self.count = count
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.ordered = bool(ordered)
+
+        view = memoryview(self._mmap)
+        offset = HEADER_SIZE
+        self.ts = view[offset:offset + 8 * capacity].cast('d')
+        offset += 8 * capacity
+        self._node_offset = offset
+        self.node = view[offset:offset + 4 * capacity].cast('I')
+        offset += 4 * capacity
+        self.delay = view[offset:offset + 4 * capacity].cast('i')
+        offset += 4 * capacity
+        self.status = view[offset:offset + capacity]
+        self._views = [view, self.ts, self.node, self.delay, self.status]
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def _write_header(self):
+        HEADER.pack_into(self._mmap, 0, MAGIC, FORMAT_VERSION, self.capacity, self.count,
+                         self.min_ts, self.max_ts, int(self.ordered))
+
+    def append(self, timestamp: float, node_id: int, delay: int, status: int):
+        """追加一行"""
+        i = self.count
+        self.ts[i] = timestamp
+        self.node[i] = node_id
+        self.delay[i] = delay
+        self.status[i] = status
+        self._extend_bounds(timestamp, timestamp, timestamp >= self.max_ts)
+        self.count = i + 1
+        self._write_header()
+
+    def append_columns(self, timestamps: array, node_ids: array, delays: array, statuses: bytes) -> int:
+        """批量追加（各列长度相同，时间戳需有序），返回实际写入的行数"""
+        i = self.count
+        n = min(len(timestamps), self.capacity - i)
+        if n <= 0:
+            return 0
+        self.ts[i:i + n] = memoryview(timestamps)[:n]
+        self.node[i:i + n] = memoryview(node_ids)[:n]
+        self.delay[i:i + n] = memoryview(delays)[:n]
+        self.status[i:i + n] = memoryview(statuses)[:n]
+        self._extend_bounds(timestamps[0], timestamps[n - 1], timestamps[0] >= self.max_ts)
+        self.count = i + n
+        self._write_header()
+        return n
+
+    def _extend_bounds(self, first: float, last: float, in_order: bool):
+        if self.count == 0:
+            self.min_ts, self.max_ts = first, last
+            return
+        if not in_order:
+            self.ordered = False
+        self.min_ts = min(self.min_ts, first)
+        self.max_ts = max(self.max_ts, last)
+
+    def overlaps(self, start: float, end: float) -> bool:
+        """分段时间范围是否与 [start, end) 相交"""
+        return self.count > 0 and self.max_ts >= start and self.min_ts < end
+
+    def bounds(self, start: float, end: float) -> Tuple[int, int]:
+        """[start, end) 对应的行号范围；无序分段返回全部行，需由调用方逐行过滤"""
+        if not self.ordered:
+            return 0, self.count
+        lo = bisect.bisect_left(self.ts, start, 0, self.count)
+        hi = bisect.bisect_left(self.ts, end, lo, self.count)
+        return lo, hi
+
+    def node_rows(self, node_id: int, lo: int, hi: int) -> Iterator[int]:
+        """[lo, hi) 内属于某个节点的行号
+
+        直接在映射上用 mmap.find 查找节点 ID 的字节模式（C 层、无复制），只为命中的行进入 Python；
+        未按 4 字节对齐的命中是跨行的误匹配，跳过即可。
+        """
+        pattern = struct.pack('=I', node_id)
+        base = self._node_offset
+        position = self._mmap.find(pattern, base + 4 * lo, base + 4 * hi)
+        while position != -1:
+            offset = position - base
+            if offset % 4 == 0:
+                yield offset // 4
+                position = self._mmap.find(pattern, position + 4, base + 4 * hi)
+            else:
+                position = self._mmap.find(pattern, position + 1, base + 4 * hi)
+
+    def flush(self):
+        """把脏页写回磁盘"""
+        self._mmap.flush()
+
+    def close(self):
+        """关闭映射（需先释放所有导出的 memoryview）"""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+        self._file.close()
+
+
+class ProbeLog:
+    """探测日志
+
+    append() 由 ProbeEvent 订阅者调用；分段写满后自动切换到新分段。
+    """
+
+    def __init__(self, directory: Path = PROBE_LOG_DIR, segment_rows: int = DEFAULT_SEGMENT_ROWS,
+                 retention_days: int = 0):
+        self.directory = Path(directory)
+        self.segment_rows = segment_rows
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        nodes_path = self.directory / NODES_FILE
+        if nodes_path.exists():
+            with open(nodes_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._register(line.rstrip('\n'))
+        self._nodes_file = open(nodes_path, 'a', encoding='utf-8')
+
+        self.segments: List[Segment] = [
+            Segment(path) for path in sorted(self.directory.glob('seg-*.bin'), key=_segment_index)
+        ]
+
+    # ---------- 节点 ID ----------
+
+    def _register(self, name: str) -> int:
+        node_id = len(self._names)
+        self._names.append(name)
+        self._ids[name] = node_id
+        return node_id
+
+    def node_id(self, name: str) -> int:
+        """获取（必要时分配并持久化）节点 ID"""
+        node_id = self._ids.get(name)
+        if node_id is None:
+            with self._lock:
+                node_id = self._ids.get(name)
+                if node_id is None:
+                    node_id = self._register(name)
+                    self._nodes_file.write(name + '\n')
+                    self._nodes_file.flush()
+        return node_id
+
+    def node_name(self, node_id: int) -> str:
+        """根据 ID 获取节点名"""
+        return self._names[node_id]
+
+    @property
+    def nodes(self) -> List[str]:
+        """已记录的节点名"""
+        return list(self._names)
+
+    # ---------- 写入 ----------
+
+    def _writable_segment(self) -> Segment:
+        if self.segments and not self.segments[-1].full:
+            return self.segments[-1]
+        index = _segment_index(self.segments[-1].path) + 1 if self.segments else 0
+        segment = Segment(self.directory / _segment_name(index), self.segment_rows)
+        self.segments.append(segment)
+        if self.retention_days:
+            self._drop_expired()
+        return segment
+
+    def append(self, node_name: str, delay: Optional[int], timestamp: float = None):
+        """记录一次探测结果，delay 为 None 表示失败"""
+        node_id = self.node_id(node_name)
+        status = STATUS_FAILED if delay is None else STATUS_OK
+        with self._lock:
+            # 在锁内取时间，保证同一分段内的时间戳有序
+            ts = time.time() if timestamp is None else timestamp
+            self._writable_segment().append(ts, node_id, delay or 0, status)
+
+    def append_columns(self, timestamps: array, node_ids: array, delays: array, statuses: bytes):
+        """批量追加按时间排序的列数据（节点 ID 需已通过 node_id() 分配）"""
+        offset = 0
+        with self._lock:
+            while offset < len(timestamps):
+                segment = self._writable_segment()
+                offset += segment.append_columns(
+                    memoryview(timestamps)[offset:], memoryview(node_ids)[offset:],
+                    memoryview(delays)[offset:], memoryview(statuses)[offset:]
+                )
+
+    def _drop_expired(self):
+        """删除完全超出保留期的已写满分段"""
+        cutoff = time.time() - self.retention_days * 86400
+        while len(self.segments) > 1 and self.segments[0].full and self.segments[0].max_ts < cutoff:
+            segment = self.segments.pop(0)
+            segment.close()
+            segment.path.unlink()
+            logger.info(f"删除过期探测日志分段: {segment.path.name}")
+
+    def flush(self):
+        """把所有分段写回磁盘"""
+        with self._lock:
+            for segment in self.segments:
+                segment.flush()
+
+    def close(self):
+        """写回并关闭"""
+        with self._lock:
+            for segment in self.segments:
+                segment.flush()
+                segment.close()
+            self.segments = []
+            self._nodes_file.close()
+
+    def __len__(self) -> int:
+        return sum(segment.count for segment in self.segments)
+
+    # ---------- 查询 ----------
+
+    def _ranges(self, start: Optional[float], end: Optional[float]) -> Iterator[Tuple[Segment, int, int, bool]]:
+        """与时间范围相交的 (分段, 起始行, 结束行, 是否需要逐行过滤)"""
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        for segment in list(self.segments):
+            if not segment.overlaps(start, end):
+                continue
+            lo, hi = segment.bounds(start, end)
+            needs_filter = not segment.ordered and not (segment.min_ts >= start and segment.max_ts < end)
+            if hi > lo:
+                yield segment, lo, hi, needs_filter
+
+    def scan(self, start: float = None, end: float = None,
+             node: str = None) -> Iterator[Tuple[float, str, Optional[int]]]:
+        """按分段顺序遍历 [start, end) 内的记录 (时间戳, 节点名, 延迟)"""
+        node_id = None
+        if node is not None:
+            node_id = self._ids.get(node)
+            if node_id is None:
+                return
+        start_ts = float('-inf') if start is None else start
+        end_ts = float('inf') if end is None else end
+        names = self._names
+
+        for segment, lo, hi, needs_filter in self._ranges(start, end):
+            rows = segment.node_rows(node_id, lo, hi) if node_id is not None else range(lo, hi)
+            ts, nodes, delays, statuses = segment.ts, segment.node, segment.delay, segment.status
+            for i in rows:
+                t = ts[i]
+                if needs_filter and not start_ts <= t < end_ts:
+                    continue
+                yield t, names[nodes[i]], delays[i] if statuses[i] == STATUS_OK else None
+
+    def summary(self, start: float = None, end: float = None, node: str = None) -> Dict:
+        """统计 [start, end) 内的探测次数、失败次数及延迟均值/最小/最大值"""
+        count = failures = total = 0
+        low = high = None
+
+        if node is not None:
+            for _, _, delay in self.scan(start, end, node):
+                count += 1
+                if delay is None:
+                    failures += 1
+                    continue
+                total += delay
+                low = delay if low is None else min(low, delay)
+                high = delay if high is None else max(high, delay)
+        else:
+            for segment, lo, hi, needs_filter in self._ranges(start, end):
+                if needs_filter:
+                    sub = self._filtered_summary(segment, lo, hi, start, end)
+                    count += sub['count']
+                    failures += sub['failures']
+                    total += sub['_total']
+                    candidates = [v for v in (sub['min'], sub['max']) if v is not None]
+                else:
+                    # 整段连续行：计数、求和、最值都在 C 层完成
+                    statuses = bytes(segment.status[lo:hi])
+                    delays = array('i')
+                    delays.frombytes(segment.delay[lo:hi].cast('B'))
+                    failed = statuses.count(STATUS_FAILED)
+                    count += hi - lo
+                    failures += failed
+                    total += sum(delays)  # 失败行的延迟为 0
+                    candidates = []
+                    if failed < len(delays):
+                        if failed:
+                            # 用任一成功行的延迟覆盖失败行，不影响最值
+                            filler = delays[statuses.index(STATUS_OK)]
+                            i = statuses.find(STATUS_FAILED)
+                            while i != -1:
+                                delays[i] = filler
+                                i = statuses.find(STATUS_FAILED, i + 1)
+                        candidates = [min(delays), max(delays)]
+                if candidates:
+                    low = min(candidates) if low is None else min(low, *candidates)
+                    high = max(candidates) if high is None else max(high, *candidates)
+
+        succeeded = count - failures
+        return {
+            'count': count,
+            'failures': failures,
+            'avg': round(total / succeeded, 1) if succeeded else None,
+            'min': low,
+            'max': high
+        }
+
+    @staticmethod
+    def _filtered_summary(segment: Segment, lo: int, hi: int, start: Optional[float], end: Optional[float]) -> Dict:
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        count = failures = total = 0
+        low = high = None
+        for t, d, s in zip(segment.ts[lo:hi], segment.delay[lo:hi], segment.status[lo:hi]):
+            if not start <= t < end:
+                continue
+            count += 1
+            if s != STATUS_OK:
+                failures += 1
+                continue
+            total += d
+            low = d if low is None else min(low, d)
+            high = d if high is None else max(high, d)
+        return {'count': count, 'failures': failures, '_total': total, 'min': low, 'max': high}
+
+
+def compact(directory: Path = PROBE_LOG_DIR, segment_rows: int = DEFAULT_SEGMENT_ROWS,
+            before: float = None) -> Dict:
+    """压缩探测日志（需在没有写入者时运行）
+
+    丢弃早于 before 的记录，把无序分段按时间排序，并把未写满的分段合并成满分段。
+    新分段先以 .tmp 写入、编号接在旧分段之后，全部完成后才删除旧分段，中途中断不会丢数据。
+    """
+    directory = Path(directory)
+    old_paths = sorted(directory.glob('seg-*.bin'), key=_segment_index)
+    if not old_paths:
+        return {'segments_before': 0, 'segments_after': 0, 'rows_before': 0, 'rows_after': 0}
+
+    next_index = _segment_index(old_paths[-1]) + 1
+    rows_before = rows_after = 0
+    written: List[Tuple[Path, Path]] = []
+    output: Optional[Segment] = None
+
+    def open_output() -> Segment:
+        nonlocal next_index
+        final = directory / _segment_name(next_index)
+        temp = final.with_suffix('.tmp')
+        next_index += 1
+        written.append((temp, final))
+        return Segment(temp, segment_rows)
+
+    for path in old_paths:
+        segment = Segment(path)
+        try:
+            rows_before += segment.count
+            lo, hi = (0, segment.count)
+            if before is not None and segment.ordered:
+                lo = bisect.bisect_left(segment.ts, before, 0, segment.count)
+            order = range(lo, hi)
+            if not segment.ordered:
+                order = sorted((i for i in range(lo, hi) if before is None or segment.ts[i] >= before),
+                               key=segment.ts.__getitem__)
+
+            ts, nodes, delays, statuses = array('d'), array('I'), array('i'), bytearray()
+            if isinstance(order, range):
+                ts.frombytes(segment.ts[lo:hi].cast('B'))
+                nodes.frombytes(segment.node[lo:hi].cast('B'))
+                delays.frombytes(segment.delay[lo:hi].cast('B'))
+                statuses += segment.status[lo:hi]
+            else:
+                for i in order:
+                    ts.append(segment.ts[i])
+                    nodes.append(segment.node[i])
+                    delays.append(segment.delay[i])
+                    statuses.append(segment.status[i])
+        finally:
+            segment.close()
+
+        offset = 0
+        while offset < len(ts):
+            if output is None or output.full:
+                if output is not None:
+                    output.flush()
+                    output.close()
+                output = open_output()
+            offset += output.append_columns(
+                memoryview(ts)[offset:], memoryview(nodes)[offset:],
+                memoryview(delays)[offset:], memoryview(statuses)[offset:]
+            )
+        rows_after += len(ts)
+
+    if output is not None:
+        output.flush()
+        output.close()
+
+    for temp, final in written:
+        with open(temp, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temp, final)
+    for path in old_paths:
+        path.unlink()
+
+    logger.info(f"探测日志压缩完成: {len(old_paths)} -> {len(written)} 个分段, {rows_before} -> {rows_after} 行")
+    return {
+        'segments_before': len(old_paths),
+        'segments_after': len(written),
+        'rows_before': rows_before,
+        'rows_after': rows_after
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='探测日志工具')
+    parser.add_argument('--dir', default=str(PROBE_LOG_DIR), help='探测日志目录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('info', help='显示分段信息')
+
+    compact_parser = subparsers.add_parser('compact', help='压缩分段并清理过期记录（需先停止服务）')
+    compact_parser.add_argument('--retention-days', type=float, default=0, help='只保留最近 N 天（0 为不清理）')
+    compact_parser.add_argument('--segment-rows', type=int, default=DEFAULT_SEGMENT_ROWS)
+
+    query_parser = subparsers.add_parser('query', help='统计时间范围内的探测结果')
+    query_parser.add_argument('--node', help='节点名（缺省为全部节点）')
+    query_parser.add_argument('--from', dest='start', type=float, help='起始时间(epoch 秒)')
+    query_parser.add_argument('--to', dest='end', type=float, help='结束时间(epoch 秒)')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'compact':
+        before = time.time() - args.retention_days * 86400 if args.retention_days else None
+        result = compact(Path(args.dir), args.segment_rows, before)
+        print(result)
+        return 0
+
+    log = ProbeLog(Path(args.dir))
+    try:
+        if args.command == 'info':
+            print(f"节点数: {len(log.nodes)}, 分段数: {len(log.segments)}, 总行数: {len(log)}")
+            for segment in log.segments:
+                print(f"  {segment.path.name}: {segment.count}/{segment.capacity} 行, "
+                      f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(segment.min_ts))} ~ "
+                      f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(segment.max_ts))}"
+                      f"{'' if segment.ordered else ' (无序)'}")
+        else:
+            print(log.summary(args.start, args.end, args.node))
+    finally:
+        log.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+有界探测池
+手动测速（单个节点或批量）共用固定数量的工作线程，限制同时发往 Clash 的延迟测试数；
+批量测试立即返回批次 ID，每个节点完成时通过回调推送结果
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认工作线程数（与 ClashAPI 连接池大小一致）
+DEFAULT_WORKERS = 8
+# 排队和进行中的探测总数上限
+MAX_PENDING = 1000
+
+
+class ProbePoolFull(Exception):
+    """探测池排队已满"""
+    pass
+
+
+class ProbePool:
+    """有界探测池
+
+    probe 为单个节点的测量函数（返回延迟或 None），探测结果由 ClashAPI 发布的 ProbeEvent
+    同步到节点统计等存储，本类不重复记录。
+    """
+
+    def __init__(self, probe: Callable[[str], Optional[int]], workers: int = DEFAULT_WORKERS,
+                 max_pending: int = MAX_PENDING):
+        self._probe = probe
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='probe')
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """排队和进行中的探测数"""
+        return self._pending
+
+    def _reserve(self, count: int):
+        with self._lock:
+            if self._pending + count > self.max_pending:
+                raise ProbePoolFull(f"探测队列已满（{self._pending}/{self.max_pending}）")
+            self._pending += count
+
+    def _run(self, node: str) -> Optional[int]:
+        try:
+            return self._probe(node)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def submit(self, node: str) -> Future:
+        """提交单个节点的探测，队列已满时抛出 ProbePoolFull"""
+        self._reserve(1)
+        return self._executor.submit(self._run, node)
+
+    def run_batch(self, nodes: List[str],
+                  on_result: Callable[[str, str, Optional[int], int, int], None],
+                  on_done: Callable[[str, Dict], None] = None) -> str:
+        """批量探测，立即返回批次 ID
+
+        每个节点完成时调用 on_result(批次ID, 节点, 延迟或None, 已完成数, 总数)，
+        全部完成后调用 on_done(批次ID, 汇总)。整批超出队列容量时抛出 ProbePoolFull。
+        """
+        nodes = list(dict.fromkeys(nodes))
+        batch_id = uuid.uuid4().hex[:12]
+        total = len(nodes)
+        self._reserve(total)
+
+        started = time.time()
+        lock = threading.Lock()
+        progress = {'completed': 0, 'succeeded': 0}
+
+        def finished(node: str, future: Future):
+            try:
+                delay = future.result()
+            except Exception as e:
+                logger.error(f"批量测速 {node} 出错: {e}")
+                delay = None
+            with lock:
+                progress['completed'] += 1
+                if delay is not None:
+                    progress['succeeded'] += 1
+                completed = progress['completed']
+            try:
+                on_result(batch_id, node, delay, completed, total)
+                if completed == total and on_done:
+                    on_done(batch_id, {
+                        'total': total,
+                        'succeeded': progress['succeeded'],
+                        'failed': total - progress['succeeded'],
+                        'elapsed': round(time.time() - started, 3)
+                    })
+            except Exception as e:
+                logger.error(f"批量测速结果回调失败: {e}")
+
+        logger.info(f"批量测速 {batch_id}: {total} 个节点，{self.workers} 个并发")
+        for node in nodes:
+            future = self._executor.submit(self._run, node)
+            future.add_done_callback(lambda f, node=node: finished(node, f))
+        if not nodes and on_done:
+            on_done(batch_id, {'total': 0, 'succeeded': 0, 'failed': 0, 'elapsed': 0.0})
+        return batch_id
+
+    def shutdown(self):
+        """停止接受新的探测，丢弃排队中的探测"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
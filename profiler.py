@@ -0,0 +1,214 @@
+"""
+在线性能剖析
+按需对运行中的服务采样或用 cProfile 剖析，以及导出所有线程（协程）的调用栈；
+只在调用期间安装钩子或启动采样线程，未使用时没有任何开销
+"""
+
+import cProfile
+import gc
+import importlib
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import server
+
+logger = logging.getLogger(__name__)
+
+# 单次剖析的最长时间(秒)
+MAX_DURATION = 60
+# 默认采样间隔(秒)
+DEFAULT_INTERVAL = 0.005
+# 采样的最大栈深度
+MAX_STACK_DEPTH = 64
+
+PSTATS_SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class ProfilerBusy(Exception):
+    """已有剖析在进行中"""
+    pass
+
+
+# 同一时间只允许一个剖析会话
+_session_lock = threading.Lock()
+
+
+def _original(module_name: str):
+    """eventlet 模式下返回未经 monkey patch 的原始模块（原生线程、阻塞 sleep）"""
+    if server.async_mode() == server.SERVER_MODE_EVENTLET:
+        from eventlet import patcher
+        return patcher.original(module_name)
+    return importlib.import_module(module_name)
+
+
+@contextmanager
+def session():
+    """占用剖析会话，已被占用时抛出 ProfilerBusy"""
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy("已有剖析在进行中")
+    try:
+        yield
+    finally:
+        _session_lock.release()
+
+
+def _thread_names() -> Dict[int, str]:
+    """原生线程 ID -> 线程名"""
+    return {thread.ident: thread.name for thread in _original('threading').enumerate()}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    """调用栈折叠为 根;...;叶"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def sample_stacks(seconds: float, interval: float = DEFAULT_INTERVAL, thread_filter: str = '') -> Tuple[Counter, int]:
+    """在当前线程中定期采样其他所有线程的调用栈，返回 (折叠栈 -> 次数, 采样轮数)
+
+    eventlet 模式下所有协程运行在主线程上，采样到的是正在占用 CPU 的协程；
+    需通过 blocking.run_blocking 在原生线程中调用，否则采样期间会阻塞事件循环。
+    thread_filter 非空时只采样线程名包含该字符串的线程。
+    """
+    seconds = min(max(seconds, 0.1), MAX_DURATION)
+    interval = max(interval, 0.001)
+    sleep = _original('time').sleep
+    clock = _original('time').monotonic
+    current = _original('threading').get_ident()
+
+    counts: Counter = Counter()
+    rounds = 0
+    names = _thread_names()
+    deadline = clock() + seconds
+    while clock() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+            name = names.get(ident)
+            if name is None:
+                names = _thread_names()
+                name = names.get(ident, f'thread-{ident}')
+            if thread_filter and thread_filter not in name:
+                continue
+            counts[f"{name};{_collapse(frame)}"] += 1
+        rounds += 1
+        sleep(interval)
+    return counts, rounds
+
+
+def format_collapsed(counts: Counter) -> str:
+    """折叠栈格式（每行 "栈 次数"），可直接用 flamegraph.pl / speedscope 打开"""
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class CallProfiler:
+    """在剖析期间用 cProfile 包裹指定的方法调用
+
+    targets 为 [(对象, 方法名)]，安装时以实例属性覆盖方法、结束后恢复。每次调用使用独立的
+    cProfile.Profile，结束后合并；cProfile 按原生线程生效，同一原生线程上同时只剖析一个调用
+    （eventlet 模式下并发的请求共用主线程，只统计其中一个，协程切换期间其他协程的调用也会计入）。
+    """
+
+    def __init__(self, targets: List[Tuple[Any, str]]):
+        self.targets = [(obj, name) for obj, name in targets if obj is not None]
+        self._profiles: List[cProfile.Profile] = []
+        self._active = set()
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _wrap(self, func: Callable) -> Callable:
+        get_ident = _original('threading').get_ident
+
+        def wrapper(*args, **kwargs):
+            ident = get_ident()
+            with self._lock:
+                if ident in self._active:
+                    return func(*args, **kwargs)
+                self._active.add(ident)
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active.discard(ident)
+                    self._profiles.append(profile)
+                    self.calls += 1
+
+        return wrapper
+
+    @contextmanager
+    def installed(self) -> Iterator['CallProfiler']:
+        saved = []
+        for obj, name in self.targets:
+            had_own = name in vars(obj)
+            original = getattr(obj, name)
+            saved.append((obj, name, had_own, original))
+            setattr(obj, name, self._wrap(original))
+        try:
+            yield self
+        finally:
+            for obj, name, had_own, original in reversed(saved):
+                if had_own:
+                    setattr(obj, name, original)
+                else:
+                    delattr(obj, name)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        """合并所有调用的统计，没有调用时返回 None"""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+def format_pstats(stats: pstats.Stats, sort: str = 'cumulative', limit: int = 50) -> str:
+    """pstats 文本报告"""
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort if sort in PSTATS_SORT_KEYS else 'cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+def dump_pstats(stats: pstats.Stats) -> bytes:
+    """pstats 二进制格式（marshal），可用 pstats.Stats(文件) 或 snakeviz 打开"""
+    return marshal.dumps(stats.stats)
+
+
+def dump_threads() -> str:
+    """导出所有原生线程的调用栈；eventlet 模式下同时导出所有挂起协程的调用栈"""
+    names = _thread_names()
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append(f"--- 线程 {names.get(ident, ident)} ({ident}) ---\n")
+        lines.extend(traceback.format_stack(frame))
+        lines.append('\n')
+
+    if server.async_mode() == server.SERVER_MODE_EVENTLET:
+        import greenlet
+        for obj in gc.get_objects():
+            if isinstance(obj, greenlet.greenlet) and obj.gr_frame is not None:
+                lines.append(f"--- 协程 {getattr(obj, '__name__', type(obj).__name__)} ({id(obj):#x}) ---\n")
+                lines.extend(traceback.format_stack(obj.gr_frame))
+                lines.append('\n')
+    return ''.join(lines)
@@ -0,0 +1,52 @@
+"""
+响应缓存
+按缓存键保存序列化后的 JSON 响应体和强 ETag：键不变时不重新生成数据，
+客户端带 If-None-Match 时可直接返回 304
+"""
+
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+import payload
+
+
+def json_etag(body: bytes) -> str:
+    """响应体内容的强 ETag"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """按名称保存最近一次的 (键, 响应体, ETag)
+
+    键应包含响应依赖的全部输入（节点列表指纹、状态字段、查询参数等），
+    任一输入变化即视为失效；不可比较的对象（如编译后的匹配器）按身份比较。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Hashable, bytes, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, key: Hashable, build: Callable[[], Any]) -> Tuple[bytes, str]:
+        """返回 (响应体, ETag)，键变化时调用 build 重新生成"""
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1], entry[2]
+
+        body = payload.dumps(build())
+        etag = json_etag(body)
+        with self._lock:
+            self._entries[name] = (key, body, etag)
+            self.misses += 1
+        return body, etag
+
+    def invalidate(self, name: str = None):
+        """丢弃指定名称（默认全部）的缓存"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
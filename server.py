@@ -0,0 +1,101 @@
+"""
+服务器运行模式
+生产模式（eventlet）使用协程 + monkey patch，所有网络 I/O 都让出事件循环；
+开发模式（threading）使用 Werkzeug 开发服务器
+"""
+
+import logging
+import os
+import signal
+import sys
+from typing import Callable
+
+import blocking
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODE_EVENTLET = 'eventlet'
+SERVER_MODE_THREADING = 'threading'
+SERVER_MODES = (SERVER_MODE_EVENTLET, SERVER_MODE_THREADING)
+
+# 收到 SIGTERM 后执行退出前处理的最长时间(秒)
+EXIT_TIMEOUT = 5
+
+_async_mode = SERVER_MODE_THREADING
+# eventlet 模式下运行服务器的主协程
+_main_greenlet = None
+
+
+def configure(mode: str) -> str:
+    """选择运行模式，返回实际生效的模式
+
+    eventlet 模式会执行 monkey patch，必须在导入 requests、threading 相关模块之前调用；
+    eventlet 不可用时回退到线程模式。
+    """
+    global _async_mode, _main_greenlet
+    mode = (mode or SERVER_MODE_EVENTLET).lower()
+    if mode not in SERVER_MODES:
+        logger.warning(f"未知的 SERVER_MODE: {mode}，使用 {SERVER_MODE_THREADING}")
+        mode = SERVER_MODE_THREADING
+
+    if mode == SERVER_MODE_EVENTLET:
+        try:
+            import eventlet
+            import greenlet
+            eventlet.monkey_patch()
+            _main_greenlet = greenlet.getcurrent()
+        except Exception as e:
+            logger.warning(f"eventlet 不可用，回退到线程模式: {e}")
+            mode = SERVER_MODE_THREADING
+
+    _async_mode = mode
+    blocking.use_native_threads(mode == SERVER_MODE_EVENTLET)
+    return mode
+
+
+def async_mode() -> str:
+    """当前运行模式（Flask-SocketIO 的 async_mode）"""
+    return _async_mode
+
+
+def install_exit_handler(on_exit: Callable[[], None] = None):
+    """SIGTERM 时正常退出以执行 atexit（docker stop）
+
+    线程模式直接抛出 SystemExit。eventlet 模式下信号可能在任意协程（包括正在 poll 的事件循环）
+    中处理，直接抛出无法可靠地结束主协程；而且 WSGI 服务器退出时会等待所有进行中的请求，
+    Socket.IO 的长轮询和 WebSocket 不会自行结束。因此通过 wakeup fd 唤醒一个协程，
+    先执行 on_exit（断开客户端），再在主协程中抛出 SystemExit。
+    """
+    if _async_mode != SERVER_MODE_EVENTLET or _main_greenlet is None:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        return
+
+    import eventlet
+    from eventlet import hubs
+
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    signal.set_wakeup_fd(write_fd)
+    # 实际处理在 _wait_for_exit 中进行；这里只需安装 Python 处理函数使 wakeup fd 生效
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+
+    def _wait_for_exit():
+        while True:
+            hubs.trampoline(read_fd, read=True)
+            try:
+                signums = os.read(read_fd, 64)
+            except BlockingIOError:
+                continue
+            if signal.SIGTERM in signums:
+                break
+        logger.info("收到 SIGTERM，正在退出")
+        if on_exit:
+            try:
+                with eventlet.Timeout(EXIT_TIMEOUT, False):
+                    on_exit()
+            except Exception as e:
+                logger.error(f"退出前处理失败: {e}")
+        _main_greenlet.throw(SystemExit(0))
+
+    eventlet.spawn(_wait_for_exit)
@@ -0,0 +1,302 @@
+"""
+影子策略评估
+在真实探测数据上并行运行备选切换策略，只记录其决策而不执行切换，
+并统计各策略所选节点随后实际表现出的延迟
+"""
+
+import logging
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from models import Config
+
+logger = logging.getLogger(__name__)
+
+# 每个节点最多挂起的待验证决策数
+MAX_PENDING_PER_NODE = 64
+# 报告中保留的最近决策条数
+RECENT_DECISIONS = 20
+
+
+class ShadowPolicy(ABC):
+    """影子策略基类
+
+    decide() 返回策略在本周期结束时希望使用的节点（返回当前节点表示保持不变）。
+    """
+
+    kind = 'base'
+
+    def __init__(self, name: str = None):
+        self.name = name or self.kind
+
+    def observe(self, node: str, delay: Optional[int], timestamp: float):
+        """接收一次探测结果（默认忽略）"""
+
+    def forget(self, nodes: Iterable[str]):
+        """删除节点的状态（默认没有按节点的状态）"""
+
+    @abstractmethod
+    def decide(self, current_node: str, current_delay: Optional[int], candidates: List[str],
+               latest: Dict[str, Tuple[Optional[int], float]], now: float) -> str:
+        """给出本周期希望使用的节点"""
+
+
+def _best_latest(candidates: List[str], latest: Dict[str, Tuple[Optional[int], float]],
+                 max_age: float = None, now: float = None) -> Optional[str]:
+    """按最近一次探测结果挑选延迟最低的候选节点"""
+    best, best_delay = None, None
+    for node in candidates:
+        sample = latest.get(node)
+        if not sample or sample[0] is None:
+            continue
+        if max_age is not None and now - sample[1] > max_age:
+            continue
+        if best_delay is None or sample[0] < best_delay:
+            best, best_delay = node, sample[0]
+    return best
+
+
+class ThresholdPolicy(ShadowPolicy):
+    """阈值策略：与现有逻辑相同，但使用不同的阈值参数"""
+
+    kind = 'threshold'
+
+    def __init__(self, delay_threshold: int = 200, min_delay_for_switch: int = 100, name: str = None):
+        super().__init__(name)
+        self.delay_threshold = delay_threshold
+        self.min_delay_for_switch = min_delay_for_switch
+
+    def decide(self, current_node, current_delay, candidates, latest, now):
+        if current_delay is not None and current_delay <= self.delay_threshold:
+            return current_node
+        if current_delay is not None and current_delay < self.min_delay_for_switch:
+            return current_node
+        return _best_latest(candidates, latest) or current_node
+
+
+class EwmaPolicy(ShadowPolicy):
+    """EWMA 策略：按指数加权平均延迟判断和排序，失败按 penalty 计入"""
+
+    kind = 'ewma'
+
+    def __init__(self, alpha: float = 0.3, threshold: int = 200, penalty: int = 3000, name: str = None):
+        super().__init__(name)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.penalty = penalty
+        self._ewma: Dict[str, float] = {}
+
+    def observe(self, node, delay, timestamp):
+        value = self.penalty if delay is None else delay
+        previous = self._ewma.get(node)
+        self._ewma[node] = value if previous is None else self.alpha * value + (1 - self.alpha) * previous
+
+    def forget(self, nodes):
+        for node in nodes:
+            self._ewma.pop(node, None)
+
+    def decide(self, current_node, current_delay, candidates, latest, now):
+        current_score = self._ewma.get(current_node)
+        if current_score is not None and current_score <= self.threshold:
+            return current_node
+        scored = [(self._ewma[n], n) for n in candidates if n in self._ewma]
+        if not scored:
+            return current_node
+        return min(scored)[1]
+
+
+class RacingPolicy(ShadowPolicy):
+    """竞速策略：只要有新鲜样本比当前节点快 margin 毫秒以上，就选最快的节点"""
+
+    kind = 'racing'
+
+    def __init__(self, margin: int = 50, max_age: float = 300, name: str = None):
+        super().__init__(name)
+        self.margin = margin
+        self.max_age = max_age
+
+    def decide(self, current_node, current_delay, candidates, latest, now):
+        best = _best_latest(candidates, latest, self.max_age, now)
+        if best is None or best == current_node:
+            return current_node
+        if current_delay is None or latest[best][0] + self.margin < current_delay:
+            return best
+        return current_node
+
+
+POLICY_TYPES = {cls.kind: cls for cls in (ThresholdPolicy, EwmaPolicy, RacingPolicy)}
+
+
+def build_policies(spec: str) -> List[ShadowPolicy]:
+    """解析影子策略配置
+
+    格式: kind:key=value,key=value;kind:...
+    例如: threshold:delay_threshold=150;ewma:alpha=0.3,threshold=200;racing:margin=80
+    """
+    policies = []
+    for item in filter(None, (part.strip() for part in (spec or '').split(';'))):
+        kind, _, body = item.partition(':')
+        kind = kind.strip()
+        cls = POLICY_TYPES.get(kind)
+        if cls is None:
+            logger.error(f"未知的影子策略类型: {kind}")
+            continue
+        try:
+            params = {}
+            for pair in filter(None, body.split(',')):
+                key, _, value = pair.partition('=')
+                value = value.strip()
+                params[key.strip()] = float(value) if '.' in value else int(value)
+            policies.append(cls(name=item, **params))
+        except (TypeError, ValueError) as e:
+            logger.error(f"影子策略参数错误 '{item}': {e}")
+    return policies
+
+
+@dataclass
+class _Decision:
+    """一次策略决策及其事后结果"""
+    policy: str
+    node: str
+    timestamp: float
+    switched: bool
+    agrees: bool
+    outcome: Optional[int] = None
+    resolved: bool = False
+
+
+class _PolicyStats:
+    """单个策略的累计统计"""
+
+    def __init__(self):
+        self.decisions = 0
+        self.switches = 0
+        self.agreements = 0
+        self.outcomes = 0
+        self.outcome_sum = 0
+        self.outcome_failures = 0
+        self.recent: Deque[_Decision] = deque(maxlen=RECENT_DECISIONS)
+
+    def to_dict(self) -> Dict:
+        measured = self.outcomes - self.outcome_failures
+        return {
+            'decisions': self.decisions,
+            'switches': self.switches,
+            'agreement_rate': round(self.agreements / self.decisions, 4) if self.decisions else None,
+            'outcomes': self.outcomes,
+            'mean_outcome_delay': round(self.outcome_sum / measured, 1) if measured else None,
+            'outcome_failures': self.outcome_failures,
+            'recent': [
+                {
+                    'node': d.node,
+                    'timestamp': d.timestamp,
+                    'switched': d.switched,
+                    'outcome': d.outcome,
+                    'resolved': d.resolved
+                }
+                for d in self.recent
+            ]
+        }
+
+
+class ShadowEvaluator:
+    """影子策略评估器
+
+    通过 ClashAPI 发布的 ProbeEvent 获取数据，不发起任何额外探测。
+    每个决策所选节点的"事后延迟"取该节点在决策之后的第一次探测结果。
+    """
+
+    ACTIVE = 'active'
+
+    def __init__(self, policies: List[ShadowPolicy], clock: Callable[[], float] = time.time):
+        self.policies = policies
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Tuple[Optional[int], float]] = {}
+        self._pending: Dict[str, Deque[_Decision]] = {}
+        self._stats: Dict[str, _PolicyStats] = {self.ACTIVE: _PolicyStats()}
+        for policy in policies:
+            self._stats[policy.name] = _PolicyStats()
+
+    def observe(self, node: str, delay: Optional[int]):
+        """记录一次探测结果：更新最新样本并结算挂起的决策"""
+        now = self._clock()
+        with self._lock:
+            self._latest[node] = (delay, now)
+            for policy in self.policies:
+                policy.observe(node, delay, now)
+
+            pending = self._pending.get(node)
+            while pending and pending[0].timestamp < now:
+                decision = pending.popleft()
+                decision.outcome = delay
+                decision.resolved = True
+                stats = self._stats[decision.policy]
+                stats.outcomes += 1
+                if delay is None:
+                    stats.outcome_failures += 1
+                else:
+                    stats.outcome_sum += delay
+
+    def forget(self, nodes: Iterable[str]):
+        """删除已消失或内容已变化的节点的样本和策略状态（已记录的决策保留）"""
+        nodes = list(nodes)
+        with self._lock:
+            for node in nodes:
+                self._latest.pop(node, None)
+            for policy in self.policies:
+                policy.forget(nodes)
+
+    def known_nodes(self) -> List[str]:
+        """已有探测样本的节点"""
+        with self._lock:
+            return list(self._latest.keys())
+
+    def evaluate(self, current_node: str, current_delay: Optional[int],
+                 candidates: List[str], active_choice: str):
+        """在一次检测周期结束后让所有影子策略给出决策"""
+        now = self._clock()
+        with self._lock:
+            self._record(self.ACTIVE, active_choice, current_node, active_choice, now)
+            for policy in self.policies:
+                try:
+                    choice = policy.decide(current_node, current_delay, candidates, self._latest, now)
+                except Exception as e:
+                    logger.error(f"影子策略 {policy.name} 决策失败: {e}")
+                    continue
+                self._record(policy.name, choice, current_node, active_choice, now)
+                if choice != active_choice:
+                    logger.debug(f"影子策略 {policy.name} 选择 {choice}，实际策略选择 {active_choice}")
+
+    def _record(self, policy: str, choice: str, current_node: str, active_choice: str, now: float):
+        decision = _Decision(
+            policy=policy,
+            node=choice,
+            timestamp=now,
+            switched=choice != current_node,
+            agrees=choice == active_choice
+        )
+        stats = self._stats[policy]
+        stats.decisions += 1
+        stats.switches += int(decision.switched)
+        stats.agreements += int(decision.agrees)
+        stats.recent.append(decision)
+        self._pending.setdefault(choice, deque(maxlen=MAX_PENDING_PER_NODE)).append(decision)
+
+    def report(self) -> Dict:
+        """生成评估报告"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+
+def create_evaluator(config: Config) -> Optional[ShadowEvaluator]:
+    """按配置创建影子评估器，未配置影子策略时返回 None"""
+    policies = build_policies(config.shadow_policies)
+    if not policies:
+        return None
+    logger.info(f"启用影子策略: {[p.name for p in policies]}")
+    return ShadowEvaluator(policies)
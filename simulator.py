@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+离线轨迹回放模拟器
+使用虚拟时钟，将记录的（或合成的）节点延迟轨迹回放给真实的
+DelayChecker/NodeManager 决策逻辑，用于在上线前比较切换策略
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import random
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from clash_api import ClashAPI, ClashAPIError
+from delay_checker import DelayChecker
+from events import EventBus, ProbeEvent
+from models import Config, RuntimeState
+from node_manager import NodeManager
+from node_stats import NodeStatsTable
+
+logger = logging.getLogger(__name__)
+
+# 模拟时代理组内节点的类型（需能通过 NodeManager.get_available_nodes 的类型过滤）
+SIMULATED_NODE_TYPE = 'Shadowsocks'
+
+
+class VirtualClock:
+    """虚拟时钟"""
+
+    def __init__(self, start: datetime):
+        self._now = start
+
+    def now(self) -> datetime:
+        """当前虚拟时间"""
+        return self._now
+
+    def advance(self, seconds: float):
+        """推进虚拟时间"""
+        self._now += timedelta(seconds=seconds)
+
+
+class LatencyTrace:
+    """节点延迟轨迹
+
+    每个节点保存按时间排序的 (秒偏移, 延迟) 采样点，延迟为 None 表示探测失败。
+    任意时刻的延迟取该时刻之前最近一次采样（阶梯函数）。
+    """
+
+    def __init__(self, start: datetime, samples: Dict[str, List[Tuple[float, Optional[int]]]]):
+        self.start = start
+        self._times: Dict[str, List[float]] = {}
+        self._delays: Dict[str, List[Optional[int]]] = {}
+        for node, points in samples.items():
+            points = sorted(points, key=lambda p: p[0])
+            if not points:
+                continue
+            self._times[node] = [p[0] for p in points]
+            self._delays[node] = [p[1] for p in points]
+
+    @property
+    def nodes(self) -> List[str]:
+        """轨迹中的节点"""
+        return list(self._times.keys())
+
+    @property
+    def duration(self) -> float:
+        """轨迹时长(秒)"""
+        return max((times[-1] for times in self._times.values()), default=0.0)
+
+    def delay_at(self, node: str, offset: float) -> Optional[int]:
+        """查询节点在某一时刻的延迟"""
+        times = self._times.get(node)
+        if not times:
+            return None
+        index = bisect.bisect_right(times, offset) - 1
+        if index < 0:
+            index = 0
+        return self._delays[node][index]
+
+    def time_above(self, node: str, begin: float, end: float, threshold: int) -> float:
+        """统计节点在 [begin, end) 区间内延迟超过阈值（或不可用）的时长(秒)"""
+        times = self._times.get(node)
+        if not times:
+            return end - begin
+
+        delays = self._delays[node]
+        index = max(bisect.bisect_right(times, begin) - 1, 0)
+        total = 0.0
+        cursor = begin
+        while cursor < end:
+            segment_end = times[index + 1] if index + 1 < len(times) else end
+            segment_end = min(max(segment_end, cursor), end)
+            delay = delays[index]
+            if delay is None or delay > threshold:
+                total += segment_end - cursor
+            cursor = segment_end
+            if index + 1 < len(times):
+                index += 1
+        return total
+
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'LatencyTrace':
+        """从延迟记录创建（{node_name, delay, timestamp} 字典，如状态快照中的 delay_history）"""
+        parsed = []
+        for record in records:
+            timestamp = record['timestamp']
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            elif isinstance(timestamp, (int, float)):
+                timestamp = datetime.fromtimestamp(timestamp)
+            parsed.append((record['node_name'], record.get('delay'), timestamp))
+
+        if not parsed:
+            raise ValueError("轨迹为空")
+
+        start = min(p[2] for p in parsed)
+        samples: Dict[str, List[Tuple[float, Optional[int]]]] = {}
+        for node, delay, timestamp in parsed:
+            samples.setdefault(node, []).append(((timestamp - start).total_seconds(), delay))
+        return cls(start, samples)
+
+    @classmethod
+    def load_json(cls, path: str) -> 'LatencyTrace':
+        """从 JSON 文件加载轨迹（记录列表，或包含 delay_history 的状态字典）"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('records') or data.get('delay_history') or []
+        return cls.from_records(data)
+
+    @classmethod
+    def from_store(cls, store, start: float = None, end: float = None) -> 'LatencyTrace':
+        """从延迟时序存储（timeseries.TimeSeriesStore）中读取原始记录"""
+        records = [
+            {'node_name': name, 'delay': delay, 'timestamp': ts}
+            for name, delay, ts in store.iter_probes(start, end)
+        ]
+        return cls.from_records(records)
+
+    @classmethod
+    def synthetic(cls, nodes: int = 20, hours: float = 24, interval: int = 10,
+                  seed: Optional[int] = None) -> 'LatencyTrace':
+        """生成合成轨迹
+
+        每个节点有独立的基础延迟和随机游走抖动，并随机出现持续数分钟的劣化期和丢包。
+        """
+        rng = random.Random(seed)
+        steps = int(hours * 3600 / interval)
+        samples: Dict[str, List[Tuple[float, Optional[int]]]] = {}
+
+        for i in range(nodes):
+            name = f"SIM-{i + 1:02d}"
+            base = rng.uniform(40, 260)
+            drift = 0.0
+            degraded_until = -1
+            degraded_extra = 0.0
+            points = []
+            for step in range(steps):
+                drift = max(-base * 0.5, min(base, drift + rng.gauss(0, base * 0.03)))
+                if step > degraded_until and rng.random() < 0.002:
+                    degraded_until = step + rng.randint(6, 60)
+                    degraded_extra = rng.uniform(150, 800)
+                extra = degraded_extra if step <= degraded_until else 0.0
+                if rng.random() < (0.15 if step <= degraded_until else 0.005):
+                    delay = None
+                else:
+                    delay = max(1, int(base + drift + extra + rng.expovariate(1 / (base * 0.1))))
+                points.append((step * interval, delay))
+            samples[name] = points
+
+        return cls(datetime(2000, 1, 1), samples)
+
+
+class TraceClashAPI(ClashAPI):
+    """按轨迹应答的 Clash API 替身，不产生任何网络请求"""
+
+    def __init__(self, config: Config, trace: LatencyTrace, clock: VirtualClock, initial_node: str = None,
+                 events: EventBus = None):
+        super().__init__(config, events)
+        self.trace = trace
+        self.clock = clock
+        self.current = initial_node or trace.nodes[0]
+        self.probe_count = 0
+        self.failed_probe_count = 0
+        self.switches: List[Tuple[datetime, str, str]] = []
+
+    def _offset(self) -> float:
+        return (self.clock.now() - self.trace.start).total_seconds()
+
+    def _request(self, method: str, endpoint: str, max_retries: int = 3, **kwargs):
+        raise ClashAPIError(f"模拟模式不支持请求: {method} {endpoint}")
+
+    def get_proxies(self, max_age: float = 0) -> Dict:
+        proxies = {name: {'name': name, 'type': SIMULATED_NODE_TYPE} for name in self.trace.nodes}
+        proxies[self.config.proxy_group] = {
+            'name': self.config.proxy_group,
+            'type': 'Selector',
+            'now': self.current,
+            'all': self.trace.nodes
+        }
+        return proxies
+
+    def get_current_proxy(self, group_name: str = 'PROXY') -> Optional[str]:
+        return self.current
+
+    def switch_proxy(self, group_name: str, proxy_name: str) -> bool:
+        if proxy_name not in self.trace.nodes:
+            return False
+        if proxy_name != self.current:
+            self.switches.append((self.clock.now(), self.current, proxy_name))
+        self.current = proxy_name
+        return True
+
+    def _measure_delay(self, proxy_name: str, test_url: str = None, timeout: int = 5000,
+                       max_retries: int = 3) -> Optional[int]:
+        self.probe_count += 1
+        delay = self.trace.delay_at(proxy_name, self._offset())
+        if delay is None or delay > timeout:
+            self.failed_probe_count += 1
+            return None
+        return delay
+
+    def is_available(self, max_retries: int = 3, timeout=None) -> bool:
+        return True
+
+
+@dataclass
+class SimulationResult:
+    """模拟结果"""
+    policy: str
+    overrides: Dict = field(default_factory=dict)
+    simulated_seconds: float = 0.0
+    cycles: int = 0
+    switch_count: int = 0
+    probe_count: int = 0
+    failed_probe_count: int = 0
+    time_above_threshold: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def above_threshold_ratio(self) -> float:
+        """超阈值时长占比"""
+        if not self.simulated_seconds:
+            return 0.0
+        return self.time_above_threshold / self.simulated_seconds
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return {
+            'policy': self.policy,
+            'overrides': self.overrides,
+            'simulated_seconds': self.simulated_seconds,
+            'cycles': self.cycles,
+            'switch_count': self.switch_count,
+            'probe_count': self.probe_count,
+            'failed_probe_count': self.failed_probe_count,
+            'time_above_threshold': round(self.time_above_threshold, 1),
+            'above_threshold_ratio': round(self.above_threshold_ratio, 4),
+            'wall_seconds': round(self.wall_seconds, 3)
+        }
+
+
+@contextmanager
+def _quiet_logging(level: int = logging.WARNING):
+    """模拟期间压低日志级别，避免逐周期日志拖慢回放"""
+    previous = logging.root.manager.disable
+    logging.disable(level)
+    try:
+        yield
+    finally:
+        logging.disable(previous)
+
+
+class Simulator:
+    """切换策略模拟器"""
+
+    def __init__(self, trace: LatencyTrace, config: Config):
+        self.trace = trace
+        self.config = config
+
+    def run(self, policy: str = 'default', overrides: Dict = None,
+            duration: float = None, initial_node: str = None) -> SimulationResult:
+        """以给定的配置覆盖项回放整条轨迹"""
+        overrides = overrides or {}
+        config = replace(self.config, **overrides)
+        state = RuntimeState()
+        clock = VirtualClock(self.trace.start)
+        node_stats = NodeStatsTable(config.predict_window, config.test_timeout,
+                                    clock=lambda: clock.now().timestamp())
+        # 回放是单线程的，节点统计在发布者线程内直接更新，下一步决策即可读到
+        events = EventBus()
+        events.subscribe(ProbeEvent, lambda event: node_stats.observe(event.node, event.delay),
+                         name='node_stats', inline=True)
+        clash_api = TraceClashAPI(config, self.trace, clock, initial_node, events=events)
+        node_manager = NodeManager(clash_api, config, state, clock=lambda: clock.now().timestamp())
+        checker = DelayChecker(clash_api, node_manager, config, state,
+                               clock=clock.now, node_stats=node_stats)
+
+        duration = self.trace.duration if duration is None else duration
+        result = SimulationResult(policy=policy, overrides=overrides)
+        wall_start = time.perf_counter()
+
+        with _quiet_logging():
+            elapsed = 0.0
+            while elapsed < duration:
+                checker._check_and_switch()
+                step = min(config.check_interval, duration - elapsed)
+                result.time_above_threshold += self.trace.time_above(
+                    clash_api.current, elapsed, elapsed + step, config.delay_threshold
+                )
+                clock.advance(step)
+                elapsed += step
+                result.cycles += 1
+
+        result.wall_seconds = time.perf_counter() - wall_start
+        result.simulated_seconds = duration
+        result.switch_count = len(clash_api.switches)
+        result.probe_count = clash_api.probe_count
+        result.failed_probe_count = clash_api.failed_probe_count
+        return result
+
+    def compare(self, policies: Dict[str, Dict], **kwargs) -> List[SimulationResult]:
+        """依次回放多组策略"""
+        return [self.run(name, overrides, **kwargs) for name, overrides in policies.items()]
+
+
+def parse_policy(spec: str) -> Tuple[str, Dict]:
+    """解析策略参数，格式: name:key=value,key=value"""
+    name, _, body = spec.partition(':')
+    overrides = {}
+    fields = Config.__dataclass_fields__
+    for item in filter(None, body.split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in fields:
+            raise ValueError(f"未知配置项: {key}")
+        field_type = fields[key].type
+        if field_type in (bool, 'bool'):
+            overrides[key] = value.strip().lower() == 'true'
+        elif field_type in (int, 'int'):
+            overrides[key] = int(value)
+        elif field_type in (float, 'float'):
+            overrides[key] = float(value)
+        else:
+            overrides[key] = value.strip()
+    return name.strip() or spec, overrides
+
+
+def main(argv: List[str] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='离线回放延迟轨迹，比较切换策略')
+    parser.add_argument('--trace', help='轨迹 JSON 文件（延迟记录列表）')
+    parser.add_argument('--store', help='延迟时序数据库（如 /app/data/history.db），回放其中的原始记录')
+    parser.add_argument('--from', dest='start', type=float, help='回放起始时间(epoch 秒)，配合 --store')
+    parser.add_argument('--to', dest='end', type=float, help='回放结束时间(epoch 秒)，配合 --store')
+    parser.add_argument('--nodes', type=int, default=20, help='合成轨迹的节点数')
+    parser.add_argument('--hours', type=float, default=72, help='合成轨迹时长(小时)')
+    parser.add_argument('--interval', type=int, default=10, help='合成轨迹采样间隔(秒)')
+    parser.add_argument('--seed', type=int, default=1, help='合成轨迹随机种子')
+    parser.add_argument('--policy', action='append', default=[],
+                        help='策略，格式 name:key=value,...（可重复）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        trace = LatencyTrace.load_json(args.trace)
+    elif args.store:
+        from timeseries import TimeSeriesStore
+        trace = LatencyTrace.from_store(TimeSeriesStore(args.store), args.start, args.end)
+    else:
+        trace = LatencyTrace.synthetic(args.nodes, args.hours, args.interval, args.seed)
+
+    base_config = Config(enable_active_detection=False)
+    policies = dict(parse_policy(spec) for spec in args.policy) or {'default': {}}
+    results = Simulator(trace, base_config).compare(policies)
+
+    if args.json:
+        print(json.dumps([r.to_dict() for r in results], ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"轨迹: {len(trace.nodes)} 个节点, {trace.duration / 3600:.1f} 小时")
+    print(f"{'策略':<16}{'切换次数':>10}{'探测次数':>10}{'超阈值占比':>12}{'耗时(s)':>10}")
+    for r in results:
+        print(f"{r.policy:<16}{r.switch_count:>10}{r.probe_count:>10}"
+              f"{r.above_threshold_ratio:>12.2%}{r.wall_seconds:>10.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
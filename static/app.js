@@ -1,6 +1,15 @@
 // WebSocket 连接
 let socket;
 
+// 客户端持有的状态副本（由完整快照和增量补丁维护）
+let clientState = null;
+
+// 保留的延迟历史条数（与服务端快照一致）
+const HISTORY_LIMIT = 20;
+
+// 订阅的推送主题（history 为每次探测的数据点，用于更新节点列表中的延迟）
+const SUBSCRIBED_TOPICS = ['state', 'history', 'probes'];
+
 // 初始化
 document.addEventListener('DOMContentLoaded', function() {
     initWebSocket();
@@ -11,6 +20,10 @@ document.addEventListener('DOMContentLoaded', function() {
     loadBlacklist();
     loadRegions();
     updateStatusIndicator();
+
+    const nodeList = document.getElementById('nodeList');
+    nodeList.addEventListener('scroll', onNodeListScroll, { passive: true });
+    nodeList.addEventListener('click', onNodeListClick);
 });
 
 // 初始化 WebSocket
@@ -19,15 +32,98 @@ function initWebSocket() {
 
     socket.on('connect', function() {
         console.log('已连接到服务器');
+        // 订阅后服务端先发送完整快照，之后只推送增量
+        socket.emit('subscribe', {topics: SUBSCRIBED_TOPICS});
     });
 
     socket.on('disconnect', function() {
         console.log('与服务器断开连接');
     });
 
-    socket.on('state_update', function(state) {
-        updateStateDisplay(state);
+    // 推送消息处理完后回复确认，服务端据此控制发送速度
+    socket.on('state_snapshot', function(state, ack) {
+        applyStateSnapshot(state);
+        if (ack) ack();
+    });
+
+    socket.on('state_delta', function(delta, ack) {
+        applyStateDelta(delta);
+        if (ack) ack();
     });
+
+    socket.on('history_point', function(point, ack) {
+        applyProbeResult(point);
+        if (ack) ack();
+    });
+
+    socket.on('probe_result', function(result, ack) {
+        applyProbeResult(result);
+        if (ack) ack();
+    });
+
+    socket.on('probe_batch_done', function(summary, ack) {
+        if (ack) ack();
+        if (summary.batch_id !== activeBatchId) return;
+        activeBatchId = null;
+        showNotification(`批量测速完成: 成功 ${summary.succeeded}/${summary.total}，耗时 ${summary.elapsed.toFixed(1)}s`,
+            summary.failed ? 'info' : 'success');
+    });
+}
+
+// 应用完整快照
+function applyStateSnapshot(state) {
+    if (clientState && clientState.version > state.version) {
+        return;  // 已有更新的状态
+    }
+    const reconnected = clientState !== null;
+    clientState = state;
+    updateStateDisplay(clientState);
+    setCurrentNode(state.current_node);
+    displayBlacklist(state.blacklist, state.blacklist_rules);
+    if (reconnected) {
+        scheduleNodeReload();  // 断线期间可能错过了节点列表的变化
+    }
+}
+
+// 应用增量补丁
+function applyStateDelta(delta) {
+    if (!clientState || clientState.version < delta.from_version) {
+        // 缺少中间版本，重新订阅获取完整快照
+        socket.emit('subscribe');
+        return;
+    }
+    if (clientState.version >= delta.version) {
+        return;  // 重复或过期的增量
+    }
+
+    Object.assign(clientState, delta.changed);
+
+    if (delta.history.length > 0) {
+        const history = clientState.delay_history;
+        const lastSeq = history.length > 0 ? history[history.length - 1].seq : -1;
+        delta.history.forEach(row => {
+            if (row.seq > lastSeq) {
+                history.push(row);
+            }
+        });
+        clientState.delay_history = history.slice(-HISTORY_LIMIT);
+    }
+
+    clientState.version = delta.version;
+    updateStateDisplay(clientState);
+
+    // 节点列表和黑名单只处理相关字段的变化
+    const changed = delta.changed;
+    if ('current_node' in changed) {
+        setCurrentNode(changed.current_node);
+    }
+    const blacklistChanged = 'blacklist' in changed || 'blacklist_rules' in changed;
+    if (blacklistChanged) {
+        displayBlacklist(clientState.blacklist, clientState.blacklist_rules);
+    }
+    if (blacklistChanged || 'available_nodes' in changed) {
+        scheduleNodeReload();
+    }
 }
 
 // 加载状态
@@ -35,7 +131,7 @@ async function loadState() {
     try {
         const response = await fetch('/api/state');
         const state = await response.json();
-        updateStateDisplay(state);
+        applyStateSnapshot(state);
     } catch (error) {
         console.error('加载状态失败:', error);
         showNotification('加载状态失败', 'error');
@@ -244,50 +340,300 @@ async function updateSmartConfig() {
     }
 }
 
+// 节点列表：一次获取当前筛选条件下的全部节点（列式），按服务端 ETag 缓存在客户端；
+// 只渲染滚动窗口内的行，行元素按节点名复用，延迟和当前节点变化时只更新对应的行
+const NODE_ROW_HEIGHT = 64;  // 行高(px)，含行间距，需与 .node-viewport .node-item 一致
+const NODE_OVERSCAN = 8;  // 窗口上下额外渲染的行数
+const NODE_CACHE_LIMIT = 8;  // 客户端缓存的查询结果数
+
+const nodeView = {
+    names: [],  // 当前筛选结果（服务端排序）
+    delays: new Map(),  // 节点名 -> 最近延迟（null 表示最近一次探测失败）
+    current: null,
+    rows: new Map(),  // 已渲染的行: 节点名 -> 元素
+    viewport: null,
+    url: null,
+    request: 0,
+    frame: null
+};
+// 查询 URL -> {etag, data}，按最近使用排序
+const nodeListCache = new Map();
+let nodeSearchTimer = null;
+let nodeReloadTimer = null;
+
+// 节点列表查询 URL（page_size=0 返回全部匹配的节点）
+function nodeListUrl() {
+    const params = new URLSearchParams({
+        page_size: 0,
+        sort: document.getElementById('nodeSort').value,
+        format: 'columnar'
+    });
+    const regionFilter = document.getElementById('regionFilter').value;
+    if (regionFilter) {
+        params.set('region', regionFilter);
+    }
+    const search = document.getElementById('nodeSearch').value.trim();
+    if (search) {
+        params.set('q', search);
+    }
+    return `/api/nodes?${params}`;
+}
+
+// 带 If-None-Match 请求，304 时直接使用缓存的结果（不再解析和重建列表）
+async function fetchNodeList(url) {
+    const cached = nodeListCache.get(url);
+    const response = await fetch(url, {
+        cache: 'no-store',
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    if (response.status === 304 && cached) {
+        nodeListCache.delete(url);
+        nodeListCache.set(url, cached);
+        return { data: cached.data, fresh: false };
+    }
+
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    nodeListCache.delete(url);
+    if (etag && data.success) {
+        nodeListCache.set(url, { etag, data });
+        while (nodeListCache.size > NODE_CACHE_LIMIT) {
+            nodeListCache.delete(nodeListCache.keys().next().value);
+        }
+    }
+    return { data, fresh: true };
+}
+
 // 加载节点列表
 async function loadNodes() {
-    const nodeListEl = document.getElementById('nodeList');
-    nodeListEl.innerHTML = '<div class="loading"></div>';
+    const container = document.getElementById('nodeList');
+    const url = nodeListUrl();
+    const request = ++nodeView.request;
+    if (nodeView.names.length === 0) {
+        container.innerHTML = '<div class="loading"></div>';
+        nodeView.viewport = null;
+    }
 
     try {
-        const regionFilter = document.getElementById('regionFilter').value;
-        const url = regionFilter
-            ? `/api/nodes?region=${encodeURIComponent(regionFilter)}`
-            : '/api/nodes';
-
-        const response = await fetch(url);
-        const data = await response.json();
-
-        if (data.success) {
-            displayNodes(data.filtered_nodes, data.current_node);
-        } else {
-            nodeListEl.innerHTML = '<p class="text-center">加载失败</p>';
+        const { data, fresh } = await fetchNodeList(url);
+        if (request !== nodeView.request) {
+            return;  // 已有更新的查询
+        }
+        if (!data.success) {
+            showNodeListMessage('加载失败');
+            return;
+        }
+        if (!fresh && url === nodeView.url && nodeView.viewport) {
+            return;  // 未变化，保留当前渲染结果
         }
+        setNodeList(url, data, fresh);
     } catch (error) {
         console.error('加载节点列表失败:', error);
-        nodeListEl.innerHTML = '<p class="text-center">加载失败</p>';
+        if (request === nodeView.request) {
+            showNodeListMessage('加载失败');
+        }
     }
 }
 
-// 显示节点列表
-function displayNodes(nodes, currentNode) {
+// 节点列表变化（可用节点、黑名单）时合并 300ms 内的多次变化后重新验证
+function scheduleNodeReload() {
+    clearTimeout(nodeReloadTimer);
+    nodeReloadTimer = setTimeout(loadNodes, 300);
+}
+
+// 搜索框输入停止 300ms 后重新加载
+function searchNodes() {
+    clearTimeout(nodeSearchTimer);
+    nodeSearchTimer = setTimeout(loadNodes, 300);
+}
+
+function showNodeListMessage(message) {
     const container = document.getElementById('nodeList');
+    container.innerHTML = `<p class="text-center">${message}</p>`;
+    nodeView.names = [];
+    nodeView.rows.clear();
+    nodeView.viewport = null;
+    nodeView.url = null;
+    document.getElementById('nodePagerInfo').textContent = '';
+}
+
+// 使用新的查询结果：更新延迟表，保留仍在结果中的行，只重新定位窗口
+function setNodeList(url, data, fresh) {
+    const names = data.items.name;
+    const delays = data.items.delay;
+    names.forEach((name, i) => {
+        // 缓存的结果可能比推送的延迟旧，只补充缺少的节点
+        if (!fresh && nodeView.delays.has(name)) return;
+        if (delays[i] === null) {
+            nodeView.delays.delete(name);
+        } else {
+            nodeView.delays.set(name, delays[i]);
+        }
+    });
 
-    if (!nodes || nodes.length === 0) {
-        container.innerHTML = '<p class="text-center">暂无可用节点</p>';
+    const container = document.getElementById('nodeList');
+    if (names.length === 0) {
+        showNodeListMessage('暂无可用节点');
         return;
     }
+    if (!nodeView.viewport) {
+        container.innerHTML = '';
+        nodeView.viewport = document.createElement('div');
+        nodeView.viewport.className = 'node-viewport';
+        container.appendChild(nodeView.viewport);
+        nodeView.rows.clear();
+    }
+    if (url !== nodeView.url) {
+        container.scrollTop = 0;
+    }
 
-    container.innerHTML = nodes.map((node, index) => `
-        <div class="node-item" style="animation-delay: ${index * 0.05}s">
-            <div class="node-name ${node === currentNode ? 'current' : ''}">${node}</div>
-            <div class="node-actions">
-                <button class="btn btn-sm btn-primary" onclick="switchNode('${escapeHtml(node)}')">切换</button>
-                <button class="btn btn-sm btn-info" onclick="testNode('${escapeHtml(node)}')">测速</button>
-                <button class="btn btn-sm btn-danger" onclick="addBlacklist('${escapeHtml(node)}')">拉黑</button>
-            </div>
+    nodeView.url = url;
+    nodeView.names = names;
+    // 缓存结果中的当前节点可能已过期，优先使用推送的状态
+    nodeView.current = clientState ? clientState.current_node : data.current_node;
+    nodeView.viewport.style.height = `${names.length * NODE_ROW_HEIGHT}px`;
+    document.getElementById('nodePagerInfo').textContent = `共 ${data.total} 个节点`;
+    nodeView.rows.forEach((row, name) => updateNodeRow(row, name));
+    renderNodeWindow();
+}
+
+// 渲染滚动窗口内的行：复用已有的行元素，移除离开窗口的行
+function renderNodeWindow() {
+    nodeView.frame = null;
+    const container = document.getElementById('nodeList');
+    const viewport = nodeView.viewport;
+    if (!viewport) return;
+
+    const height = container.clientHeight || 450;
+    const first = Math.max(0, Math.floor(container.scrollTop / NODE_ROW_HEIGHT) - NODE_OVERSCAN);
+    const last = Math.min(nodeView.names.length,
+        Math.ceil((container.scrollTop + height) / NODE_ROW_HEIGHT) + NODE_OVERSCAN);
+
+    const visible = new Set();
+    for (let i = first; i < last; i++) {
+        const name = nodeView.names[i];
+        visible.add(name);
+        let row = nodeView.rows.get(name);
+        if (!row) {
+            row = createNodeRow(name);
+            nodeView.rows.set(name, row);
+            viewport.appendChild(row);
+        }
+        if (row.dataset.index !== String(i)) {
+            row.dataset.index = i;
+            row.style.top = `${i * NODE_ROW_HEIGHT}px`;
+        }
+    }
+    nodeView.rows.forEach((row, name) => {
+        if (!visible.has(name)) {
+            row.remove();
+            nodeView.rows.delete(name);
+        }
+    });
+}
+
+// 滚动时每帧最多渲染一次
+function onNodeListScroll() {
+    if (nodeView.frame === null) {
+        nodeView.frame = requestAnimationFrame(renderNodeWindow);
+    }
+}
+
+// 创建节点行（按钮通过事件委托处理）
+function createNodeRow(name) {
+    const row = document.createElement('div');
+    row.className = 'node-item';
+    row.dataset.node = name;
+    row.innerHTML = `
+        <div class="node-name"><span class="node-label"></span> <span class="node-delay"></span></div>
+        <div class="node-actions">
+            <button class="btn btn-sm btn-primary" data-action="switch">切换</button>
+            <button class="btn btn-sm btn-info" data-action="test">测速</button>
+            <button class="btn btn-sm btn-danger" data-action="blacklist">拉黑</button>
         </div>
-    `).join('');
+    `;
+    row.querySelector('.node-label').textContent = name;
+    updateNodeRow(row, name);
+    return row;
+}
+
+// 更新行的当前节点标记和延迟
+function updateNodeRow(row, name) {
+    row.querySelector('.node-name').classList.toggle('current', name === nodeView.current);
+    updateNodeDelay(row, name);
+}
+
+function updateNodeDelay(row, name) {
+    const delay = nodeView.delays.get(name);
+    row.querySelector('.node-delay').innerHTML = delay === null
+        ? '<span class="delay-badge danger">失败</span>'
+        : delayBadge(delay);
+}
+
+// 节点列表按钮
+function onNodeListClick(event) {
+    const button = event.target.closest('button[data-action]');
+    if (!button) return;
+    const name = button.closest('.node-item').dataset.node;
+    const actions = { switch: switchNode, test: testNode, blacklist: addBlacklist };
+    actions[button.dataset.action](name);
+}
+
+// 当前节点变化：只更新新旧两行
+function setCurrentNode(name) {
+    if (name === nodeView.current) return;
+    const previous = nodeView.current;
+    nodeView.current = name;
+    [previous, name].forEach(node => {
+        const row = nodeView.rows.get(node);
+        if (row) updateNodeRow(row, node);
+    });
+}
+
+// 节点延迟标签（null 表示未测试或失败）
+function delayBadge(delay) {
+    if (delay === null || delay === undefined) return '';
+    return `<span class="delay-badge ${getDelayClass(delay).replace('delay-', '')}">${delay} ms</span>`;
+}
+
+// 当前进行中的批量测速
+let activeBatchId = null;
+
+// 批量测试当前筛选条件下的所有节点，结果通过 probe_result 事件逐个推送
+async function testAllNodes() {
+    const body = {
+        region: document.getElementById('regionFilter').value,
+        q: document.getElementById('nodeSearch').value.trim(),
+        sid: socket ? socket.id : undefined
+    };
+
+    try {
+        const response = await fetch('/api/nodes/test/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(body)
+        });
+        const result = await response.json();
+
+        if (result.success) {
+            activeBatchId = result.batch_id;
+            showNotification(`开始批量测速 ${result.total} 个节点...`, 'info');
+        } else {
+            showNotification('批量测速失败: ' + result.error, 'error');
+        }
+    } catch (error) {
+        console.error('批量测速失败:', error);
+        showNotification('批量测速失败', 'error');
+    }
+}
+
+// 记录节点的最新延迟（手动测速结果和 history 主题的探测数据点），只更新已渲染的对应行
+function applyProbeResult(result) {
+    nodeView.delays.set(result.node_name, result.delay);
+    const row = nodeView.rows.get(result.node_name);
+    if (row) updateNodeDelay(row, result.node_name);
 }
 
 // HTML 转义
@@ -314,8 +660,7 @@ async function switchNode(nodeName) {
 
         if (result.success) {
             showNotification(result.message, 'success');
-            loadNodes();
-            loadState();  // 刷新状态
+            loadState();  // 刷新状态（当前节点标记随状态更新）
         } else {
             showNotification('切换失败: ' + result.error, 'error');
         }
@@ -358,30 +703,140 @@ async function loadBlacklist() {
         const data = await response.json();
 
         if (data.success) {
-            displayBlacklist(data.blacklist);
+            displayBlacklist(data.blacklist, data.rules);
         }
     } catch (error) {
         console.error('加载黑名单失败:', error);
     }
 }
 
-// 显示黑名单
-function displayBlacklist(blacklist) {
+// 黑名单规则类型名称
+const RULE_TYPE_LABELS = { exact: '节点', glob: '通配符', regex: '正则', keyword: '关键词' };
+
+// 显示黑名单：条目按节点名 / 规则键复用，只创建、删除或重建变化的条目
+function displayBlacklist(blacklist, rules) {
     const container = document.getElementById('blacklistList');
+    blacklist = blacklist || [];
+    rules = rules || [];
 
-    if (!blacklist || blacklist.length === 0) {
+    if (blacklist.length === 0 && rules.length === 0) {
         container.innerHTML = '<p class="text-center">黑名单为空</p>';
         return;
     }
 
-    container.innerHTML = blacklist.map((node, index) => `
-        <div class="blacklist-item" style="animation-delay: ${index * 0.05}s">
-            <div class="node-name">${node}</div>
-            <div class="node-actions">
-                <button class="btn btn-sm btn-success" onclick="removeBlacklist('${escapeHtml(node)}')">解除</button>
-            </div>
+    const entries = blacklist.map(node => ({
+        key: `node:${node}`,
+        signature: '',
+        label: node,
+        remove: () => removeBlacklist(node)
+    })).concat(rules.map(rule => ({
+        key: `rule:${rule.key}`,
+        signature: rule.expires_at || '',
+        label: `[${RULE_TYPE_LABELS[rule.type] || rule.type}] ${rule.pattern}`,
+        expiresAt: rule.expires_at,
+        remove: () => removeBlacklistRule(rule.key)
+    })));
+
+    const existing = new Map();
+    container.querySelectorAll('.blacklist-item').forEach(item => existing.set(item.dataset.key, item));
+    container.querySelectorAll('.text-center').forEach(item => item.remove());
+
+    entries.forEach(entry => {
+        let item = existing.get(entry.key);
+        if (!item || item.dataset.signature !== entry.signature) {
+            const created = createBlacklistItem(entry);
+            if (item) item.replaceWith(created);
+            item = created;
+        }
+        existing.delete(entry.key);
+        // appendChild 移动已有元素，保持与服务端相同的顺序
+        container.appendChild(item);
+    });
+    existing.forEach(item => item.remove());
+}
+
+function createBlacklistItem(entry) {
+    const item = document.createElement('div');
+    item.className = 'blacklist-item';
+    item.dataset.key = entry.key;
+    item.dataset.signature = entry.signature;
+    item.innerHTML = `
+        <div class="node-name"></div>
+        <div class="node-actions">
+            <button class="btn btn-sm btn-success">解除</button>
         </div>
-    `).join('');
+    `;
+    const name = item.querySelector('.node-name');
+    name.textContent = entry.label;
+    if (entry.expiresAt) {
+        const expires = document.createElement('small');
+        expires.textContent = `（${new Date(entry.expiresAt).toLocaleString()} 到期）`;
+        name.append(' ', expires);
+    }
+    item.querySelector('button').addEventListener('click', entry.remove);
+    return item;
+}
+
+// 添加黑名单规则（或临时条目）
+async function addBlacklistRule() {
+    const input = document.getElementById('blacklistPattern');
+    const pattern = input.value.trim();
+    const ttl = document.getElementById('blacklistTtl').value;
+
+    if (!pattern) {
+        showNotification('请输入节点名或规则', 'error');
+        return;
+    }
+
+    try {
+        const response = await fetch('/api/blacklist', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ pattern: pattern, ttl_minutes: ttl ? Number(ttl) : null })
+        });
+
+        const result = await response.json();
+
+        if (result.success) {
+            showNotification(result.message, 'success');
+            input.value = '';
+            loadBlacklist();
+            loadNodes();
+        } else {
+            showNotification('添加失败: ' + result.error, 'error');
+        }
+    } catch (error) {
+        console.error('添加黑名单规则失败:', error);
+        showNotification('添加黑名单规则失败', 'error');
+    }
+}
+
+// 移除黑名单规则
+async function removeBlacklistRule(ruleKey) {
+    try {
+        const response = await fetch('/api/blacklist', {
+            method: 'DELETE',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ rule: ruleKey })
+        });
+
+        const result = await response.json();
+
+        if (result.success) {
+            showNotification('已从黑名单移除', 'success');
+            loadBlacklist();
+            loadNodes();
+        } else {
+            showNotification('移除失败: ' + result.error, 'error');
+        }
+    } catch (error) {
+        console.error('移除黑名单规则失败:', error);
+        showNotification('移除黑名单规则失败', 'error');
+    }
 }
 
 // 添加黑名单
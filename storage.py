@@ -5,9 +5,15 @@
 
 import json
 import logging
+import os
+import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from blacklist import BlacklistRule, active_rules
 from models import Config, RuntimeState
+from blocking import run_blocking
 
 logger = logging.getLogger(__name__)
 
@@ -16,37 +22,153 @@ DATA_DIR = Path('/app/data')
 CONFIG_FILE = DATA_DIR / 'config.json'
 BLACKLIST_FILE = DATA_DIR / 'blacklist.json'
 
+# 写入合并窗口(秒)：最后一次修改后等待这么久才写盘
+WRITE_DEBOUNCE_SECONDS = 1.0
+# 持续修改时最长推迟写盘的时间(秒)
+WRITE_MAX_DELAY_SECONDS = 5.0
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """原子写入：写临时文件并 fsync，再 rename 覆盖目标文件，最后 fsync 目录
+
+    进程在任何时刻崩溃，目标文件要么是旧内容，要么是完整的新内容。
+    """
+    path = Path(path)
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+    # 确保 rename 本身落盘
+    dir_fd = os.open(str(path.parent), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def atomic_write_json(path: Path, data) -> None:
+    """原子写入 JSON 文件"""
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+class WriteBehind:
+    """延迟合并写入
+
+    submit() 只记录每个文件最新的待写内容并立即返回；后台线程在修改停止 debounce 秒后
+    （或首次修改 max_delay 秒后）统一写盘，同一文件的多次修改只写一次。
+    """
+
+    def __init__(self, debounce: float = WRITE_DEBOUNCE_SECONDS, max_delay: float = WRITE_MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.write_count = 0
+        self._pending: Dict[Path, object] = {}
+        self._first_change = 0.0
+        self._last_change = 0.0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def submit(self, path: Path, data):
+        """提交待写内容（调用方之后不得再修改 data）"""
+        with self._condition:
+            now = time.monotonic()
+            if not self._pending:
+                self._first_change = now
+            self._pending[Path(path)] = data
+            self._last_change = now
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='storage-writer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped and not self._pending:
+                    return
+                # 等待修改停止，但不超过最长推迟时间
+                now = time.monotonic()
+                due = min(self._last_change + self.debounce, self._first_change + self.max_delay)
+                if now < due and not self._stopped:
+                    self._condition.wait(due - now)
+                    continue
+                stopping = self._stopped
+            # 写入失败的内容已放回队列，debounce 后重试；停止时交给 close() 最后再试一次
+            if not self.flush() and stopping:
+                return
+
+    def flush(self) -> bool:
+        """立即写入所有待写内容，全部成功时返回 True"""
+        with self._write_lock:
+            with self._condition:
+                pending, self._pending = self._pending, {}
+            failed: Dict[Path, object] = {}
+            for path, data in pending.items():
+                try:
+                    run_blocking(atomic_write_json, path, data)
+                    self.write_count += 1
+                except Exception as e:
+                    failed[path] = data
+                    logger.error(f"写入 {path.name} 失败: {e}")
+            if failed:
+                self._requeue(failed)
+            return not failed
+
+    def _requeue(self, failed: Dict[Path, object]):
+        """把写入失败的内容放回队列，已有更新的提交时以新内容为准"""
+        with self._condition:
+            now = time.monotonic()
+            if not self._pending:
+                self._first_change = now
+            for path, data in failed.items():
+                self._pending.setdefault(path, data)
+            self._last_change = now
+            self._condition.notify()
+
+    def close(self):
+        """写入剩余内容并停止后台线程"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+
 
 class StorageManager:
-    """数据持久化管理器"""
+    """数据持久化管理器
+
+    保存操作只提交到 WriteBehind，由后台线程合并后原子写盘；退出前需调用 flush()。
+    """
 
     def __init__(self):
         # 确保数据目录存在
         DATA_DIR.mkdir(parents=True, exist_ok=True)
+        self.writer = WriteBehind()
 
     def save_config(self, config: Config) -> bool:
-        """保存配置到文件"""
+        """保存配置到文件（只保存 Config.PERSISTED_FIELDS，部署配置始终以环境变量为准）"""
         try:
-            config_data = {
-                'clash_api_url': config.clash_api_url,
-                'clash_secret': config.clash_secret,
-                'proxy_group': config.proxy_group,
-                'delay_threshold': config.delay_threshold,
-                'check_interval': config.check_interval,
-                'locked_region': config.locked_region,
-                'test_timeout': config.test_timeout,
-                'test_url': config.test_url,
-                # 智能切换配置
-                'silent_period_minutes': config.silent_period_minutes,
-                'min_delay_for_switch': config.min_delay_for_switch,
-                'enable_active_detection': config.enable_active_detection,
-                'active_check_method': config.active_check_method
-            }
+            config_data = config.persisted_dict()
 
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config_data, f, ensure_ascii=False, indent=2)
+            self.writer.submit(CONFIG_FILE, config_data)
 
-            logger.info("配置已保存")
+            logger.info("配置已提交保存")
             return True
         except Exception as e:
             logger.error(f"保存配置失败: {e}")
@@ -68,17 +190,17 @@ class StorageManager:
             logger.error(f"加载配置失败: {e}")
             return None
 
-    def save_blacklist(self, blacklist: set) -> bool:
-        """保存黑名单到文件"""
+    def save_blacklist(self, blacklist: set, rules: Tuple[BlacklistRule, ...] = ()) -> bool:
+        """保存黑名单（精确节点名和规则）到文件"""
         try:
             blacklist_data = {
-                'blacklist': list(blacklist)
+                'blacklist': list(blacklist),
+                'rules': [rule.to_record() for rule in active_rules(rules)]
             }
 
-            with open(BLACKLIST_FILE, 'w', encoding='utf-8') as f:
-                json.dump(blacklist_data, f, ensure_ascii=False, indent=2)
+            self.writer.submit(BLACKLIST_FILE, blacklist_data)
 
-            logger.info(f"黑名单已保存，共 {len(blacklist)} 个节点")
+            logger.info(f"黑名单已提交保存，共 {len(blacklist)} 个节点")
             return True
         except Exception as e:
             logger.error(f"保存黑名单失败: {e}")
@@ -101,17 +223,50 @@ class StorageManager:
             logger.error(f"加载黑名单失败: {e}")
             return set()
 
+    def load_blacklist_rules(self) -> Tuple[BlacklistRule, ...]:
+        """从文件加载黑名单规则（跳过已过期和无效的规则）"""
+        try:
+            if not BLACKLIST_FILE.exists():
+                return ()
+
+            with open(BLACKLIST_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            rules = []
+            for record in data.get('rules', []):
+                try:
+                    rules.append(BlacklistRule.from_record(record))
+                except (KeyError, ValueError) as e:
+                    logger.warning(f"忽略无效的黑名单规则 {record}: {e}")
+            rules = active_rules(rules)
+            logger.info(f"黑名单规则已加载，共 {len(rules)} 条")
+            return rules
+        except Exception as e:
+            logger.error(f"加载黑名单规则失败: {e}")
+            return ()
+
     def save_state(self, state: RuntimeState) -> bool:
         """保存运行时状态（黑名单部分）"""
-        return self.save_blacklist(state.blacklist)
+        return self.save_blacklist(state.blacklist, state.blacklist_rules)
+
+    def flush(self) -> bool:
+        """立即写入所有待保存的数据"""
+        return self.writer.flush()
+
+    def close(self):
+        """写入剩余数据并停止后台写入线程（退出前调用）"""
+        self.writer.close()
 
     def load_state_to_config(self, config: Config) -> Config:
-        """从文件加载配置并应用到 Config 对象"""
+        """从文件加载配置并应用到 Config 对象
+
+        只恢复 Config.PERSISTED_FIELDS，旧版本保存的其他字段被忽略，不覆盖环境变量。
+        """
         config_data = self.load_config()
         if config_data:
-            for key, value in config_data.items():
-                if hasattr(config, key):
-                    setattr(config, key, value)
+            for key in Config.PERSISTED_FIELDS:
+                if key in config_data:
+                    setattr(config, key, config_data[key])
         return config
 
 
@@ -89,10 +89,192 @@ def test_modules():
         print(f"✗ delay_checker: {e}")
         return False
 
+    # 其余模块只检查能否导入
+    for module in ('blacklist', 'history', 'node_stats', 'events', 'payload', 'blocking', 'storage',
+                   'discovery', 'metrics', 'broadcaster', 'response_cache', 'probe_pool', 'probe_log',
+                   'timeseries', 'shadow', 'warmstart', 'profiler', 'server', 'wiring', 'daemon'):
+        try:
+            __import__(module)
+            print(f"✓ {module}")
+        except ImportError as e:
+            print(f"✗ {module}: {e}")
+            return False
+
     print("\n所有模块导入成功!\n")
     return True
 
 
+def check(name, passed):
+    """打印单项检查结果"""
+    print(f"{'✓' if passed else '✗'} {name}")
+    return passed
+
+
+def test_blacklist():
+    """测试黑名单规则匹配"""
+    print("=" * 50)
+    print("测试黑名单规则...")
+    print("=" * 50)
+
+    try:
+        import time
+        from blacklist import BlacklistMatcher, BlacklistRule, RULE_KEYWORD, parse_rule
+        from models import RuntimeState
+
+        def matcher(*texts):
+            return BlacklistMatcher(tuple(parse_rule(text) for text in texts))
+
+        results = [
+            check("精确规则", matcher('香港 01').matches('香港 01') and not matcher('香港 01').matches('香港 012')),
+            check("通配符规则", matcher('glob:*HK*').matches('香港 HK-01')
+                  and matcher('glob:JP-??').matches('JP-01') and not matcher('glob:JP-??').matches('JP-001')),
+            check("关键词规则（不区分大小写）", matcher('kw:iplc').matches('HK IPLC 01')
+                  and parse_rule('倍率', kind=RULE_KEYWORD).kind == RULE_KEYWORD
+                  and not matcher('kw:倍率').matches('美国 01')),
+            check("正则规则", matcher('re:^香港').matches('香港 01') and not matcher('re:^香港').matches('IPLC 香港')),
+            # 行内标志和反向引用只在单条规则内有效，不能与其他规则合并编译
+            check("正则行内标志", matcher('glob:JP*', 'kw:倍率', 're:(?i)hk').matches('香港 hk')
+                  and matcher('glob:JP*', 're:(?i)hk').matches('JP-01')),
+            check("正则反向引用", matcher('re:(a)(b)\\2', 're:(\\d)\\1').matches('节点 11')
+                  and not matcher('re:(a)(b)\\2', 're:(\\d)\\1').matches('节点 12')
+                  and matcher('re:(a)(b)\\2', 're:(\\d)\\1').matches('abb')),
+        ]
+
+        # 临时条目到期后匹配器失效，重新编译后不再命中
+        now = time.time()
+        rules = (BlacklistRule('HK', RULE_KEYWORD, expires_at=now + 10),)
+        compiled = BlacklistMatcher(rules, now)
+        results.append(check("临时条目到期", compiled.matches('HK-01') and not compiled.stale(rules, now + 1)
+                             and compiled.stale(rules, now + 11) and compiled.stale((), now + 1)
+                             and not BlacklistMatcher(rules, now + 11).matches('HK-01')))
+
+        # 匹配结果缓存：规则到期后重新匹配，节点消失后从缓存中移除
+        state = RuntimeState()
+        state.add_blacklist_rule(BlacklistRule('HK', RULE_KEYWORD, expires_at=time.time() + 0.2))
+        hit = state.is_blacklisted('HK-01')
+        cache = state.__dict__['_blacklist_cache'][1]
+        cached = 'HK-01' in cache
+        state.forget_nodes(['HK-01'])
+        results.append(check("节点消失后清除缓存", hit and cached and 'HK-01' not in cache))
+        time.sleep(0.3)
+        results.append(check("规则到期后重新匹配", not state.is_blacklisted('HK-01')))
+
+        print()
+        return all(results)
+    except Exception as e:
+        print(f"✗ 黑名单测试失败: {e}\n")
+        return False
+
+
+def test_node_stats():
+    """测试流式分位数和趋势估计"""
+    print("=" * 50)
+    print("测试节点统计...")
+    print("=" * 50)
+
+    try:
+        import random
+        from node_stats import HoltTrend, P2Quantile
+
+        def estimate(p, samples):
+            estimator = P2Quantile(p)
+            for x in samples:
+                estimator.add(x)
+            return estimator.value()
+
+        samples = list(range(1, 10001))
+        random.Random(1).shuffle(samples)
+        median, p90 = estimate(0.5, samples), estimate(0.9, samples)
+
+        rising = HoltTrend()
+        for t in range(20):
+            rising.add(100 + 10 * t, t)
+        flat = HoltTrend()
+        for t in range(20):
+            flat.add(200, t * 3)
+
+        results = [
+            check("P² 少于 5 个样本", estimate(0.5, []) is None and estimate(0.5, [3, 1, 2]) == 2),
+            check(f"P² 中位数 {median:.0f}", abs(median - 5000) < 100),
+            check(f"P² 90 分位 {p90:.0f}", abs(p90 - 9000) < 100),
+            check(f"Holt 趋势 {rising.trend:.2f} ms/s", abs(rising.trend - 10) < 0.5
+                  and abs(rising.forecast(5) - 340) < 10),
+            check("Holt 平稳序列", abs(flat.trend) < 1e-9 and flat.forecast(60) == 200),
+        ]
+        print()
+        return all(results)
+    except Exception as e:
+        print(f"✗ 节点统计测试失败: {e}\n")
+        return False
+
+
+def test_history():
+    """测试延迟历史环形缓冲区"""
+    print("=" * 50)
+    print("测试延迟历史...")
+    print("=" * 50)
+
+    try:
+        from history import RingBuffer
+
+        buffer = RingBuffer(4)
+        for i in range(6):
+            buffer.append(float(i), 1, i)
+        view = buffer.view()
+        results = [
+            check("写满后覆盖最旧记录", len(buffer) == 4 and buffer.first_seq == 2 and buffer.total == 6),
+            check("按时间顺序读取", [seq for seq, _, _, _ in view] == [2, 3, 4, 5] and view.delays() == [2, 3, 4, 5]),
+            check("跨越末尾的视图分为两段", len(view.segments('delays')) == 2),
+            check("最近 N 条和增量读取", buffer.view(last=2).delays() == [4, 5]
+                  and buffer.view(since_seq=3).delays() == [3, 4, 5]),
+        ]
+        buffer.append(6.0, 1, 6)
+        buffer.append(7.0, 1, 7)
+        results.append(check("跳过视图中已被覆盖的记录", len(view) == 2 and view.delays() == [4, 5]))
+        print()
+        return all(results)
+    except Exception as e:
+        print(f"✗ 延迟历史测试失败: {e}\n")
+        return False
+
+
+def test_proxies_diff():
+    """测试节点列表快照比较"""
+    print("=" * 50)
+    print("测试节点列表变化...")
+    print("=" * 50)
+
+    try:
+        from clash_api import ProxiesSnapshot, proxies_fingerprint, proxy_entry
+
+        def snapshot(proxies):
+            entries = {name: proxy_entry(info) for name, info in proxies.items()}
+            return ProxiesSnapshot(proxies, proxies_fingerprint(proxies, entries), 0.0, entries)
+
+        old = snapshot({
+            'A': {'type': 'Shadowsocks', 'history': [{'delay': 100}]},
+            'B': {'type': 'Vmess', 'history': []},
+            'PROXY': {'type': 'Selector', 'now': 'A', 'all': ['A', 'B']}
+        })
+        new = snapshot({
+            'A': {'type': 'Shadowsocks', 'history': [{'delay': 120}]},
+            'C': {'type': 'Trojan', 'history': []},
+            'PROXY': {'type': 'Selector', 'now': 'C', 'all': ['A', 'C']}
+        })
+        diff = new.diff(old)
+        results = [
+            check("新增、消失和变化的条目", diff.added == ('C',) and diff.removed == ('B',)
+                  and diff.changed == ('PROXY',)),
+            check("忽略测速历史的变化", 'A' not in diff.changed),
+            check("内容相同时无变化", not snapshot(dict(old.proxies)).diff(old)),
+        ]
+        print()
+        return all(results)
+    except Exception as e:
+        print(f"✗ 节点列表变化测试失败: {e}\n")
+        return False
+
+
 def test_config():
     """测试配置加载"""
     print("=" * 50)
@@ -162,6 +344,12 @@ def main():
     # 测试模块导入
     results.append(("模块导入", test_modules()))
 
+    # 测试黑名单、统计、历史和节点列表比较
+    results.append(("黑名单规则", test_blacklist()))
+    results.append(("节点统计", test_node_stats()))
+    results.append(("延迟历史", test_history()))
+    results.append(("节点列表变化", test_proxies_diff()))
+
     # 测试配置加载
     results.append(("配置加载", test_config()))
 
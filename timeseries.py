@@ -0,0 +1,301 @@
+"""
+长期延迟时序存储
+基于 SQLite（WAL 模式）保存每一次探测结果，后台批量写入，
+并自动维护 1 分钟和 1 小时汇总及各自的保留期限
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from blocking import run_blocking
+from storage import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB_FILE = DATA_DIR / 'history.db'
+
+# 汇总表及其时间粒度(秒)
+ROLLUP_TABLES = (('rollup_1m', 60), ('rollup_1h', 3600))
+
+# 保留期清理的执行间隔(秒)
+RETENTION_INTERVAL = 3600
+# 写入失败时缓冲区最多保留的记录数，超出时丢弃最旧的记录
+MAX_BUFFERED_ROWS = 100000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS probes (
+    ts REAL NOT NULL,
+    node_id INTEGER NOT NULL,
+    delay INTEGER              -- NULL 表示探测失败
+);
+CREATE INDEX IF NOT EXISTS idx_probes_node_ts ON probes (node_id, ts);
+CREATE INDEX IF NOT EXISTS idx_probes_ts ON probes (ts);
+"""
+
+_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    node_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,   -- 桶起始时间(epoch 秒)
+    count INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    sum_delay INTEGER NOT NULL,
+    min_delay INTEGER,
+    max_delay INTEGER,
+    PRIMARY KEY (node_id, bucket)
+) WITHOUT ROWID;
+"""
+
+_ROLLUP_UPSERT = """
+INSERT INTO {table} (node_id, bucket, count, failures, sum_delay, min_delay, max_delay)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (node_id, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    failures = failures + excluded.failures,
+    sum_delay = sum_delay + excluded.sum_delay,
+    min_delay = CASE WHEN min_delay IS NULL THEN excluded.min_delay
+                     WHEN excluded.min_delay IS NULL THEN min_delay
+                     ELSE min(min_delay, excluded.min_delay) END,
+    max_delay = CASE WHEN max_delay IS NULL THEN excluded.max_delay
+                     WHEN excluded.max_delay IS NULL THEN max_delay
+                     ELSE max(max_delay, excluded.max_delay) END
+"""
+
+
+class TimeSeriesStore:
+    """延迟时序存储
+
+    record() 只把探测结果放入内存缓冲区，由后台线程按 flush_interval 或 batch_size 批量提交。
+    """
+
+    def __init__(self, path: Path = HISTORY_DB_FILE, flush_interval: float = 5.0, batch_size: int = 500,
+                 raw_retention_days: int = 2, minute_retention_days: int = 14, hour_retention_days: int = 365):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention = {
+            'probes': raw_retention_days * 86400,
+            'rollup_1m': minute_retention_days * 86400,
+            'rollup_1h': hour_retention_days * 86400
+        }
+
+        self._buffer: List[Tuple[float, str, Optional[int]]] = []
+        self._buffer_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._node_ids: Dict[str, int] = {}
+        self._last_retention = 0.0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            for table, _ in ROLLUP_TABLES:
+                conn.executescript(_ROLLUP_SCHEMA.format(table=table))
+
+    @contextmanager
+    def _connect(self):
+        """打开连接，正常退出时提交事务，最后关闭连接"""
+        conn = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------- 写入 ----------
+
+    def record(self, node_name: str, delay: Optional[int], timestamp: float = None):
+        """记录一次探测结果（由 ProbeEvent 订阅者调用）"""
+        with self._buffer_lock:
+            self._buffer.append((timestamp or time.time(), node_name, delay))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._writer_loop, name='timeseries-writer', daemon=True)
+        self._thread.start()
+        logger.info(f"延迟时序存储已启动: {self.path}")
+
+    def stop(self):
+        """停止后台线程并写入剩余数据"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def _writer_loop(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_retention > RETENTION_INTERVAL:
+                    self.apply_retention()
+            except Exception as e:
+                logger.error(f"写入延迟时序数据失败: {e}")
+
+    def flush(self) -> int:
+        """把缓冲区中的记录写入数据库，返回写入条数"""
+        with self._buffer_lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+
+        try:
+            run_blocking(self._write_batch, batch)
+        except Exception:
+            # 写入失败的记录放回缓冲区，下次重试
+            with self._buffer_lock:
+                self._buffer = batch + self._buffer
+                dropped = len(self._buffer) - MAX_BUFFERED_ROWS
+                if dropped > 0:
+                    del self._buffer[:dropped]
+            if dropped > 0:
+                logger.warning(f"延迟时序缓冲区已满，丢弃 {dropped} 条最旧的记录")
+            raise
+        logger.debug(f"写入 {len(batch)} 条延迟记录")
+        return len(batch)
+
+    def _write_batch(self, batch: List[Tuple[float, str, Optional[int]]]):
+        # 本次事务中新分配的节点 ID，提交成功后才加入缓存（回滚后这些 ID 可能被其他节点重用）
+        new_ids: Dict[str, int] = {}
+        with self._connect() as conn:
+            rows = [(ts, self._node_id(conn, name, new_ids), delay) for ts, name, delay in batch]
+            conn.executemany('INSERT INTO probes (ts, node_id, delay) VALUES (?, ?, ?)', rows)
+            for table, width in ROLLUP_TABLES:
+                conn.executemany(_ROLLUP_UPSERT.format(table=table), _aggregate(rows, width))
+        self._node_ids.update(new_ids)
+
+    def _node_id(self, conn: sqlite3.Connection, name: str, new_ids: Dict[str, int]) -> int:
+        node_id = self._node_ids.get(name) or new_ids.get(name)
+        if node_id is None:
+            conn.execute('INSERT OR IGNORE INTO nodes (name) VALUES (?)', (name,))
+            node_id = conn.execute('SELECT id FROM nodes WHERE name = ?', (name,)).fetchone()[0]
+            new_ids[name] = node_id
+        return node_id
+
+    def apply_retention(self, now: float = None):
+        """删除超过保留期限的原始记录和汇总"""
+        now = now or time.time()
+        run_blocking(self._delete_expired, now)
+        self._last_retention = now
+
+    def _delete_expired(self, now: float):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM probes WHERE ts < ?', (now - self.retention['probes'],))
+            for table, _ in ROLLUP_TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE bucket < ?', (int(now - self.retention[table]),))
+
+    # ---------- 查询 ----------
+
+    def nodes(self) -> List[str]:
+        """有记录的节点名列表"""
+        return run_blocking(self._query_nodes)
+
+    def _query_nodes(self) -> List[str]:
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute('SELECT name FROM nodes ORDER BY name')]
+
+    def query(self, node_name: str, start: float, end: float, step: int = 0) -> List[Dict]:
+        """查询节点在 [start, end) 内的延迟
+
+        step 为 0 时返回原始记录；否则按 step 秒聚合，step 为 60/3600 的整数倍时直接读汇总表。
+        """
+        return run_blocking(self._query, node_name, start, end, step)
+
+    def _query(self, node_name: str, start: float, end: float, step: int) -> List[Dict]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT id FROM nodes WHERE name = ?', (node_name,)).fetchone()
+            if row is None:
+                return []
+            node_id = row[0]
+
+            if step <= 0:
+                cursor = conn.execute(
+                    'SELECT ts, delay FROM probes WHERE node_id = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                    (node_id, start, end)
+                )
+                return [{'t': ts, 'delay': delay} for ts, delay in cursor]
+
+            step = int(step)
+            table = None
+            for candidate, width in reversed(ROLLUP_TABLES):
+                if step % width == 0:
+                    table = candidate
+                    break
+
+            if table:
+                cursor = conn.execute(
+                    f'SELECT (bucket / ?) * ? AS t, SUM(count), SUM(failures), SUM(sum_delay), '
+                    f'MIN(min_delay), MAX(max_delay) FROM {table} '
+                    f'WHERE node_id = ? AND bucket >= ? AND bucket < ? GROUP BY t ORDER BY t',
+                    (step, step, node_id, int(start), int(end))
+                )
+            else:
+                cursor = conn.execute(
+                    'SELECT CAST(ts / ? AS INTEGER) * ? AS t, COUNT(*), SUM(delay IS NULL), '
+                    'COALESCE(SUM(delay), 0), MIN(delay), MAX(delay) FROM probes '
+                    'WHERE node_id = ? AND ts >= ? AND ts < ? GROUP BY t ORDER BY t',
+                    (step, step, node_id, start, end)
+                )
+
+            result = []
+            for t, count, failures, total, min_delay, max_delay in cursor:
+                succeeded = count - failures
+                result.append({
+                    't': t,
+                    'count': count,
+                    'failures': failures,
+                    'avg': round(total / succeeded, 1) if succeeded else None,
+                    'min': min_delay,
+                    'max': max_delay
+                })
+            return result
+
+    def iter_probes(self, start: float = None, end: float = None) -> Iterable[Tuple[str, Optional[int], float]]:
+        """按时间顺序遍历原始记录 (节点名, 延迟, 时间戳)"""
+        start = 0 if start is None else start
+        end = float('inf') if end is None else end
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'SELECT nodes.name, probes.delay, probes.ts FROM probes JOIN nodes ON nodes.id = probes.node_id '
+                'WHERE probes.ts >= ? AND probes.ts < ? ORDER BY probes.ts',
+                (start, end)
+            )
+            yield from cursor
+
+
+def _aggregate(rows: List[Tuple[float, int, Optional[int]]], width: int) -> List[Tuple]:
+    """把一批原始记录聚合为汇总表的增量行"""
+    buckets: Dict[Tuple[int, int], List] = {}
+    for ts, node_id, delay in rows:
+        key = (node_id, int(ts) // width * width)
+        entry = buckets.get(key)
+        if entry is None:
+            entry = buckets[key] = [0, 0, 0, None, None]
+        entry[0] += 1
+        if delay is None:
+            entry[1] += 1
+            continue
+        entry[2] += delay
+        entry[3] = delay if entry[3] is None else min(entry[3], delay)
+        entry[4] = delay if entry[4] is None else max(entry[4], delay)
+    return [(node_id, bucket, *entry) for (node_id, bucket), entry in buckets.items()]
@@ -0,0 +1,142 @@
+"""
+热启动快照
+定期（以及退出时）把节点统计、最近排名、备用节点和区域索引保存到紧凑的快照文件，
+重启后校验时效再恢复，服务启动即可利用之前积累的节点质量信息
+"""
+
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from models import Config
+from node_manager import NodeManager
+from node_stats import NodeStatsTable
+from blocking import run_blocking
+from storage import DATA_DIR, atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+WARM_START_FILE = DATA_DIR / 'warm_start.json'
+SNAPSHOT_VERSION = 1
+
+# 定期保存间隔(秒)
+SAVE_INTERVAL = 60
+
+
+class WarmStart:
+    """热启动快照的保存与恢复"""
+
+    def __init__(self, config: Config, node_manager: NodeManager, node_stats: Optional[NodeStatsTable],
+                 path: Path = WARM_START_FILE, interval: float = SAVE_INTERVAL,
+                 clock: Callable[[], float] = time.time):
+        self.config = config
+        self.node_manager = node_manager
+        self.node_stats = node_stats
+        self.path = Path(path)
+        self.interval = interval
+        self._clock = clock
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def capture(self) -> Dict:
+        """生成快照内容"""
+        node_manager = self.node_manager
+        return {
+            'version': SNAPSHOT_VERSION,
+            'saved_at': self._clock(),
+            'clash_api_url': self.config.clash_api_url,
+            'proxy_group': self.config.proxy_group,
+            'node_stats': self.node_stats.export_state() if self.node_stats else {},
+            'ranking': [[node, value] for node, value in node_manager.last_ranking],
+            'ranked_at': node_manager.ranked_at,
+            'standby': node_manager.standby_candidates(),
+            'region_index': node_manager.region_index
+        }
+
+    def save(self) -> bool:
+        """保存快照（原子写入）"""
+        try:
+            data = json.dumps(self.capture(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            run_blocking(atomic_write_bytes, self.path, data)
+            logger.debug(f"热启动快照已保存: {len(data)} 字节")
+            return True
+        except Exception as e:
+            logger.error(f"保存热启动快照失败: {e}")
+            return False
+
+    def load(self) -> bool:
+        """加载并应用快照，快照不存在、过期或不属于当前 Controller 时返回 False"""
+        if not self.path.exists():
+            logger.info("没有热启动快照，冷启动")
+            return False
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取热启动快照失败: {e}")
+            return False
+
+        if data.get('version') != SNAPSHOT_VERSION:
+            logger.info("热启动快照版本不匹配，忽略")
+            return False
+
+        max_age = self.config.warm_start_max_age_minutes * 60
+        age = self._clock() - data.get('saved_at', 0)
+        if age > max_age:
+            logger.info(f"热启动快照已过期（{age / 60:.0f} 分钟前保存），忽略")
+            return False
+
+        if (data.get('clash_api_url') != self.config.clash_api_url
+                or data.get('proxy_group') != self.config.proxy_group):
+            logger.info("热启动快照来自不同的 Clash Controller 或代理组，忽略")
+            return False
+
+        # 只恢复当前仍然存在的节点
+        nodes = self.node_manager.get_available_nodes()
+        if not nodes:
+            logger.warning("无法获取节点列表，跳过热启动快照")
+            return False
+        current = set(nodes)
+
+        restored_stats = 0
+        if self.node_stats and data.get('node_stats'):
+            restored_stats = self.node_stats.load_state(data['node_stats'], max_age=max_age, nodes=nodes)
+
+        ranking = [(node, value) for node, value in data.get('ranking', []) if node in current]
+        if ranking and data.get('ranked_at'):
+            self.node_manager.restore_ranking(ranking, data['ranked_at'])
+
+        self.node_manager.region_index = {
+            region: [node for node in members if node in current]
+            for region, members in data.get('region_index', {}).items()
+            if any(node in current for node in members)
+        }
+
+        logger.info(f"热启动: 恢复 {restored_stats} 个节点的统计、{len(ranking)} 个节点的排名"
+                    f"（{age:.0f} 秒前保存），备用节点: {self.node_manager.standby_candidates()}")
+        return True
+
+    def start(self):
+        """启动定期保存线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='warm-start', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.save()
+
+    def stop(self):
+        """停止定期保存并写入最终快照"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.save()
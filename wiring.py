@@ -0,0 +1,82 @@
+"""
+组件装配
+Web 界面（app.py）和无界面守护进程（daemon.py）在 Clash Controller 可用后共用的装配步骤：
+创建节点管理器、延迟检测器和影子策略评估器，获取初始状态，恢复热启动数据并订阅影子评估事件
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from clash_api import ClashAPI
+from delay_checker import DelayChecker
+from events import EventBus, NodesChangedEvent, ProbeEvent
+from models import Config, RuntimeState
+from node_manager import NodeManager
+from node_stats import NodeStatsTable
+from shadow import ShadowEvaluator, create_evaluator
+from warmstart import WarmStart
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ControllerComponents:
+    """Controller 可用后创建的组件"""
+    node_manager: NodeManager
+    delay_checker: DelayChecker
+    shadow_evaluator: Optional[ShadowEvaluator]
+    warm_start: Optional[WarmStart]
+
+
+def attach_controller(clash_api: ClashAPI, config: Config, state: RuntimeState,
+                      node_stats: NodeStatsTable, event_bus: EventBus,
+                      warm_start: Optional[WarmStart] = None) -> ControllerComponents:
+    """创建依赖 Controller 的组件并获取初始状态（不启动延迟检测）
+
+    组件全部创建完成后才订阅事件、启动后台任务：创建失败时关闭已创建的组件（取消其订阅）后
+    重新抛出异常，发现线程重试时不会留下重复的订阅者和后台任务。
+    warm_start 为上次装配的热启动任务，启用热启动时先停止它再创建新的。
+    """
+    manager = checker = None
+    try:
+        manager = NodeManager(clash_api, config, state, events=event_bus)
+
+        # 获取初始状态
+        current_node = clash_api.get_current_proxy(config.proxy_group)
+        available_nodes = manager.get_available_nodes()
+
+        # 创建影子策略评估器（未配置时为 None）
+        evaluator = create_evaluator(config)
+        # 创建延迟检测器
+        checker = DelayChecker(clash_api, manager, config, state,
+                               shadow_evaluator=evaluator,
+                               node_stats=node_stats,
+                               events=event_bus)
+    except Exception:
+        for component in (checker, manager):
+            if component:
+                component.close()
+        raise
+
+    if current_node:
+        state.current_node = current_node
+    state.available_nodes = available_nodes
+
+    # 热启动：恢复上次保存的节点统计和排名，并定期保存
+    if config.enable_warm_start:
+        if warm_start:
+            warm_start.stop()
+        warm_start = WarmStart(config, manager, node_stats)
+        warm_start.load()
+        warm_start.start()
+
+    if evaluator:
+        # 与节点统计相同，检测周期随后的影子评估要读到本次结果
+        event_bus.subscribe(ProbeEvent, lambda event: evaluator.observe(event.node, event.delay),
+                            name='shadow', inline=True)
+        event_bus.subscribe(NodesChangedEvent, lambda event: evaluator.forget(event.removed + event.changed),
+                            name='shadow.churn', inline=True)
+
+    return ControllerComponents(node_manager=manager, delay_checker=checker,
+                                shadow_evaluator=evaluator, warm_start=warm_start)